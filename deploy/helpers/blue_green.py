@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+import http.client
+import os
+import re
+import sys
+import tempfile
+import time
+from threading import Event, Thread
+
+from helpers.cli import CLI
+from helpers.readiness import Readiness, ReadinessTimeout
+
+
+class DowntimeMonitor:
+    """
+    Send requests to a service in a loop, in the background, to measure how
+    long it does not answer.
+    """
+
+    # Seconds between two requests
+    INTERVAL = 0.1
+
+    def __init__(self, probe):
+        """
+        Args:
+            probe (callable): called without arguments, returns whether the
+                service answered
+        """
+        self.requests = 0
+        self.failures = 0
+        self.downtime = 0
+        self.__probe = probe
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__run, daemon=True)
+
+    def __enter__(self):
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self):
+        failing_since = None
+        while not self.__stop.is_set():
+            sent = time.time()
+            answered = self.__probe()
+            self.requests += 1
+            if not answered:
+                self.failures += 1
+                if failing_since is None:
+                    failing_since = sent
+            elif failing_since is not None:
+                self.downtime += sent - failing_since
+                failing_since = None
+            self.__stop.wait(self.INTERVAL)
+
+        if failing_since is not None:
+            self.downtime += time.time() - failing_since
+
+
+class BlueGreen:
+    """
+    Update `support-api` without downtime. Two services, blue and green,
+    take turns behind `support-api-proxy` (nginx): the idle one is started
+    with the new definition, checked through the alternate port of the
+    proxy, then receives traffic, and only then is the previous one removed.
+
+    Which color receives traffic is stored in the upstream file of the
+    proxy, so it survives restarts. The proxy reloads it on `SIGHUP`:
+    requests already sent to the previous color are not interrupted.
+    Upstreams themselves are rendered (`nginx/support-api.conf`): each color
+    may run several replicas, which the proxy finds through Docker DNS.
+    """
+
+    SERVICES = {
+        'blue': 'support-api',
+        'green': 'support-api-green',
+    }
+    PROXY_SERVICE = 'support-api-proxy'
+
+    UPSTREAM_DIRECTORY = 'nginx-upstream'
+    UPSTREAM_FILE = 'support-api.conf'
+    COLOR_PATTERN = re.compile(r'^\s*default\s+(\w+);', re.MULTILINE)
+
+    PROBE_HOST = '127.0.0.1'
+    # Seconds given to requests sent to the previous color before it is
+    # stopped
+    DRAIN_DELAY = 5
+
+    def __init__(self, config):
+        """
+        Args:
+            config (helpers.config.Config)
+        """
+        dict_ = config.get_dict()
+        self.__path = os.path.join(dict_['support_api_path'],
+                                   self.UPSTREAM_DIRECTORY,
+                                   self.UPSTREAM_FILE)
+        self.__port = int(dict_['support_api_port'])
+        self.__alternate_port = int(
+            config.get_value('support_api_alternate_port'))
+        self.__timeout = int(config.get_value('readiness_timeout'))
+        self.__rolling_update = config.rolling_update
+
+    @property
+    def active(self):
+        """
+        Returns:
+            str: color which receives traffic, blue by default and without
+            blue/green updates
+        """
+        if not self.__rolling_update:
+            return 'blue'
+        try:
+            with open(self.__path, 'r') as f:
+                match = self.COLOR_PATTERN.search(f.read())
+        except IOError:
+            match = None
+        if match is None or match.group(1) not in self.SERVICES:
+            return 'blue'
+        return match.group(1)
+
+    def get_services(self):
+        """
+        Returns:
+            list: services which run outside updates. The API comes first:
+            when the proxy is added, the API must release its port first.
+        """
+        return [self.SERVICES[self.active], self.PROXY_SERVICE]
+
+    def update(self, up, remove, reload, prefix=None):
+        """
+        Replace the active color with the idle one.
+
+        Args:
+            up (callable): (re)creates the service it receives, without its
+                dependencies
+            remove (callable): stops and removes the service it receives
+            reload (callable): makes the proxy reload its configuration
+            prefix (str): printed at the beginning of each output line
+
+        Returns:
+            DowntimeMonitor: requests sent to the API during the update
+
+        Raises:
+            ReadinessTimeout: the new color did not answer in time, or the
+                proxy did not switch to it. Traffic is left to the previous
+                color.
+        """
+        previous = self.active
+        color = next(color_ for color_ in self.SERVICES if color_ != previous)
+        readiness = Readiness(self.__timeout)
+
+        with DowntimeMonitor(lambda: Readiness.probe_http(
+                self.PROBE_HOST, self.__port)) as monitor:
+            up(self.SERVICES[color])
+            self.write_upstream(previous, color)
+            reload()
+            try:
+                readiness.wait(self.SERVICES[color],
+                               lambda: Readiness.probe_http(
+                                   self.PROBE_HOST, self.__alternate_port))
+
+                CLI.print_line('Switching traffic to {}'.format(color),
+                               prefix)
+                self.write_upstream(color)
+                reload()
+                # Until the proxy has reloaded, the previous color still
+                # receives traffic and must be kept. nginx keeps its
+                # previous configuration if it rejects the new one.
+                readiness.wait(self.PROXY_SERVICE,
+                               lambda: self.__get_proxy_color() == color)
+            except ReadinessTimeout:
+                CLI.print_line('Rolling back to {}'.format(previous), prefix,
+                               error=True)
+                self.write_upstream(previous)
+                reload()
+                remove(self.SERVICES[color])
+                raise
+
+            time.sleep(self.DRAIN_DELAY)
+            remove(self.SERVICES[previous])
+
+        return monitor
+
+    def write_upstream(self, active=None, standby=None):
+        """
+        Select the upstreams of the proxy. It must be reloaded to use them.
+
+        Args:
+            active (str): color which receives traffic, the current one
+                when `None`
+            standby (str): idle color reachable through the alternate port,
+                if any
+
+        Returns:
+            bool: whether the selection changed
+        """
+        active = active or self.active
+        content = '\n'.join([
+            '# Written by `run.py`, see `helpers/blue_green.py`',
+            'map $host $support_api_color {',
+            '    default {};'.format(active),
+            '}',
+            '',
+            '# `none` outside updates',
+            'map $host $support_api_standby {',
+            '    default {};'.format(standby or 'none'),
+            '}',
+            '',
+        ])
+
+        try:
+            with open(self.__path, 'r') as f:
+                if f.read() == content:
+                    return False
+        except IOError:
+            pass
+
+        directory = os.path.dirname(self.__path)
+        tmp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # Replaced atomically: the proxy must never read half a file
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upstream.')
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.__path)
+        except (IOError, OSError) as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            CLI.colored_print('Could not write {}: {}'.format(self.__path, e),
+                              CLI.COLOR_ERROR)
+            sys.exit(1)
+        return True
+
+    def __get_proxy_color(self):
+        """
+        Returns:
+            str: color the proxy sends traffic to, `None` if it does not
+            answer
+        """
+        connection = http.client.HTTPConnection(
+            self.PROBE_HOST, self.__alternate_port,
+            timeout=Readiness.ATTEMPT_TIMEOUT)
+        try:
+            connection.request('GET', '/-/color')
+            response = connection.getresponse()
+            if response.status != 200:
+                return None
+            return response.read().decode().strip()
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            connection.close()
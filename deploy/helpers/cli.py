@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
+import os
+import re
+import selectors
+import signal
 import subprocess
 import sys
-import re
 import textwrap
+import threading
+import time
+from collections import namedtuple
+
+
+CommandResult = namedtuple('CommandResult', ['command', 'returncode',
+                                             'duration', 'stdout',
+                                             'timed_out'])
 
 
 class CLI:
@@ -17,6 +28,12 @@ class CLI:
 
     EMPTY_CHARACTER = '-'
 
+    # Commands may run in several threads, do not mix their output lines
+    OUTPUT_LOCK = threading.Lock()
+
+    # Seconds given to killed commands to exit and close their output
+    KILL_TIMEOUT = 5
+
     DEFAULT_CHOICES = {
         '1': True,
         '2': False,
@@ -135,29 +152,194 @@ class CLI:
         return '{}{}'.format(message, default)
 
     @classmethod
-    def run_command(cls, command, cwd=None, polling=False):
+    def run_command(cls, command, cwd=None, polling=False, timeout=None,
+                    prefix=None):
+        """
+        Run `command` and wait for it to complete.
+
+        Args:
+            command (list)
+            cwd (str)
+            polling (bool): stream stdout instead of returning it
+            timeout (float): seconds before the command is killed
+            prefix (str): printed at the beginning of each output line
+
+        Returns:
+            int|str: exit code if `polling` is `True`, stdout otherwise.
+            Exits on failure if `polling` is `False`.
+        """
+        result = cls.run_commands([command],
+                                  cwd=cwd,
+                                  timeout=timeout,
+                                  prefixes=[prefix],
+                                  capture=not polling)[0]
         if polling:
-            process = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=cwd)
-            while True:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
+            return result.returncode
+
+        if result.returncode != 0:
+            # stderr has already been displayed, but stdout was captured.
+            sys.stderr.write(result.stdout)
+            if result.timed_out:
+                cls.colored_print('Command timed out after {}s: {}'.format(
+                    timeout, ' '.join(command)), CLI.COLOR_ERROR)
+            cls.colored_print('An error has occurred', CLI.COLOR_ERROR)
+            sys.exit(1)
+        return result.stdout
+
+    @classmethod
+    def run_commands(cls, commands, cwd=None, timeout=None, prefixes=None,
+                     capture=False):
+        """
+        Run `commands` concurrently and stream their output line by line,
+        without busy-waiting, as they produce it.
+
+        Args:
+            commands (list): list of commands
+            cwd (str)
+            timeout (float): seconds before unfinished commands are killed
+            prefixes (list): printed at the beginning of each output line of
+                the command at the same index. Default to the command name
+                when several commands run.
+            capture (bool): return stdout instead of printing it. stderr is
+                always printed.
+
+        Returns:
+            list: one `CommandResult` per command
+        """
+        if prefixes is None:
+            prefixes = [None] * len(commands)
+        if len(commands) > 1:
+            prefixes = [prefix if prefix is not None else command[0]
+                        for prefix, command in zip(prefixes, commands)]
+
+        selector = selectors.DefaultSelector()
+        processes = []
+        start = time.time()
+        deadline = start + timeout if timeout is not None else None
+
+        try:
+            for index, command in enumerate(commands):
+                process = subprocess.Popen(command,
+                                           stdout=subprocess.PIPE,
+                                           stderr=subprocess.PIPE,
+                                           cwd=cwd,
+                                           start_new_session=True)
+                processes.append({
+                    'process': process,
+                    'open_streams': 2,
+                    'stdout': [],
+                    'end': None,
+                    'timed_out': False,
+                })
+                selector.register(process.stdout, selectors.EVENT_READ,
+                                  (index, 'stdout', bytearray()))
+                selector.register(process.stderr, selectors.EVENT_READ,
+                                  (index, 'stderr', bytearray()))
+
+            # Once processes are killed, time given to their pipes to close
+            drain_deadline = None
+            while selector.get_map():
+                select_timeout = None
+                if deadline is not None or drain_deadline is not None:
+                    select_timeout = max(
+                        0, (deadline or drain_deadline) - time.time())
+                events = selector.select(select_timeout)
+
+                # Checked even when there are events: a command which keeps
+                # writing must be killed too
+                if deadline is not None and time.time() >= deadline:
+                    for process in processes:
+                        if process['end'] is None \
+                                and process['process'].poll() is None:
+                            process['timed_out'] = True
+                            cls.__kill(process['process'])
+                    # Pipes will be closed by the killed processes
+                    deadline = None
+                    drain_deadline = time.time() + cls.KILL_TIMEOUT
+                elif drain_deadline is not None \
+                        and time.time() >= drain_deadline:
+                    # e.g. kept open by a process which left the session
+                    for key in list(selector.get_map().values()):
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
                     break
-                if output:
-                    print(output.decode().strip())
-            return process.poll()
-        else:
+
+                for key, _ in events:
+                    index, stream, buffer = key.data
+                    process = processes[index]
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        buffer.extend(data)
+                        lines = buffer.split(b'\n')
+                        buffer[:] = lines.pop()
+                    else:
+                        lines = [bytes(buffer)] if buffer else []
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                        process['open_streams'] -= 1
+                        if not process['open_streams']:
+                            process['end'] = time.time()
+
+                    for line in lines:
+                        line = line.decode(errors='replace').rstrip('\r')
+                        if stream == 'stdout' and capture:
+                            process['stdout'].append(line)
+                        else:
+                            cls.print_line(line, prefixes[index],
+                                           stream == 'stderr')
+        except BaseException:
+            # e.g. `KeyboardInterrupt`. Processes run in their own session
+            # and do not receive the signal, stop them.
+            for process in processes:
+                if process['process'].poll() is None:
+                    cls.__kill(process['process'])
+            raise
+        finally:
+            selector.close()
+
+        results = []
+        for command, process in zip(commands, processes):
             try:
-                stdout = subprocess.check_output(command,
-                                                 universal_newlines=True,
-                                                 cwd=cwd)
-            except subprocess.CalledProcessError as cpe:
-                # Error will be display by above command.
-                # ^^^ this doesn't seem to be true? let's write it explicitly
-                # see https://docs.python.org/3/library/subprocess.html#subprocess.check_output
-                sys.stderr.write(cpe.output)
-                cls.colored_print('An error has occurred', CLI.COLOR_ERROR)
-                sys.exit(1)
-            return stdout
+                returncode = process['process'].wait(
+                    cls.KILL_TIMEOUT if process['timed_out'] else None)
+            except subprocess.TimeoutExpired:
+                # Killed, but not reaped yet (e.g. uninterruptible sleep)
+                returncode = -signal.SIGKILL
+            results.append(CommandResult(
+                command=command,
+                returncode=returncode,
+                duration=(process['end'] or time.time()) - start,
+                stdout='\n'.join(process['stdout']) +
+                ('\n' if process['stdout'] else ''),
+                timed_out=process['timed_out'],
+            ))
+
+        return results
+
+    @classmethod
+    def print_line(cls, line, prefix=None, error=False):
+        """
+        Print `line` without mixing it with lines of other threads.
+
+        Args:
+            prefix (str): printed at the beginning of the line, e.g. to
+                tell concurrent steps apart
+            error (bool): print to stderr
+        """
+        if prefix is not None:
+            line = '{} | {}'.format(cls.colorize(prefix, cls.COLOR_INFO),
+                                    line)
+        output = sys.stderr if error else sys.stdout
+        with cls.OUTPUT_LOCK:
+            output.write(line + '\n')
+            output.flush()
+
+    @staticmethod
+    def __kill(process):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
 
     @classmethod
     def yes_no_question(cls, question, default=True,
@@ -1,61 +1,402 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 import time
 import subprocess
 import shutil
+from http.client import HTTPException
 
+from helpers.blue_green import BlueGreen
 from helpers.cli import CLI
+from helpers.compose_file import ComposeFile
+from helpers.compose_project import ComposeProject
 from helpers.config import Config
+from helpers.docker_engine import DockerEngine, DockerEngineError
+from helpers.readiness import Readiness, ReadinessTimeout
+from helpers.reconciler import Reconciler
+from helpers.scheduler import Scheduler
 from helpers.template import Template
 
 class Command:
 
+    # Docker Compose projects. Keys are the roles used by
+    # `Config.get_prefix()`.
+    # `depends_on` only applies when starting the projects. Shutdowns are
+    # run in reverse order, e.g. `frontend` containers are attached to the
+    # network created by `backend` and must be removed first.
+    # `probes` are the services which must answer (see `Readiness`) before
+    # the projects which depend on this one start.
+    STACKS = {
+        'backend': {
+            'files': ['docker-compose.db.yml'],
+            'depends_on': [],
+            'probes': ['support-postgres'],
+        },
+        'frontend': {
+            'files': ['docker-compose.frontend.yml',
+                      'docker-compose.frontend.override.yml'],
+            'depends_on': ['backend'],
+            'probes': ['support-api'],
+        },
+        'dashboards': {
+            'files': ['docker-compose.shiny.yml'],
+            'depends_on': [],
+            'probes': ['dashboards'],
+        },
+    }
+
+    # Services are probed through their published ports
+    PROBE_HOST = '127.0.0.1'
+
+    @classmethod
+    def get_compose_command(cls, config, role, *args):
+        """
+        Build `docker-compose` command for the project of `role`
+
+        Args:
+            config (helpers.config.Config)
+            role (str): one key of `Command.STACKS`
+            args (str): arguments passed to `docker-compose`
+
+        Returns:
+            list
+        """
+        command = ['docker-compose']
+        for file_ in cls.STACKS[role]['files']:
+            command += ['-f', file_]
+        command += ['-p', config.get_prefix(role)]
+        command += list(args)
+        return command
+
+    @classmethod
+    def help(cls):
+        output = [
+            'Usage: python3 run.py [options]',
+            '',
+            '    Options:',
+            '          -s, --setup',
+            '                Setup the Support API environment',
+            '          -S, --stop',
+            '                Stop the Support API environment',
+            '          -r, --reconcile',
+            '                Render configuration files and restart only',
+            '                the services whose configuration has changed',
+            '          -p, --plan',
+            '                Show which services would be restarted by',
+            '                `--reconcile` without changing anything',
+            '          -u, --update-api',
+            '                Pull the API image and replace the API',
+            '                container without downtime (blue/green)',
+            '          -R, --restore',
+            '                Restore the database from a backup on S3 or',
+            '                on disk, and report timings of each phase',
+            '          -h, --help',
+            '                Display this help',
+            '',
+        ]
+        print('\n'.join(output))
+
+    @classmethod
+    def reconcile(cls, dry_run=False):
+        """
+        Recreate only the services whose compose definition, env files,
+        scripts or global configuration changed since the last time they
+        were applied. Stopped services are started again, the others are
+        left untouched.
+
+        Args:
+            dry_run (bool): only print the plan. Templates are rendered in
+                memory to take into account configuration changes which
+                have not been written yet.
+        """
+        config = Config()
+        dict_ = config.get_dict()
+        contents = None
+        if dry_run:
+            contents = {path: file_['content']
+                        for path, file_ in Template.render(
+                            config, dry_run=True).items()}
+        reconciler = Reconciler(config, cls.STACKS, contents)
+        plan = reconciler.get_plan()
+        reconciler.print_plan(plan)
+
+        if dry_run:
+            return
+
+        cls.pull(config, list(cls.STACKS))
+        scheduler = Scheduler()
+        engine = DockerEngine() if config.docker_api else None
+        readiness = Readiness(int(config.get_value('readiness_timeout')))
+        for role in cls.STACKS:
+            cls.__add_probes(scheduler, readiness, config, role)
+            recreate = [item['service'] for item in plan
+                        if item['role'] == role and
+                        item['action'] in [Reconciler.NEW, Reconciler.RESTART]]
+            remove = [item['service'] for item in plan
+                      if item['role'] == role and
+                      item['action'] == Reconciler.REMOVE]
+            # Groups of services to start, in order. `None` for all of them.
+            groups = cls.__get_service_groups(config, role)
+            update_api = False
+            recreate_groups = [recreate]
+            if groups != [None]:
+                colors = BlueGreen.SERVICES.values()
+                if any(item['service'] == BlueGreen.PROXY_SERVICE and
+                       item['action'] == Reconciler.NEW for item in plan):
+                    # The proxy has just been added: the API must release
+                    # its port before the proxy publishes it
+                    recreate = [service for service in recreate
+                                if service not in colors
+                                or service == groups[0][0]]
+                elif config.rolling_update:
+                    # The API is replaced by its idle color, not recreated
+                    update_api = any(service in colors
+                                     for service in recreate)
+                    recreate = [service for service in recreate
+                                if service not in colors]
+                recreate_groups = [[service] for service in recreate]
+
+            if engine is not None:
+                operations = [
+                    lambda project, service=service:
+                        project.remove_service(service)
+                    for service in remove
+                ]
+                for services in recreate_groups:
+                    if services:
+                        operations.append(
+                            lambda project, services=services: project.up(
+                                services, force_recreate=True, no_deps=True,
+                                scale=cls.__get_scale(config, services)))
+                for group in groups:
+                    operations.append(
+                        lambda project, services=group: project.up(
+                            services, no_recreate=True,
+                            scale=cls.__get_scale(config, services)))
+                action = cls.__get_engine_action(engine, config, role,
+                                                  operations)
+            else:
+                commands = []
+                for service in remove:
+                    commands.append(
+                        cls.__get_remove_service_command(config, role,
+                                                         service))
+                for services in recreate_groups:
+                    if services:
+                        commands.append(cls.get_compose_command(
+                            config, role, 'up', '-d', '--no-deps',
+                            '--force-recreate',
+                            *cls.__get_scale_arguments(config, services),
+                            *services))
+                # Start services which may have been stopped, without
+                # touching the running ones. The number of API replicas is
+                # applied here too: it is not part of the compose files.
+                for group in groups:
+                    commands.append(cls.get_compose_command(
+                        config, role, 'up', '-d', '--no-recreate',
+                        *cls.__get_scale_arguments(config, group),
+                        *(group or [])))
+                action = cls.__get_action(commands,
+                                          dict_['support_api_path'], role)
+
+            if groups != [None]:
+                action = cls.__get_blue_green_action(config, role, action,
+                                                     update_api)
+            scheduler.add(
+                role,
+                action,
+                depends_on=cls.__get_dependencies(role, list(cls.STACKS))
+            )
+
+        scheduler.run(title='Reconciliation timings:')
+        readiness.print_report(title='Time to ready:')
+        reconciler.save_state()
+        CLI.colored_print('Support API is up to date', CLI.COLOR_SUCCESS)
+
+    @classmethod
+    def pull(cls, config, roles, refresh=False):
+        """
+        Pull, concurrently, the images used by the compose files of `roles`
+        which are not available locally yet. Running containers are left
+        untouched, so they keep serving requests while images are
+        downloaded and `up` does not have to pull anything.
+
+        Args:
+            config (helpers.config.Config)
+            roles (list): keys of `Command.STACKS`
+            refresh (bool): pull images available locally too, to get the
+                latest version of their tags
+        """
+        dict_ = config.get_dict()
+        images = []
+        for role in roles:
+            try:
+                compose = ComposeFile.load([
+                    os.path.join(dict_['support_api_path'], file_)
+                    for file_ in cls.STACKS[role]['files']])
+            except (IOError, ValueError) as e:
+                # `docker-compose` pulls them itself when they are missing
+                CLI.colored_print('Images of `{}` cannot be pulled in '
+                                  'advance: {}'.format(role, e),
+                                  CLI.COLOR_WARNING)
+                continue
+            for definition in (compose.get('services') or {}).values():
+                image = (definition or {}).get('image')
+                if image:
+                    image = cls.__get_image_reference(str(image))
+                    if image not in images:
+                        images.append(image)
+
+        engine = DockerEngine() if config.docker_api else None
+        missing = images if refresh else cls.__get_missing_images(
+            engine, images, dict_['support_api_path'])
+        if not missing:
+            return
+
+        CLI.colored_print('Pulling images', CLI.COLOR_INFO)
+        scheduler = Scheduler()
+        for image in missing:
+            scheduler.add(image, cls.__get_pull_action(
+                engine, image, dict_['support_api_path']))
+        scheduler.run(title='Pull timings:')
+
+    @classmethod
+    def restore(cls):
+        """
+        Restore the database from a backup chosen among those on S3 and on
+        disk. The restore runs in the backup container (see
+        `postgres/restore.py`). Frontend containers are stopped meanwhile,
+        so no connection prevents the database from being dropped.
+        """
+        config = Config()
+        dict_ = config.get_dict()
+        if not dict_['use_backup']:
+            CLI.colored_print('Backups are not activated', CLI.COLOR_ERROR)
+            sys.exit(1)
+
+        restore_command = cls.get_compose_command(
+            config, 'backend', 'exec', '-T', 'support-postgres-backup',
+            'sh', '/postgres-scripts/restore.sh')
+        output = CLI.run_command(restore_command + ['list'],
+                                 dict_['support_api_path'])
+        backups = [line.split('\t') for line in output.splitlines() if line]
+        if not backups:
+            CLI.colored_print('No backups found', CLI.COLOR_ERROR)
+            sys.exit(1)
+
+        CLI.colored_print('Which backup do you want to restore?',
+                          CLI.COLOR_QUESTION)
+        for index, (name, last_modified, size, format_) in enumerate(
+                backups):
+            CLI.colored_print('\t{index}) {name} ({last_modified} UTC, '
+                              '{size:.1f} MB, {format})'.format(
+                                  index=index + 1,
+                                  name=name,
+                                  last_modified=last_modified,
+                                  size=int(size) / 1024 ** 2,
+                                  format=format_))
+        while True:
+            response = CLI.get_response(r'~^\d+$', str(len(backups)))
+            # `get_response()` also accepts single characters of the regex
+            if response.isdigit() and 1 <= int(response) <= len(backups):
+                break
+            CLI.colored_print("Sorry, I didn't understand that!",
+                              CLI.COLOR_ERROR)
+        name = backups[int(response) - 1][0]
+
+        if not CLI.yes_no_question(
+                'Database `{}` will be dropped and restored from `{}`. '
+                'Do you want to continue?'.format(dict_['support_db_name'],
+                                                  name),
+                default=False):
+            return
+
+        cls.stop(output=False, frontend_only=True)
+        returncode = CLI.run_command(restore_command + ['restore', name],
+                                     dict_['support_api_path'],
+                                     polling=True)
+        cls.start(frontend_only=True)
+        if returncode != 0:
+            CLI.colored_print('Restore has failed', CLI.COLOR_ERROR)
+            sys.exit(1)
+        CLI.colored_print('Database has been restored', CLI.COLOR_SUCCESS)
+
+    @classmethod
+    def update_api(cls):
+        """
+        Pull the image of the API and replace its container without
+        downtime, see `BlueGreen`. Measured downtime is reported.
+        """
+        config = Config()
+        if not config.rolling_update:
+            CLI.colored_print('Updates without downtime are not activated',
+                              CLI.COLOR_ERROR)
+            sys.exit(1)
+        if not cls.__has_proxy(config):
+            CLI.colored_print('Compose files have no proxy in front of the '
+                              'API. Run `run.py --setup` to render them '
+                              'again.', CLI.COLOR_ERROR)
+            sys.exit(1)
+
+        cls.pull(config, ['frontend'], refresh=True)
+        CLI.colored_print('Updating API', CLI.COLOR_INFO)
+        cls.__update_api(config, 'frontend')
+
     @classmethod
     def start(cls, frontend_only=False):
         config = Config()
         dict_ = config.get_dict()
- 
+        roles = ['frontend'] if frontend_only else list(cls.STACKS)
+
+        # Before anything is stopped, the outage does not include downloads
+        cls.pull(config, roles)
         cls.stop(output=False, frontend_only=frontend_only)
         if frontend_only:
             CLI.colored_print('Launching frontend containers', CLI.COLOR_INFO)
         else:
             CLI.colored_print('Launching environment', CLI.COLOR_INFO)
 
-            backend_command = [
-                'docker-compose',
-                '-f',
-                'docker-compose.db.yml',
-                '-p',
-                config.get_prefix('backend'),
-                'up',
-                '-d'
-            ]
-            CLI.run_command(backend_command, dict_['support_api_path'])
-
-        # Start the front-end containers
-        # if config.frontend:
+        scheduler = Scheduler()
+        engine = DockerEngine() if config.docker_api else None
+        # Containers being created is not enough, wait for services to
+        # answer, e.g. the API would crash-loop while PostgreSQL recovers.
+        readiness = Readiness(int(config.get_value('readiness_timeout')))
+        for role in roles:
+            groups = cls.__get_service_groups(config, role)
+            # API containers are recreated before the proxy starts: one
+            # created before the proxy existed (e.g. when `stop` is skipped
+            # for other server roles) still publishes the API port.
+            if engine is not None:
+                action = cls.__get_engine_action(
+                    engine, config, role,
+                    [lambda project, services=group: project.up(
+                        services,
+                        force_recreate=bool(cls.__get_scale(config, services)),
+                        scale=cls.__get_scale(config, services))
+                     for group in groups])
+            else:
+                commands = [cls.get_compose_command(
+                                config, role, 'up', '-d',
+                                *(['--force-recreate']
+                                  if cls.__get_scale(config, group) else []),
+                                *cls.__get_scale_arguments(config, group),
+                                *(group or []))
+                            for group in groups]
+                action = cls.__get_action(commands,
+                                          dict_['support_api_path'], role)
+            if groups != [None]:
+                action = cls.__get_blue_green_action(config, role, action)
+            scheduler.add(
+                role,
+                action,
+                depends_on=cls.__get_dependencies(role, roles)
+            )
+            cls.__add_probes(scheduler, readiness, config, role)
 
-            # If this was previously a shared-database setup, migrate to
-            # separate databases for KPI and KoBoCAT
-            #Upgrading.migrate_single_to_two_databases(config)
-
-            frontend_command = ['docker-compose',
-                                '-f', 'docker-compose.frontend.yml',
-                                '-f', 'docker-compose.frontend.override.yml',
-                                '-p', config.get_prefix('frontend'),
-                                'up', '-d']
-
-            
-            CLI.run_command(frontend_command, dict_['support_api_path'])
-
-
-            # Start Dashboards container
-            frontend_command = ['docker-compose',
-                                '-f', 'docker-compose.shiny.yml',
-                                '-p', config.get_prefix('dashboards'),
-                                'up', '-d']
-            CLI.run_command(frontend_command, dict_['support_api_path'])
+        scheduler.run(title='Startup timings:')
+        readiness.print_report(title='Time to ready:')
+        Reconciler(config, cls.STACKS).save_state()
 
     @classmethod
     def stop(cls, output=True, frontend_only=False):
@@ -69,30 +410,346 @@ class Command:
 
             print ("Shutting down docker containers...")
 
-            # Shut down frontend containers
-            frontend_command = ['docker-compose',
-                                '-f', 'docker-compose.frontend.yml',
-                                '-f', 'docker-compose.frontend.override.yml',
-                                '-p', config.get_prefix('frontend'),
-                                'down']
-            CLI.run_command(frontend_command, dict_['support_api_path'])
-
-            # Shutdown Dashboards container
-            dashboards_command = ['docker-compose',
-                                '-f', 'docker-compose.shiny.yml',
-                                '-p', config.get_prefix('dashboards'),
-                                'down']
-            CLI.run_command(dashboards_command, dict_['support_api_path'])
-
-            # Shutdown Database related containers
-            backend_command = [
-                'docker-compose',
-                '-f',
-                'docker-compose.db.yml',
-                '-p', config.get_prefix('backend'),
-                'down'
-            ]
-            CLI.run_command(backend_command, dict_['support_api_path'])
+            roles = ['frontend'] if frontend_only else list(cls.STACKS)
+
+            # Reverse dependencies: a project goes down only once the
+            # projects which depend on it are down.
+            scheduler = Scheduler()
+            engine = DockerEngine() if config.docker_api else None
+            for role in roles:
+                if engine is not None:
+                    action = cls.__get_engine_action(
+                        engine, config, role, [lambda project: project.down()])
+                else:
+                    command = cls.get_compose_command(config, role, 'down')
+                    action = cls.__get_action(command,
+                                              dict_['support_api_path'], role)
+                scheduler.add(
+                    role,
+                    action,
+                    depends_on=[dependent
+                                for dependent in roles
+                                if role in cls.STACKS[dependent]['depends_on']]
+                )
+
+            scheduler.run(title='Shutdown timings:')
 
         if output:
             CLI.colored_print('Support API has been stopped', CLI.COLOR_SUCCESS)
+
+    @classmethod
+    def __add_probes(cls, scheduler, readiness, config, role):
+        """
+        Add one step per service of `role` to probe, which waits for the
+        service to answer once the project of `role` is up.
+        """
+        probes = cls.__get_probes(config)
+        for service in cls.STACKS[role]['probes']:
+            def _run(service=service):
+                try:
+                    readiness.wait(service, probes[service])
+                except ReadinessTimeout as e:
+                    CLI.colored_print(str(e), CLI.COLOR_ERROR)
+                    sys.exit(1)
+
+            scheduler.add(cls.__get_probe_step(service), _run,
+                          depends_on=[role])
+
+    @staticmethod
+    def __get_action(commands, cwd, prefix=None):
+        """
+        Return a callable which runs `commands` one after the other.
+        `commands` can be a single command.
+        Output lines are prefixed with `prefix` to tell concurrent steps
+        apart.
+        """
+        if commands and isinstance(commands[0], str):
+            commands = [commands]
+
+        def _run():
+            for command in commands:
+                CLI.run_command(command, cwd, prefix=prefix)
+
+        return _run
+
+    @classmethod
+    def __get_blue_green_action(cls, config, role, action, update_api=False):
+        """
+        Wrap `action`, which starts the services of `role`: the upstream of
+        the proxy must exist first, and the proxy must reload it if it
+        changed (e.g. blue/green updates were deactivated while green
+        received traffic). Then, if `update_api`, replace the API with its
+        idle color.
+        """
+        def _run():
+            changed = BlueGreen(config).write_upstream()
+            action()
+            if changed:
+                cls.__reload_proxy(config, role)
+            if update_api:
+                cls.__update_api(config, role)
+
+        return _run
+
+    @classmethod
+    def __get_dependencies(cls, role, roles):
+        """
+        Returns:
+            list: steps which must succeed before the project of `role`
+            starts, i.e. the probes of the projects it depends on, among
+            `roles`
+        """
+        dependencies = []
+        for dependency in cls.STACKS[role]['depends_on']:
+            if dependency in roles:
+                dependencies += [cls.__get_probe_step(service) for service
+                                 in cls.STACKS[dependency]['probes']] \
+                    or [dependency]
+        return dependencies
+
+    @classmethod
+    def __get_engine_action(cls, engine, config, role, operations):
+        """
+        Return a callable which loads the project of `role` and applies
+        `operations` to it through the Docker Engine API, in place of
+        `docker-compose` commands.
+
+        Args:
+            engine (helpers.docker_engine.DockerEngine)
+            config (helpers.config.Config)
+            role (str): one key of `Command.STACKS`
+            operations (list): callables which receive the
+                `ComposeProject`
+        """
+        def _run():
+            try:
+                project = ComposeProject(engine,
+                                         config.get_prefix(role),
+                                         cls.STACKS[role]['files'],
+                                         config.get_dict()['support_api_path'],
+                                         prefix=role)
+                for operation in operations:
+                    operation(project)
+            except (DockerEngineError, HTTPException, ValueError,
+                    OSError) as e:
+                CLI.colored_print('{} | {}'.format(role, e), CLI.COLOR_ERROR)
+                sys.exit(1)
+
+        return _run
+
+    @staticmethod
+    def __get_image_reference(image):
+        """
+        Returns:
+            str: `image` with the `latest` tag when it has neither a tag nor
+            a digest, as listed by `docker images`
+        """
+        if '@' in image or ':' in image.rpartition('/')[2]:
+            return image
+        return '{}:latest'.format(image)
+
+    @staticmethod
+    def __get_missing_images(engine, images, cwd):
+        """
+        Returns:
+            list: `images` which are not available locally
+        """
+        if engine is not None:
+            try:
+                return [image for image in images
+                        if engine.inspect_image(image) is None]
+            except (DockerEngineError, HTTPException, OSError) as e:
+                CLI.colored_print('Could not list images: {}'.format(e),
+                                  CLI.COLOR_ERROR)
+                sys.exit(1)
+
+        output = CLI.run_command(['docker', 'images', '--format',
+                                  '{{.Repository}}:{{.Tag}} '
+                                  '{{.Repository}}@{{.Digest}}'], cwd)
+        local_images = set(output.split())
+        return [image for image in images if image not in local_images]
+
+    @staticmethod
+    def __get_pull_action(engine, image, cwd):
+        """
+        Return a callable which pulls `image` and prints its progress.
+        """
+        def _run():
+            if engine is None:
+                if CLI.run_command(['docker', 'pull', image], cwd,
+                                   polling=True, prefix=image) != 0:
+                    CLI.colored_print('Could not pull {}'.format(image),
+                                      CLI.COLOR_ERROR)
+                    sys.exit(1)
+                return
+
+            def _progress(message):
+                # Byte counts would flood the output, only print when the
+                # status of a layer changes
+                if message.get('progressDetail'):
+                    return
+                CLI.print_line(
+                    ': '.join(str(message[key]) for key in ('id', 'status')
+                              if message.get(key)),
+                    prefix=image)
+
+            try:
+                engine.pull_image(image, progress=_progress)
+            except (DockerEngineError, HTTPException, OSError) as e:
+                CLI.colored_print('{} | {}'.format(image, e), CLI.COLOR_ERROR)
+                sys.exit(1)
+
+        return _run
+
+    @classmethod
+    def __get_probes(cls, config):
+        """
+        Returns:
+            dict: callables which return whether a service is ready, keyed
+            by service
+        """
+        dict_ = config.get_dict()
+        return {
+            'support-postgres': lambda: Readiness.probe_postgres(
+                cls.PROBE_HOST, int(dict_['support_db_port']),
+                dict_['support_db_user'], dict_['support_db_name']),
+            'support-api': lambda: Readiness.probe_http(
+                cls.PROBE_HOST, int(dict_['support_api_port'])),
+            'dashboards': lambda: Readiness.probe_http(
+                cls.PROBE_HOST, int(dict_['dashboards_port'])),
+        }
+
+    @staticmethod
+    def __get_probe_step(service):
+        return '{} ready'.format(service)
+
+    @staticmethod
+    def __get_scale(config, services):
+        """
+        Returns:
+            dict: number of containers of the API colors among `services`
+        """
+        replicas = int(config.get_value('support_api_replicas'))
+        return {service: replicas for service in services or []
+                if service in BlueGreen.SERVICES.values()}
+
+    @classmethod
+    def __get_scale_arguments(cls, config, services):
+        """
+        Returns:
+            list: `--scale` options of `docker-compose up` for `services`
+        """
+        arguments = []
+        for service, replicas in sorted(
+                cls.__get_scale(config, services).items()):
+            arguments += ['--scale', '{}={}'.format(service, replicas)]
+        return arguments
+
+    @classmethod
+    def __get_service_groups(cls, config, role):
+        """
+        Returns:
+            list: groups of services of `role` to start one after the other,
+            `[None]` to start all of them at once. Only the color of the API
+            which receives traffic runs, before the proxy.
+        """
+        if role != 'frontend' or not cls.__has_proxy(config):
+            return [None]
+        return [[service] for service in BlueGreen(config).get_services()]
+
+    @classmethod
+    def __has_proxy(cls, config):
+        """
+        Returns:
+            bool: whether the rendered compose files define the proxy in
+            front of the API. Those rendered by older versions do not, until
+            `run.py --setup` renders them again.
+        """
+        try:
+            compose = ComposeFile.load([
+                os.path.join(config.get_dict()['support_api_path'], file_)
+                for file_ in cls.STACKS['frontend']['files']])
+        except (IOError, ValueError):
+            return False
+        return BlueGreen.PROXY_SERVICE in (compose.get('services') or {})
+
+    @classmethod
+    def __reload_proxy(cls, config, prefix):
+        """
+        Make the proxy reload its configuration, without interrupting
+        requests in progress.
+        """
+        cwd = config.get_dict()['support_api_path']
+        try:
+            if config.docker_api:
+                ComposeProject(DockerEngine(),
+                               config.get_prefix('frontend'),
+                               cls.STACKS['frontend']['files'],
+                               cwd,
+                               prefix=prefix).kill(BlueGreen.PROXY_SERVICE,
+                                                   'SIGHUP')
+            else:
+                CLI.run_command(cls.get_compose_command(
+                    config, 'frontend', 'kill', '-s', 'SIGHUP',
+                    BlueGreen.PROXY_SERVICE), cwd, prefix=prefix)
+        except (DockerEngineError, HTTPException, ValueError, OSError) as e:
+            CLI.colored_print('{} | {}'.format(prefix, e), CLI.COLOR_ERROR)
+            sys.exit(1)
+
+    @classmethod
+    def __update_api(cls, config, prefix):
+        """
+        Replace the API with its idle color and print the measured downtime.
+        """
+        cwd = config.get_dict()['support_api_path']
+        blue_green = BlueGreen(config)
+        try:
+            if config.docker_api:
+                project = ComposeProject(DockerEngine(),
+                                         config.get_prefix('frontend'),
+                                         cls.STACKS['frontend']['files'],
+                                         cwd,
+                                         prefix=prefix)
+                monitor = blue_green.update(
+                    lambda service: project.up(
+                        [service], force_recreate=True, no_deps=True,
+                        scale=cls.__get_scale(config, [service])),
+                    project.remove_service,
+                    lambda: project.kill(BlueGreen.PROXY_SERVICE, 'SIGHUP'),
+                    prefix=prefix)
+            else:
+                def _run(*args):
+                    CLI.run_command(cls.get_compose_command(
+                        config, 'frontend', *args), cwd, prefix=prefix)
+
+                monitor = blue_green.update(
+                    lambda service: _run(
+                        'up', '-d', '--no-deps', '--force-recreate',
+                        *cls.__get_scale_arguments(config, [service]),
+                        service),
+                    lambda service: _run('rm', '--stop', '--force', service),
+                    lambda: _run('kill', '-s', 'SIGHUP',
+                                 BlueGreen.PROXY_SERVICE),
+                    prefix=prefix)
+        except (ReadinessTimeout, DockerEngineError, HTTPException,
+                ValueError, OSError) as e:
+            CLI.colored_print('{} | {}'.format(prefix, e), CLI.COLOR_ERROR)
+            sys.exit(1)
+
+        CLI.print_line(
+            'API updated, downtime: {:.1f}s ({} of {} requests '
+            'failed)'.format(monitor.downtime, monitor.failures,
+                             monitor.requests), prefix)
+
+    @staticmethod
+    def __get_remove_service_command(config, role, service):
+        """
+        Services which are not part of the compose files anymore cannot be
+        addressed by `docker-compose`. Remove their containers by labels.
+        """
+        return ['sh', '-c',
+                'docker ps -aq '
+                '--filter label=com.docker.compose.project={project} '
+                '--filter label=com.docker.compose.service={service} '
+                '| xargs -r docker rm -f'.format(
+                    project=config.get_prefix(role), service=service)]
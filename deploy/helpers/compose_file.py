@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+
+
+class ComposeFile:
+    """
+    Load compose files without PyYAML.
+
+    Only the subset of YAML used by the rendered templates is supported:
+    block mappings and sequences, plain and quoted scalars, flow sequences
+    (e.g. `command: ["postgres", "-c", "..."]`) and comments. Anything else
+    raises a `ValueError` rather than being misread.
+    """
+
+    # Keys of services whose lists are concatenated when files are merged,
+    # like `docker-compose` does. Other values are replaced.
+    MERGED_LISTS = ['ports', 'expose', 'extra_hosts', 'volumes', 'env_file',
+                    'dns', 'networks']
+
+    INT_PATTERN = re.compile(r'^[-+]?\d+$')
+    FLOAT_PATTERN = re.compile(r'^[-+]?\d*\.\d+$')
+
+    @classmethod
+    def load(cls, paths):
+        """
+        Args:
+            paths (list): compose files, each one overriding the previous
+                ones
+
+        Returns:
+            dict
+        """
+        config = {}
+        for path in paths:
+            with open(path, 'r') as f:
+                try:
+                    content = cls.parse(f.read())
+                except ValueError as e:
+                    raise ValueError('{}: {}'.format(path, e))
+            config = cls.merge(config, content or {})
+        return config
+
+    @classmethod
+    def merge(cls, base, override, key=None):
+        """
+        Returns:
+            dict: `base` updated with `override`, recursively
+        """
+        if isinstance(base, dict) and isinstance(override, dict):
+            merged = dict(base)
+            for key_, value in override.items():
+                merged[key_] = cls.merge(base[key_], value, key_) \
+                    if key_ in base else value
+            return merged
+
+        if isinstance(base, list) and isinstance(override, list) \
+                and key in cls.MERGED_LISTS:
+            return base + [item for item in override if item not in base]
+
+        return override
+
+    @classmethod
+    def parse(cls, content):
+        """
+        Returns:
+            dict|list: `None` for an empty document
+        """
+        lines = []
+        for number, line in enumerate(content.split('\n'), 1):
+            if '\t' in line[:len(line) - len(line.lstrip())]:
+                raise ValueError('line {}: tabs are not allowed in '
+                                 'indentation'.format(number))
+            text = cls.__strip_comment(line).rstrip()
+            if text.strip():
+                lines.append((len(text) - len(text.lstrip()), text.strip(),
+                              number))
+
+        if not lines:
+            return None
+
+        value, index = cls.__parse_block(lines, 0, lines[0][0])
+        if index < len(lines):
+            raise ValueError('line {}: unexpected indentation'.format(
+                lines[index][2]))
+        return value
+
+    @classmethod
+    def __parse_block(cls, lines, index, indent):
+        if cls.__is_sequence_item(lines[index][1]):
+            return cls.__parse_sequence(lines, index, indent)
+        return cls.__parse_mapping(lines, index, indent)
+
+    @classmethod
+    def __parse_mapping(cls, lines, index, indent):
+        mapping = {}
+        while index < len(lines) and lines[index][0] == indent \
+                and not cls.__is_sequence_item(lines[index][1]):
+            _, text, number = lines[index]
+            key, value = cls.__split_key(text, number)
+            index += 1
+            if value:
+                mapping[key] = cls.__parse_scalar(value, number)
+                continue
+
+            mapping[key] = None
+            if index < len(lines) and (
+                    lines[index][0] > indent or
+                    (lines[index][0] == indent and
+                     cls.__is_sequence_item(lines[index][1]))):
+                mapping[key], index = cls.__parse_block(lines, index,
+                                                        lines[index][0])
+        if index < len(lines) and lines[index][0] > indent:
+            raise ValueError('line {}: unexpected indentation'.format(
+                lines[index][2]))
+        return mapping, index
+
+    @classmethod
+    def __parse_sequence(cls, lines, index, indent):
+        sequence = []
+        while index < len(lines) and lines[index][0] == indent \
+                and cls.__is_sequence_item(lines[index][1]):
+            _, text, number = lines[index]
+            item = text[1:].strip()
+            if not item:
+                index += 1
+                if index < len(lines) and lines[index][0] > indent:
+                    value, index = cls.__parse_block(lines, index,
+                                                     lines[index][0])
+                else:
+                    value = None
+            elif cls.__split_key(item, number, strict=False):
+                # Mapping inside a sequence: its first key is on the line of
+                # the dash, the next ones are aligned with it
+                item_indent = indent + len(text) - len(item)
+                lines = lines[:index] + [(item_indent, item, number)] \
+                    + lines[index + 1:]
+                value, index = cls.__parse_mapping(lines, index, item_indent)
+            else:
+                value = cls.__parse_scalar(item, number)
+                index += 1
+            sequence.append(value)
+        return sequence, index
+
+    @staticmethod
+    def __is_sequence_item(text):
+        return text == '-' or text.startswith('- ')
+
+    @classmethod
+    def __split_key(cls, text, number, strict=True):
+        """
+        Returns:
+            tuple: key and raw value (empty when the value is a block), or
+            `None` if `text` is not a `key: value` pair and `strict` is
+            `False`
+        """
+        position = 0
+        if text[:1] in ('"', "'"):
+            position = cls.__find_closing_quote(text, number) + 1
+        while True:
+            position = text.find(':', position)
+            if position == -1:
+                break
+            if position == len(text) - 1 or text[position + 1] == ' ':
+                key = cls.__parse_scalar(text[:position].strip(), number)
+                return str(key), text[position + 1:].strip()
+            position += 1
+
+        if strict:
+            raise ValueError('line {}: expected `key: value`'.format(number))
+        return None
+
+    @classmethod
+    def __parse_scalar(cls, text, number):
+        if text[0] in ('"', "'"):
+            end = cls.__find_closing_quote(text, number)
+            if text[end + 1:].strip():
+                raise ValueError('line {}: unexpected characters after '
+                                 'quoted string'.format(number))
+            if text[0] == "'":
+                return text[1:end].replace("''", "'")
+            return cls.__unescape(text[1:end], number)
+
+        if text[0] == '[':
+            return cls.__parse_flow_sequence(text, number)
+        if text == '{}':
+            return {}
+        if text[0] in ('{', '&', '*', '!', '|', '>'):
+            raise ValueError('line {}: unsupported YAML syntax `{}`'.format(
+                number, text))
+        if ': ' in text or text.endswith(':'):
+            raise ValueError('line {}: unexpected `:` in `{}`'.format(
+                number, text))
+
+        if text in ('null', 'Null', 'NULL', '~'):
+            return None
+        if text in ('true', 'True', 'TRUE'):
+            return True
+        if text in ('false', 'False', 'FALSE'):
+            return False
+        if cls.INT_PATTERN.match(text):
+            return int(text)
+        if cls.FLOAT_PATTERN.match(text):
+            return float(text)
+        return text
+
+    @classmethod
+    def __parse_flow_sequence(cls, text, number):
+        if not text.endswith(']'):
+            raise ValueError('line {}: unterminated flow sequence'.format(
+                number))
+        items = []
+        content = text[1:-1].strip()
+        position = 0
+        while position < len(content):
+            while content[position] == ' ':
+                position += 1
+            if content[position] in ('"', "'"):
+                end = cls.__find_closing_quote(content[position:], number) \
+                    + position + 1
+            else:
+                end = content.find(',', position)
+                end = len(content) if end == -1 else end
+            item = content[position:end].strip()
+            if item:
+                items.append(cls.__parse_scalar(item, number))
+            separator = content.find(',', end)
+            if separator == -1:
+                if content[end:].strip():
+                    raise ValueError('line {}: invalid flow sequence'.format(
+                        number))
+                break
+            position = separator + 1
+        return items
+
+    @staticmethod
+    def __find_closing_quote(text, number):
+        quote = text[0]
+        position = 1
+        while position < len(text):
+            if text[position] == '\\' and quote == '"':
+                position += 2
+                continue
+            if text[position] == quote:
+                if quote == "'" and text[position + 1:position + 2] == "'":
+                    position += 2
+                    continue
+                return position
+            position += 1
+        raise ValueError('line {}: unterminated string'.format(number))
+
+    @staticmethod
+    def __strip_comment(line):
+        """
+        Remove a comment, i.e. `#` at the beginning of the line or after a
+        space, outside quotes.
+        """
+        quote = None
+        escaped = False
+        for position, character in enumerate(line):
+            if escaped:
+                escaped = False
+            elif quote is not None:
+                if character == "'" == quote \
+                        and line[position + 1:position + 2] == "'":
+                    escaped = True
+                elif character == quote:
+                    quote = None
+                elif character == '\\' and quote == '"':
+                    escaped = True
+            elif character in ('"', "'") and (
+                    position == 0 or line[position - 1] in ' [,-:'):
+                quote = character
+            elif character == '#' and (position == 0 or
+                                       line[position - 1] in ' \t'):
+                return line[:position]
+        return line
+
+    @staticmethod
+    def __unescape(text, number):
+        escapes = {'"': '"', '\\': '\\', '/': '/', 'n': '\n', 't': '\t',
+                   'r': '\r', '0': '\0'}
+        output = []
+        position = 0
+        while position < len(text):
+            character = text[position]
+            if character == '\\':
+                try:
+                    output.append(escapes[text[position + 1]])
+                except (IndexError, KeyError):
+                    raise ValueError('line {}: unsupported escape '
+                                     'sequence'.format(number))
+                position += 2
+                continue
+            output.append(character)
+            position += 1
+        return ''.join(output)
+
+    @staticmethod
+    def read_env_file(path):
+        """
+        Read an `env_file` like `docker-compose`: `KEY=VALUE` lines, values
+        are taken verbatim. A line with a key only takes its value from the
+        environment.
+
+        Returns:
+            dict
+        """
+        env = {}
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                key, separator, value = line.partition('=')
+                if separator:
+                    env[key] = value
+                elif key in os.environ:
+                    env[key] = os.environ[key]
+        return env
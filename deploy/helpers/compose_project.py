@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import re
+import shlex
+
+from helpers.cli import CLI
+from helpers.compose_file import ComposeFile
+
+
+class ComposeProject:
+    """
+    Apply a compose project through the Docker Engine API, in place of
+    `docker-compose up -d` and `docker-compose down`.
+
+    Compose files are read once when the project is created. Resources
+    carry the labels of `docker-compose` and get the same names, so both
+    tools can be used alternately on the same project. Only the options
+    used by the templates are supported (`image`, `command`, `env_file`,
+    `environment`, `ports`, `volumes`, `networks`, `restart`, ...), other
+    ones raise a `ValueError`.
+    """
+
+    PROJECT_LABEL = 'com.docker.compose.project'
+    SERVICE_LABEL = 'com.docker.compose.service'
+    NETWORK_LABEL = 'com.docker.compose.network'
+    VOLUME_LABEL = 'com.docker.compose.volume'
+    CONFIG_HASH_LABEL = 'com.docker.compose.config-hash'
+    NUMBER_LABEL = 'com.docker.compose.container-number'
+
+    SUPPORTED_OPTIONS = ['image', 'container_name', 'hostname', 'command',
+                         'entrypoint', 'env_file', 'environment', 'ports',
+                         'volumes', 'networks', 'restart', 'user',
+                         'extra_hosts', 'depends_on', 'working_dir',
+                         'healthcheck']
+
+    DURATION_PATTERN = re.compile(r'(\d+(?:\.\d+)?)(ms|us|ns|h|m|s)')
+
+    # Seconds given to containers to stop before they are killed
+    STOP_TIMEOUT = 10
+
+    def __init__(self, engine, name, files, cwd, prefix=None):
+        """
+        Args:
+            engine (helpers.docker_engine.DockerEngine)
+            name (str): project name, e.g. `Config.get_prefix()`
+            files (list): compose files, relative to `cwd`
+            cwd (str): directory of the project, relative paths of the
+                compose files are resolved from it
+            prefix (str): printed at the beginning of each output line
+        """
+        self.engine = engine
+        # Same normalization as `docker-compose`
+        self.name = re.sub(r'[^-_a-z0-9]', '', name.lower())
+        self.cwd = cwd
+        self.prefix = prefix
+        self.config = ComposeFile.load(
+            [os.path.join(cwd, file_) for file_ in files])
+        self.services = self.config.get('services') or {}
+        for service, definition in self.services.items():
+            unsupported = set(definition or {}) - set(self.SUPPORTED_OPTIONS)
+            if unsupported:
+                raise ValueError('Unsupported options of `{}`: {}'.format(
+                    service, ', '.join(sorted(unsupported))))
+        self.__networks = self.__get_networks()
+        self.__volumes = self.__get_volumes()
+
+    def up(self, services=None, force_recreate=False, no_recreate=False,
+           no_deps=False, scale=None):
+        """
+        Same as `docker-compose up -d`: create networks and volumes,
+        (re)create containers whose definition changed and start them.
+
+        Args:
+            services (list): all services when `None`
+            force_recreate (bool): recreate containers even if their
+                definition did not change
+            no_recreate (bool): never recreate existing containers
+            no_deps (bool): do not start services `services` depend on
+            scale (dict): number of containers per service, 1 for services
+                which are not listed. Extra containers are removed, like
+                `--scale`.
+        """
+        for name, definition in self.__networks.items():
+            self.__ensure_network(name, definition)
+        for definition in self.__volumes.values():
+            self.__ensure_volume(definition['name'], definition)
+
+        for service in self.__get_services(services, no_deps):
+            replicas = (scale or {}).get(service, 1)
+            if replicas > 1 and \
+                    (self.services[service] or {}).get('container_name'):
+                raise ValueError('`{}` has a `container_name` and cannot be '
+                                 'scaled'.format(service))
+            containers = self.__get_containers(service)
+            for number in range(1, replicas + 1):
+                name = self.__get_display_name(service, number)
+                config = self.__get_container_config(service, number)
+                container = containers.pop(number, None)
+                if container is not None:
+                    recreate = force_recreate or (
+                        not no_recreate and
+                        container['Labels'].get(self.CONFIG_HASH_LABEL) !=
+                        config['Labels'][self.CONFIG_HASH_LABEL])
+                    if not recreate:
+                        if container['State'] != 'running':
+                            self.__log('Starting {}'.format(name))
+                            self.engine.start_container(container['Id'])
+                        continue
+                    self.__log('Recreating {}'.format(name))
+                    self.__remove_container(container)
+                else:
+                    self.__log('Creating {}'.format(name))
+
+                self.__create_container(service, config, number)
+
+            # Scaled down, last ones first
+            for number, container in sorted(containers.items(),
+                                            reverse=True):
+                self.__log('Removing {}'.format(
+                    self.__get_display_name(service, number)))
+                self.__remove_container(container)
+
+    def down(self):
+        """
+        Same as `docker-compose down`: remove the containers of the services
+        and the networks of the compose files. Volumes are kept.
+        """
+        # Dependents first
+        for service in reversed(self.__get_services(None, False)):
+            self.remove_service(service)
+
+        for name, definition in self.__networks.items():
+            if not definition.get('external') \
+                    and self.engine.inspect_network(name) is not None:
+                self.__log('Removing network {}'.format(name))
+                self.engine.remove_network(name)
+
+    def kill(self, service, signal='SIGKILL'):
+        """
+        Same as `docker-compose kill -s`, e.g. `SIGHUP` to reload the
+        configuration of a server. All running containers of `service`
+        receive `signal`.
+        """
+        containers = [container for container in
+                      self.__get_containers(service).values()
+                      if container['State'] == 'running']
+        if not containers:
+            raise ValueError('Service `{}` is not running'.format(service))
+        for container in containers:
+            self.engine.kill_container(container['Id'], signal)
+
+    def remove_service(self, service):
+        """
+        Remove the containers of `service`, even if it is not part of the
+        compose files anymore.
+        """
+        for number, container in sorted(
+                self.__get_containers(service).items(), reverse=True):
+            self.__log('Removing {}'.format(
+                self.__get_display_name(service, number)))
+            self.__remove_container(container)
+
+    def __create_container(self, service, config, number=1):
+        definition = self.services[service] or {}
+        networks = self.__get_service_networks(definition)
+        if not definition.get('image'):
+            raise ValueError('Service `{}` has no image'.format(service))
+        if self.engine.inspect_image(definition['image']) is None:
+            self.__log('Pulling {}'.format(definition['image']))
+            self.engine.pull_image(definition['image'])
+
+        container_id = self.engine.create_container(
+            definition.get('container_name') or
+            '{}_{}_{}'.format(self.name, service, number), config)
+        for network in networks[1:]:
+            self.engine.connect_network(network, container_id, [service])
+        self.engine.start_container(container_id)
+
+    def __ensure_network(self, name, definition):
+        if self.engine.inspect_network(name) is not None:
+            return
+        if definition.get('external'):
+            raise ValueError('External network `{}` does not exist'.format(
+                name))
+        self.__log('Creating network {}'.format(name))
+        self.engine.create_network(name, definition.get('driver'), {
+            self.PROJECT_LABEL: self.name,
+            self.NETWORK_LABEL: definition['key'],
+        })
+
+    def __ensure_volume(self, name, definition):
+        if self.engine.inspect_volume(name) is not None:
+            return
+        if definition.get('external'):
+            raise ValueError('External volume `{}` does not exist'.format(
+                name))
+        self.__log('Creating volume {}'.format(name))
+        self.engine.create_volume(name, definition.get('driver'), {
+            self.PROJECT_LABEL: self.name,
+            self.VOLUME_LABEL: definition['key'],
+        })
+
+    def __get_containers(self, service):
+        """
+        Returns:
+            dict: containers of `service`, keyed by number
+        """
+        containers = {}
+        for container in self.engine.list_containers([
+                '{}={}'.format(self.PROJECT_LABEL, self.name),
+                '{}={}'.format(self.SERVICE_LABEL, service)]):
+            try:
+                number = int(container['Labels'].get(self.NUMBER_LABEL, 1))
+            except ValueError:
+                number = 1
+            containers[number] = container
+        return containers
+
+    def __get_container_config(self, service, number=1):
+        """
+        Returns:
+            dict: body of the container creation request. Its labels
+            include a hash of the rest, to tell whether the container must
+            be recreated.
+        """
+        definition = self.services[service] or {}
+        env = {}
+        for env_file in self.__as_list(definition.get('env_file')):
+            env.update(ComposeFile.read_env_file(
+                os.path.join(self.cwd, env_file)))
+        environment = definition.get('environment') or {}
+        if isinstance(environment, list):
+            environment = dict(item.partition('=')[::2]
+                               for item in environment)
+        env.update({key: '' if value is None else str(value)
+                    for key, value in environment.items()})
+
+        exposed_ports = {}
+        port_bindings = {}
+        for port in self.__as_list(definition.get('ports')):
+            container_port, host_ip, host_port = self.__parse_port(port)
+            exposed_ports[container_port] = {}
+            if host_port:
+                port_bindings.setdefault(container_port, []).append(
+                    {'HostIp': host_ip, 'HostPort': host_port})
+
+        networks = self.__get_service_networks(definition)
+        restart = str(definition.get('restart') or 'no')
+        config = {
+            'Image': definition.get('image'),
+            'Hostname': definition.get('hostname'),
+            'User': definition.get('user'),
+            'WorkingDir': definition.get('working_dir'),
+            'Env': ['{}={}'.format(key, value)
+                    for key, value in sorted(env.items())],
+            'ExposedPorts': exposed_ports,
+            'Labels': {
+                self.PROJECT_LABEL: self.name,
+                self.SERVICE_LABEL: service,
+                self.NUMBER_LABEL: str(number),
+                'com.docker.compose.oneoff': 'False',
+            },
+            'HostConfig': {
+                'Binds': [self.__get_bind(volume) for volume in
+                          self.__as_list(definition.get('volumes'))],
+                'PortBindings': port_bindings,
+                'RestartPolicy': {'Name': restart},
+                'ExtraHosts': self.__as_list(definition.get('extra_hosts')),
+                'NetworkMode': networks[0],
+            },
+            'NetworkingConfig': {
+                'EndpointsConfig': {networks[0]: {'Aliases': [service]}},
+            },
+        }
+        if definition.get('healthcheck') is not None:
+            config['Healthcheck'] = self.__get_healthcheck(
+                definition['healthcheck'])
+        for key, option in (('Cmd', 'command'), ('Entrypoint', 'entrypoint')):
+            value = definition.get(option)
+            if value is not None:
+                config[key] = shlex.split(value) \
+                    if isinstance(value, str) else [str(x) for x in value]
+
+        config = {key: value for key, value in config.items()
+                  if value is not None}
+        config['Labels'][self.CONFIG_HASH_LABEL] = hashlib.sha256(
+            json.dumps([config, networks], sort_keys=True).encode()
+        ).hexdigest()
+        return config
+
+    def __get_bind(self, volume):
+        """
+        Returns:
+            str: `source:target[:mode]`, with the path of bind mounts made
+            absolute and the real name of named volumes
+        """
+        source, separator, target = volume.partition(':')
+        if not separator:
+            raise ValueError('Anonymous volume `{}` is not supported'.format(
+                volume))
+        if source.startswith(('.', '/', '~')):
+            source = os.path.normpath(os.path.join(
+                self.cwd, os.path.expanduser(source)))
+        else:
+            source = self.__volumes[source]['name'] \
+                if source in self.__volumes else source
+        return '{}:{}'.format(source, target)
+
+    @classmethod
+    def __get_healthcheck(cls, healthcheck):
+        """
+        Returns:
+            dict: `healthcheck` of a service in the format of the API,
+            durations in nanoseconds
+        """
+        if healthcheck.get('disable'):
+            return {'Test': ['NONE']}
+        test = healthcheck.get('test')
+        config = {
+            'Test': ['CMD-SHELL', test] if isinstance(test, str) else test,
+            'Retries': healthcheck.get('retries'),
+        }
+        for key, option in (('Interval', 'interval'), ('Timeout', 'timeout'),
+                            ('StartPeriod', 'start_period')):
+            if healthcheck.get(option) is not None:
+                config[key] = cls.__parse_duration(healthcheck[option])
+        return {key: value for key, value in config.items()
+                if value is not None}
+
+    def __get_networks(self):
+        """
+        Returns:
+            dict: definitions (with their `key` in the compose files) keyed
+            by real name, `default` included when a service uses it
+        """
+        networks = {}
+        definitions = dict(self.config.get('networks') or {})
+        if any('default' in self.__get_service_network_keys(definition or {})
+               for definition in self.services.values()):
+            definitions.setdefault('default', None)
+        for key, definition in definitions.items():
+            definition = dict(definition or {}, key=key)
+            networks[self.__get_resource_name(key, definition)] = definition
+        return networks
+
+    def __get_resource_name(self, key, definition):
+        external = definition.get('external')
+        if isinstance(external, dict) and external.get('name'):
+            return external['name']
+        if definition.get('name'):
+            return definition['name']
+        if external:
+            return key
+        return '{}_{}'.format(self.name, key)
+
+    def __get_service_networks(self, definition):
+        definitions = dict(self.config.get('networks') or {})
+        names = []
+        for key in self.__get_service_network_keys(definition):
+            names.append(self.__get_resource_name(
+                key, dict(definitions.get(key) or {})))
+        return names
+
+    @staticmethod
+    def __get_service_network_keys(definition):
+        networks = definition.get('networks') or ['default']
+        return list(networks)
+
+    def __get_services(self, services, no_deps):
+        """
+        Returns:
+            list: `services` and, unless `no_deps`, their dependencies,
+            dependencies first
+        """
+        ordered = []
+
+        def _visit(service, path):
+            if service in ordered:
+                return
+            if service in path:
+                raise ValueError('Circular dependency on service `{}`'.format(
+                    service))
+            if service not in self.services:
+                raise ValueError('No such service: `{}`'.format(service))
+            for dependency in self.__as_list(
+                    (self.services[service] or {}).get('depends_on')):
+                _visit(dependency, path + [service])
+            ordered.append(service)
+
+        for service in self.services:
+            _visit(service, [])
+
+        if services is None:
+            return ordered
+
+        selected = set(services)
+        if not no_deps:
+            for service in services:
+                stack = [service]
+                while stack:
+                    for dependency in self.__as_list(
+                            (self.services[stack.pop()] or {}).get(
+                                'depends_on')):
+                        if dependency not in selected:
+                            selected.add(dependency)
+                            stack.append(dependency)
+        return [service for service in ordered if service in selected]
+
+    @staticmethod
+    def __get_display_name(service, number):
+        return service if number == 1 else '{}_{}'.format(service, number)
+
+    def __get_volumes(self):
+        return {key: dict(definition or {},
+                          key=key,
+                          name=self.__get_resource_name(key,
+                                                        definition or {}))
+                for key, definition in
+                (self.config.get('volumes') or {}).items()}
+
+    def __log(self, message):
+        CLI.print_line(message, self.prefix)
+
+    @classmethod
+    def __parse_duration(cls, duration):
+        """
+        Returns:
+            int: nanoseconds of a compose duration, e.g. `1m30s`
+        """
+        units = {'h': 3600, 'm': 60, 's': 1, 'ms': 10 ** -3,
+                 'us': 10 ** -6, 'ns': 10 ** -9}
+        parts = cls.DURATION_PATTERN.findall(str(duration))
+        if not parts or ''.join(number + unit for number, unit in parts) \
+                != str(duration):
+            raise ValueError('Invalid duration `{}`'.format(duration))
+        return int(round(sum(float(number) * units[unit]
+                             for number, unit in parts) * 10 ** 9))
+
+    @staticmethod
+    def __parse_port(port):
+        """
+        Returns:
+            tuple: container port with its protocol (e.g. `5432/tcp`), host
+            IP and host port (empty when not published)
+        """
+        port = str(port)
+        port, _, protocol = port.partition('/')
+        parts = port.split(':')
+        host_ip = ':'.join(parts[:-2])
+        host_port = parts[-2] if len(parts) > 1 else ''
+        return '{}/{}'.format(parts[-1], protocol or 'tcp'), host_ip, \
+            host_port
+
+    def __remove_container(self, container):
+        if container['State'] == 'running':
+            self.engine.stop_container(container['Id'], self.STOP_TIMEOUT)
+        self.engine.remove_container(container['Id'], force=True)
+
+    @staticmethod
+    def __as_list(value):
+        if value is None:
+            return []
+        if isinstance(value, (list, dict)):
+            return list(value)
+        return [value]
@@ -95,6 +95,14 @@ class Config(metaclass=Singleton):
         
         self.__questions_api_port()
 
+        self.__questions_api_proxy()
+
+        self.__questions_rolling_update()
+
+        self.__questions_docker_engine()
+
+        self.__questions_readiness_timeout()
+
         self.__questions_postgres()
 
         self.__questions_kobo_postgres()
@@ -133,6 +141,16 @@ class Config(metaclass=Singleton):
 
         return upgraded_dict
 
+    def get_value(self, key):
+        """
+        Read `key`, which may be missing from configurations saved by older
+        versions (i.e. `run.py` was not run with `--setup` since).
+
+        Returns:
+            value of `key`, its default when it is missing
+        """
+        return self.get_upgraded_dict()[key]
+
     def get_env_files_path(self):
         current_path = os.path.realpath(os.path.normpath(os.path.join(
             self.__dict['support_api_path'],
@@ -178,6 +196,80 @@ class Config(metaclass=Singleton):
                                             CLI.COLOR_QUESTION,
                                             self.__dict['support_api_port'])
 
+    def __questions_api_proxy(self):
+        """
+        Replicas of the API and TLS of the proxy in front of them
+        """
+        CLI.colored_print('How many API containers should share requests?',
+                          CLI.COLOR_QUESTION)
+        CLI.colored_print(
+            'A proxy publishes the API port and sends each request to the '
+            'container with the fewest active requests.', CLI.COLOR_INFO)
+        self.__dict['support_api_replicas'] = CLI.get_response(
+            r'~^[1-9]\d*$', str(self.__dict['support_api_replicas']))
+
+        CLI.colored_print('Domain name of the API?', CLI.COLOR_QUESTION)
+        CLI.colored_print(
+            'The proxy serves HTTPS (HTTP/2) on ports 80 and 443 for this '
+            'domain. Leave empty, or `-` to remove it, if another server '
+            'terminates TLS.', CLI.COLOR_INFO)
+        self.__dict['support_api_domain'] = CLI.get_response(
+            r'~^([a-z0-9.-]+)?$', self.__dict['support_api_domain'])
+        if not self.__dict['support_api_domain']:
+            return
+
+        CLI.colored_print('Let\'s Encrypt directory?', CLI.COLOR_QUESTION)
+        CLI.colored_print(
+            'Certificates are read from `live/{}/` in it, e.g. '
+            '`letsencrypt.tar.gz` extracted in `/etc`.'.format(
+                self.__dict['support_api_domain']), CLI.COLOR_INFO)
+        self.__dict['letsencrypt_path'] = CLI.get_response(
+            r'~^/.+$', self.__dict['letsencrypt_path'])
+
+    def __questions_rolling_update(self):
+        """
+        Blue/green updates of the API behind a proxy
+        """
+        self.__dict['support_api_rolling_update'] = CLI.yes_no_question(
+            'Do you want to update the API without downtime?',
+            default=self.__dict['support_api_rolling_update'])
+        if not self.__dict['support_api_rolling_update']:
+            return
+
+        CLI.colored_print(
+            'The proxy switches traffic to new API containers once they '
+            'answer.', CLI.COLOR_INFO)
+        CLI.colored_print('Port to check new API containers before they '
+                          'receive traffic?', CLI.COLOR_QUESTION)
+        self.__dict['support_api_alternate_port'] = CLI.get_response(
+            r'~^\d+$', str(self.__dict['support_api_alternate_port']))
+
+    def __questions_docker_engine(self):
+        """
+        Tool which creates, starts and stops containers
+        """
+        CLI.colored_print('How should containers be managed?',
+                          CLI.COLOR_QUESTION)
+        CLI.colored_print(
+            '`compose` runs `docker-compose`. `api` talks to the Docker '
+            'Engine API directly (`/var/run/docker.sock`), without starting '
+            'a process for each step.', CLI.COLOR_INFO)
+        self.__dict['docker_engine'] = CLI.get_response(
+            r'~^(compose|api)$', self.__dict['docker_engine'])
+
+    def __questions_readiness_timeout(self):
+        """
+        Time given to services to answer once their containers are started
+        """
+        CLI.colored_print('How many seconds should services be given to '
+                          'become ready?', CLI.COLOR_QUESTION)
+        CLI.colored_print(
+            'Startup fails if PostgreSQL, the API or the dashboards do not '
+            'answer in time, e.g. while PostgreSQL replays a long WAL.',
+            CLI.COLOR_INFO)
+        self.__dict['readiness_timeout'] = CLI.get_response(
+            r'~^[1-9]\d*$', self.__dict['readiness_timeout'])
+
     def __questions_postgres(self):
         """
         PostgreSQL credentials to be confirmed
@@ -260,8 +352,6 @@ class Config(metaclass=Singleton):
             default=self.__dict['use_backup']
         )
         if self.__dict['use_backup']:
-            self.__dict['use_wal_e'] = False
-
             schedule_regex_pattern = (
                 r'^((((\d+(,\d+)*)|(\d+-\d+)|(\*(\/\d+)?)))'
                 r'(\s+(((\d+(,\d+)*)|(\d+\-\d+)|(\*(\/\d+)?)))){4})$')
@@ -281,8 +371,173 @@ class Config(metaclass=Singleton):
                 '~{}'.format(schedule_regex_pattern),
                 self.__dict['postgres_backup_schedule'])
 
+            CLI.colored_print('How many parallel jobs for PostgreSQL backups?',
+                              CLI.COLOR_QUESTION)
+            CLI.colored_print(
+                'Several `pg_dump` processes share the same snapshot to use '
+                'multiple cores. Use 1 to dump with a single process.',
+                CLI.COLOR_INFO)
+            self.__dict['postgres_backup_dump_jobs'] = CLI.get_response(
+                r'~^[1-9]\d*$', self.__dict['postgres_backup_dump_jobs'])
+
+            CLI.colored_print('Compression of PostgreSQL backups?',
+                              CLI.COLOR_QUESTION)
+            CLI.colored_print(
+                '`zstd` and `gzip` (with `pigz`) compress with several '
+                'threads. `none` keeps `pg_dump` built-in compression.',
+                CLI.COLOR_INFO)
+            self.__dict['postgres_backup_compression'] = CLI.get_response(
+                r'~^(none|zstd|gzip)$',
+                self.__dict['postgres_backup_compression'])
+
+            if self.__dict['postgres_backup_compression'] != 'none':
+                CLI.colored_print(
+                    'Compression level? (leave empty for default)',
+                    CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_compression_level'] = \
+                    CLI.get_response(
+                        r'~^(\d+)?$',
+                        self.__dict['postgres_backup_compression_level'])
+
+                CLI.colored_print(
+                    'Number of compression threads? (0 to use all cores)',
+                    CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_compression_threads'] = \
+                    CLI.get_response(
+                        r'~^\d+$',
+                        self.__dict['postgres_backup_compression_threads'])
+
+            CLI.colored_print('Priority of `pg_dump`?', CLI.COLOR_QUESTION)
+            CLI.colored_print(
+                '`low` and `idle` lower the CPU and I/O priority of the '
+                'backup (`nice`/`ionice`), which then yields to other '
+                'services.', CLI.COLOR_INFO)
+            self.__dict['postgres_backup_priority'] = CLI.get_response(
+                r'~^(normal|low|idle)$',
+                self.__dict['postgres_backup_priority'])
+
+            self.__dict['postgres_backup_dedup'] = CLI.yes_no_question(
+                'Do you want to deduplicate PostgreSQL backups?',
+                default=self.__dict['postgres_backup_dedup']
+            )
+            if self.__dict['postgres_backup_dedup']:
+                CLI.colored_print(
+                    'Dumps are split into chunks which are stored once; each '
+                    'backup only stores chunks which changed since previous '
+                    'ones.', CLI.COLOR_INFO)
+                CLI.colored_print('Average size of chunks (in MB)?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_dedup_chunk_size'] = \
+                    CLI.get_response(
+                        r'~^[1-9]\d*$',
+                        self.__dict['postgres_backup_dedup_chunk_size'])
+
+                if not self.aws:
+                    CLI.colored_print(
+                        'How many deduplicated backups to keep on disk?',
+                        CLI.COLOR_QUESTION)
+                    self.__dict['postgres_backup_dedup_retention'] = \
+                        CLI.get_response(
+                            r'~^[1-9]\d*$',
+                            self.__dict['postgres_backup_dedup_retention'])
+
+            if not self.aws and not self.__dict['postgres_backup_dedup']:
+                CLI.colored_print(
+                    'Backups on disk are sorted in yearly, monthly, weekly '
+                    'and daily tiers. A backup kept by several tiers is '
+                    'stored once.', CLI.COLOR_INFO)
+
+                CLI.colored_print('How many yearly backups to keep on disk?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_local_yearly_retention'] = \
+                    CLI.get_response(
+                        r'~^\d+$',
+                        self.__dict['postgres_backup_local_yearly_retention'])
+
+                CLI.colored_print('How many monthly backups to keep on disk?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_local_monthly_retention'] = \
+                    CLI.get_response(
+                        r'~^\d+$',
+                        self.__dict['postgres_backup_local_monthly_retention'])
+
+                CLI.colored_print('How many weekly backups to keep on disk?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_local_weekly_retention'] = \
+                    CLI.get_response(
+                        r'~^\d+$',
+                        self.__dict['postgres_backup_local_weekly_retention'])
+
+                CLI.colored_print('How many daily backups to keep on disk?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_backup_local_daily_retention'] = \
+                    CLI.get_response(
+                        r'~^\d+$',
+                        self.__dict['postgres_backup_local_daily_retention'])
+
             if self.aws:
                 self.__questions_aws_backup_settings()
+
+            self.__dict['postgres_wal_archiving'] = CLI.yes_no_question(
+                'Do you want to activate continuous archiving of PostgreSQL '
+                'WAL (point-in-time recovery)?',
+                default=self.__dict['postgres_wal_archiving']
+            )
+            if self.__dict['postgres_wal_archiving']:
+                if self.aws and self.__dict['aws_backup_bucket_name']:
+                    response = CLI.yes_no_question(
+                        'Archive WAL to AWS S3 bucket `{}`?'.format(
+                            self.__dict['aws_backup_bucket_name']),
+                        default=self.__dict[
+                            'postgres_wal_archive_destination'] == 's3'
+                    )
+                    self.__dict['postgres_wal_archive_destination'] = \
+                        's3' if response else 'local'
+                else:
+                    self.__dict['postgres_wal_archive_destination'] = 'local'
+
+                if self.__dict['postgres_wal_archive_destination'] == 'local':
+                    CLI.colored_print(
+                        'WAL will be archived in `{}`.'.format(
+                            os.path.join(self.__dict['support_api_path'],
+                                         'wal-archive')),
+                        CLI.COLOR_INFO)
+
+                CLI.colored_print('Base backup cron expression?',
+                                  CLI.COLOR_QUESTION)
+                CLI.colored_print(
+                    'Recovery replays WAL from the last base backup, more '
+                    'frequent base backups make it faster.',
+                    CLI.COLOR_INFO)
+                self.__dict[
+                    'postgres_wal_base_backup_schedule'] = CLI.get_response(
+                    '~{}'.format(schedule_regex_pattern),
+                    self.__dict['postgres_wal_base_backup_schedule'])
+
+                CLI.colored_print('How many base backups to keep?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict[
+                    'postgres_wal_base_backup_retention'] = CLI.get_response(
+                    r'~^[1-9]\d*$',
+                    self.__dict['postgres_wal_base_backup_retention'])
+
+                CLI.colored_print(
+                    'Maximum delay before a WAL file is archived (in '
+                    'seconds)?',
+                    CLI.COLOR_QUESTION)
+                CLI.colored_print(
+                    'This is the maximum data loss. Every delay produces a '
+                    'WAL file of 16 MB (compressed when mostly empty).',
+                    CLI.COLOR_INFO)
+                self.__dict['postgres_wal_archive_timeout'] = \
+                    CLI.get_response(
+                        r'~^[1-9]\d*$',
+                        self.__dict['postgres_wal_archive_timeout'])
+
+                CLI.colored_print('Number of WAL files sent concurrently?',
+                                  CLI.COLOR_QUESTION)
+                self.__dict['postgres_wal_push_jobs'] = CLI.get_response(
+                    r'~^[1-9]\d*$', self.__dict['postgres_wal_push_jobs'])
                     
     def __questions_kobo_api(self):
         """
@@ -524,6 +779,35 @@ class Config(metaclass=Singleton):
             self.__dict['aws_backup_upload_chunk_size'] = CLI.get_response(
                 r'~^\d+$', self.__dict['aws_backup_upload_chunk_size'])
 
+            CLI.colored_print('Number of parts uploaded concurrently?',
+                              CLI.COLOR_QUESTION)
+            CLI.colored_print(
+                'Memory usage is about this number times the chunk size.',
+                CLI.COLOR_INFO)
+            self.__dict['aws_backup_upload_parts_in_flight'] = \
+                CLI.get_response(
+                    r'~^[1-9]\d*$',
+                    self.__dict['aws_backup_upload_parts_in_flight'])
+
+            CLI.colored_print(
+                'Upload bandwidth limit (in MB/s)? (0 for no limit)',
+                CLI.COLOR_QUESTION)
+            self.__dict['aws_backup_upload_rate_limit'] = CLI.get_response(
+                r'~^\d+(\.\d+)?$', self.__dict['aws_backup_upload_rate_limit'])
+
+            CLI.colored_print(
+                'Upload bandwidth limits by time of day? (leave empty for '
+                'none)', CLI.COLOR_QUESTION)
+            CLI.colored_print(
+                'UTC windows with their own limit in MB/s, e.g. '
+                '`08:00-18:00=2,18:00-20:00=10` to slow uploads down during '
+                'business hours. 0 means no limit.', CLI.COLOR_INFO)
+            profile_pattern = r'\d{1,2}:\d{2}-\d{1,2}:\d{2}=\d+(\.\d+)?'
+            self.__dict['aws_backup_upload_rate_profiles'] = \
+                CLI.get_response(
+                    r'~^({0}(,{0})*)?$'.format(profile_pattern),
+                    self.__dict['aws_backup_upload_rate_profiles'])
+
             response = CLI.yes_no_question(
                 'Use AWS LifeCycle deletion rule?',
                 default=self.__dict['aws_backup_bucket_deletion_rule_enabled']
@@ -537,7 +821,14 @@ class Config(metaclass=Singleton):
             'advanced': False,
             'customized_ports': False,
             'support_api_port': 8500,
+            'support_api_replicas': '1',
+            'support_api_domain': '',
+            'letsencrypt_path': '/etc/letsencrypt',
+            'support_api_rolling_update': False,
+            'support_api_alternate_port': '8501',
             'docker_prefix': '',
+            'docker_engine': 'compose',
+            'readiness_timeout': '300',
             'server_role': 'frontend',
 
             'support_api_path': os.path.realpath(os.path.normpath(os.path.join(
@@ -572,6 +863,24 @@ class Config(metaclass=Singleton):
             'multi': False,
             'backup_from_primary': True,
             'postgres_backup_schedule': '0 2 * * 0',
+            'postgres_backup_dump_jobs': '1',
+            'postgres_backup_compression': 'zstd',
+            'postgres_backup_compression_level': '',
+            'postgres_backup_compression_threads': '0',
+            'postgres_backup_priority': 'normal',
+            'postgres_backup_dedup': False,
+            'postgres_backup_dedup_chunk_size': '1',
+            'postgres_backup_dedup_retention': '7',
+            'postgres_backup_local_yearly_retention': '2',
+            'postgres_backup_local_monthly_retention': '12',
+            'postgres_backup_local_weekly_retention': '4',
+            'postgres_backup_local_daily_retention': '7',
+            'postgres_wal_archiving': False,
+            'postgres_wal_archive_destination': 'local',
+            'postgres_wal_base_backup_schedule': '0 3 * * *',
+            'postgres_wal_base_backup_retention': '7',
+            'postgres_wal_archive_timeout': '300',
+            'postgres_wal_push_jobs': '4',
             'aws_backup_bucket_name': '',
             'aws_backup_yearly_retention': '2',
             'aws_backup_monthly_retention': '12',
@@ -579,6 +888,9 @@ class Config(metaclass=Singleton):
             'aws_backup_daily_retention': '30',
             'aws_postgres_backup_minimum_size': '50',
             'aws_backup_upload_chunk_size': '15',
+            'aws_backup_upload_parts_in_flight': '4',
+            'aws_backup_upload_rate_limit': '0',
+            'aws_backup_upload_rate_profiles': '',
             'aws_backup_bucket_deletion_rule_enabled': False
         }
 
@@ -621,6 +933,28 @@ class Config(metaclass=Singleton):
         """
         return self.__dict['server_role'] == 'frontend'
     
+    @property
+    def rolling_update(self):
+        """
+        Checks whether the API is updated with blue/green containers behind
+        a proxy
+
+        Returns:
+            bool
+        """
+        return self.get_value('support_api_rolling_update')
+
+    @property
+    def docker_api(self):
+        """
+        Checks whether containers are managed through the Docker Engine API
+        instead of `docker-compose`
+
+        Returns:
+            bool
+        """
+        return self.get_value('docker_engine') == 'api'
+
     @property
     def aws(self):
         """
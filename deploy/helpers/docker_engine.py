@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+import http.client
+import json
+import os
+import socket
+from threading import local
+from urllib.parse import quote, urlencode
+
+
+class DockerEngineError(Exception):
+    """
+    Error response of the Docker Engine API, e.g. `404 No such container`.
+    """
+
+    def __init__(self, status, message):
+        super().__init__('{} {}'.format(status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+class DockerEngine:
+    """
+    Client of the Docker Engine API over its Unix socket, with the
+    operations needed to manage compose projects (see `ComposeProject`).
+
+    Each thread keeps one connection alive for all its requests, instead of
+    starting a `docker` or `docker-compose` process per operation.
+    """
+
+    DEFAULT_SOCKET = '/var/run/docker.sock'
+    # Seconds to wait for a response. Stopping a container waits for its
+    # own timeout first.
+    TIMEOUT = 300
+
+    def __init__(self, socket_path=None):
+        """
+        Args:
+            socket_path (str): `DOCKER_HOST` (`unix://` only) or
+                `DEFAULT_SOCKET` when `None`
+        """
+        if socket_path is None:
+            docker_host = os.environ.get('DOCKER_HOST', '')
+            if docker_host.startswith('unix://'):
+                socket_path = docker_host[len('unix://'):]
+            elif docker_host:
+                raise ValueError('Unsupported `DOCKER_HOST` `{}`, only Unix '
+                                 'sockets can be used'.format(docker_host))
+            else:
+                socket_path = self.DEFAULT_SOCKET
+        self.socket_path = socket_path
+        self.__local = local()
+
+    def reset(self):
+        connection = getattr(self.__local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.__local.connection = None
+
+    def list_containers(self, labels):
+        """
+        Args:
+            labels (list): `name=value` filters, all must match
+
+        Returns:
+            list: summaries of containers, stopped ones included
+        """
+        return self.request('GET', '/containers/json', {
+            'all': 1,
+            'filters': json.dumps({'label': labels}),
+        })
+
+    def inspect_container(self, name):
+        """
+        Returns:
+            dict: `None` if the container does not exist
+        """
+        return self.request('GET', '/containers/{}/json'.format(
+            quote(name, safe='')), not_found=None)
+
+    def create_container(self, name, config):
+        """
+        Returns:
+            str: ID of the container
+        """
+        return self.request('POST', '/containers/create', {'name': name},
+                            config)['Id']
+
+    def start_container(self, id_):
+        self.request('POST', '/containers/{}/start'.format(id_))
+
+    def stop_container(self, id_, timeout=10):
+        self.request('POST', '/containers/{}/stop'.format(id_),
+                     {'t': timeout})
+
+    def kill_container(self, id_, signal='SIGKILL'):
+        self.request('POST', '/containers/{}/kill'.format(id_),
+                     {'signal': signal})
+
+    def remove_container(self, id_, force=False):
+        self.request('DELETE', '/containers/{}'.format(id_),
+                     {'force': int(force)}, not_found=None)
+
+    def inspect_network(self, name):
+        return self.request('GET', '/networks/{}'.format(
+            quote(name, safe='')), not_found=None)
+
+    def create_network(self, name, driver=None, labels=None):
+        return self.request('POST', '/networks/create', body={
+            'Name': name,
+            'Driver': driver or 'bridge',
+            'Labels': labels or {},
+            'CheckDuplicate': True,
+        })['Id']
+
+    def connect_network(self, name, container_id, aliases=None):
+        self.request('POST', '/networks/{}/connect'.format(
+            quote(name, safe='')), body={
+                'Container': container_id,
+                'EndpointConfig': {'Aliases': aliases or []},
+            })
+
+    def remove_network(self, name):
+        self.request('DELETE', '/networks/{}'.format(quote(name, safe='')),
+                     not_found=None)
+
+    def inspect_volume(self, name):
+        return self.request('GET', '/volumes/{}'.format(
+            quote(name, safe='')), not_found=None)
+
+    def create_volume(self, name, driver=None, labels=None):
+        return self.request('POST', '/volumes/create', body={
+            'Name': name,
+            'Driver': driver or 'local',
+            'Labels': labels or {},
+        })
+
+    def inspect_image(self, name):
+        return self.request('GET', '/images/{}/json'.format(name),
+                            not_found=None)
+
+    def pull_image(self, name, progress=None):
+        """
+        Pull `name` (`repository[:tag]` or `repository@digest`). Progress
+        is streamed until the pull is over.
+
+        Args:
+            progress (callable): receives each progress message (dict with
+                `status`, and `id` for layers)
+        """
+        repository, tag = name, None
+        if '@' not in name:
+            repository, separator, tag = name.rpartition(':')
+            if not separator or '/' in tag:
+                repository, tag = name, 'latest'
+        query = {'fromImage': repository}
+        if tag:
+            query['tag'] = tag
+        for message in self.request('POST', '/images/create', query,
+                                    stream=True):
+            if 'error' in message:
+                raise DockerEngineError(500, message['error'])
+            if progress is not None:
+                progress(message)
+
+    def request(self, method, path, query=None, body=None, stream=False,
+                **kwargs):
+        """
+        Args:
+            query (dict)
+            body: sent as JSON when not `None`
+            stream (bool): return a generator of the JSON messages of the
+                response, one per line, e.g. pull progress
+            not_found: returned for `404` responses when given, which
+                raise `DockerEngineError` otherwise
+
+        Returns:
+            decoded JSON response, `None` if it is empty
+        """
+        if query:
+            path += '?' + urlencode(query)
+        headers = {}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+
+        response = self.__send(method, path, data, headers)
+        if response.status == 404 and 'not_found' in kwargs:
+            response.read()
+            return kwargs['not_found']
+        if response.status >= 400:
+            content = response.read()
+            try:
+                message = json.loads(content)['message']
+            except (ValueError, KeyError, TypeError):
+                message = content.decode(errors='replace') or response.reason
+            raise DockerEngineError(response.status, message)
+
+        if stream:
+            return self.__read_stream(response)
+        content = response.read()
+        return json.loads(content) if content.strip() else None
+
+    def __get_connection(self):
+        """
+        Returns:
+            tuple: connection of the current thread, and whether it has
+            already been used
+        """
+        connection = getattr(self.__local, 'connection', None)
+        if connection is not None:
+            return connection, True
+        connection = UnixHTTPConnection(self.socket_path, self.TIMEOUT)
+        self.__local.connection = connection
+        return connection, False
+
+    def __read_stream(self, response):
+        try:
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+            # Let the connection be reused
+            response.read()
+        except BaseException:
+            self.reset()
+            raise
+
+    def __send(self, method, path, data, headers):
+        while True:
+            connection, reused = self.__get_connection()
+            try:
+                connection.request(method, path, body=data, headers=headers)
+                return connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                self.reset()
+                # The daemon closed the idle connection, retry once with a
+                # new one
+                if not reused:
+                    raise
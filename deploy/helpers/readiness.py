@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+import http.client
+import socket
+import struct
+import time
+from threading import Lock
+
+from helpers.cli import CLI
+
+
+class ReadinessTimeout(Exception):
+    pass
+
+
+class Readiness:
+    """
+    Wait for services to answer requests, not only for their containers to
+    be created: PostgreSQL may still be replaying WAL and applications may
+    still be booting when `docker-compose up -d` returns.
+
+    Probes are retried with an exponential backoff until a deadline shared
+    by all services. Each wait is recorded to report how long every service
+    took to become ready.
+    """
+
+    # Seconds before the second attempt, doubled after each failure up to
+    # `MAX_DELAY`
+    INITIAL_DELAY = 0.25
+    MAX_DELAY = 2
+    # Seconds given to each attempt
+    ATTEMPT_TIMEOUT = 3
+
+    # SQLSTATE `cannot_connect_now`: starting up, shutting down or in
+    # recovery
+    POSTGRES_NOT_READY = '57P03'
+
+    def __init__(self, timeout):
+        """
+        Args:
+            timeout (float): seconds, from now, given to all services to
+                become ready
+        """
+        self.start = time.time()
+        self.deadline = self.start + timeout
+        self.__results = {}
+        self.__lock = Lock()
+
+    def wait(self, name, probe):
+        """
+        Call `probe` until it returns `True`.
+
+        Args:
+            name (str): service, as printed in the report
+            probe (callable): called without arguments, returns whether the
+                service is ready
+
+        Raises:
+            ReadinessTimeout: the deadline has passed
+        """
+        started = time.time()
+        delay = self.INITIAL_DELAY
+        attempts = 0
+        while True:
+            attempts += 1
+            if probe():
+                break
+            now = time.time()
+            if now >= self.deadline:
+                raise ReadinessTimeout(
+                    '{} is not ready after {:.0f}s ({} attempts)'.format(
+                        name, now - self.start, attempts))
+            time.sleep(min(delay, self.deadline - now))
+            delay = min(delay * 2, self.MAX_DELAY)
+
+        with self.__lock:
+            self.__results[name] = {
+                'started': started - self.start,
+                'ready': time.time() - self.start,
+                'attempts': attempts,
+            }
+
+    def print_report(self, title=None):
+        """
+        Print, for each ready service, when its probes started (i.e. once
+        its container was up) and when it answered, since the creation of
+        this object.
+        """
+        if not self.__results:
+            return
+        if title:
+            CLI.colored_print(title, CLI.COLOR_INFO)
+
+        width = max(len(name) for name in self.__results)
+        for name, result in sorted(self.__results.items(),
+                                   key=lambda item: item[1]['ready']):
+            CLI.colored_print(
+                '\t{name:<{width}}  {ready:>6.1f}s  (container up at '
+                '{started:.1f}s, {attempts} probes)'.format(
+                    name=name, width=width, **result),
+                CLI.COLOR_SUCCESS)
+
+    @classmethod
+    def probe_http(cls, host, port, path='/'):
+        """
+        Returns:
+            bool: whether an HTTP server answers on `host:port` with a status
+            other than a server error (e.g. `502` of a proxy whose upstream
+            is still booting)
+        """
+        connection = http.client.HTTPConnection(host, port,
+                                                timeout=cls.ATTEMPT_TIMEOUT)
+        try:
+            connection.request('GET', path)
+            return connection.getresponse().status < 500
+        except (OSError, http.client.HTTPException):
+            return False
+        finally:
+            connection.close()
+
+    @classmethod
+    def probe_postgres(cls, host, port, user, database):
+        """
+        Send a startup message, like `pg_isready`. Credentials are not
+        needed: any answer but `POSTGRES_NOT_READY` means that the server
+        accepts connections.
+
+        Returns:
+            bool
+        """
+        parameters = b''.join(
+            key + b'\0' + value.encode() + b'\0'
+            for key, value in ((b'user', user), (b'database', database))
+        ) + b'\0'
+        # Protocol 3.0
+        message = struct.pack('!ii', 8 + len(parameters), 196608) + parameters
+        try:
+            with socket.create_connection((host, port),
+                                          cls.ATTEMPT_TIMEOUT) as sock:
+                sock.sendall(message)
+                header = cls.__receive(sock, 5)
+                if len(header) < 5:
+                    return False
+                if header[:1] != b'E':
+                    # Authentication request
+                    return True
+                length = struct.unpack('!i', header[1:])[0]
+                fields = cls.__receive(sock, length - 4).split(b'\0')
+        except OSError:
+            return False
+
+        sqlstate = next((field[1:].decode() for field in fields
+                         if field[:1] == b'C'), None)
+        return sqlstate != cls.POSTGRES_NOT_READY
+
+    @staticmethod
+    def __receive(sock, size):
+        """
+        Returns:
+            bytes: `size` bytes, less if the connection is closed first
+        """
+        data = b''
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import os
+import re
+import stat
+
+from helpers.cli import CLI
+
+
+class Reconciler:
+    """
+    Compare the files docker-compose consumes (compose files, env files and
+    scripts directories) and the configuration with the state which was
+    applied last, to restart only the services which are affected by a
+    change.
+
+    Fingerprints are computed per service:
+        - its block in each compose file of its project, plus the top-level
+          sections of these files (networks, volumes...)
+        - every env file it loads (`env_file`)
+        - every scripts directory it mounts (see `MANAGED_DIRECTORIES`)
+    """
+
+    STATE_FILE = '.reconcile.json'
+
+    # Bind-mounted directories whose content is read when the container
+    # starts. Other bind mounts (e.g. `./dashboards`) are data and must not
+    # trigger a restart.
+    MANAGED_DIRECTORIES = ['postgres-scripts', 'shiny-scripts', 'nginx']
+
+    # Configuration keys which are not rendered in any file but change how
+    # every project is handled.
+    GLOBAL_CONFIG_KEYS = ['docker_prefix', 'server_role', 'support_api_path']
+
+    CONFIG_INPUT = 'configuration'
+    COMPOSE_INPUT = 'compose'
+
+    NEW = 'new'
+    RESTART = 'restart'
+    REMOVE = 'remove'
+    UNCHANGED = 'unchanged'
+
+    RELATIVE_PATH_PATTERN = re.compile(r'^\s*-\s*[\'"]?\./([^\'":]+)')
+
+    def __init__(self, config, stacks, contents=None):
+        """
+        Args:
+            config (helpers.config.Config)
+            stacks (dict): see `helpers.command.Command.STACKS`
+            contents (dict): file contents keyed by path, which take
+                precedence over files on disk (e.g. templates rendered in
+                memory)
+        """
+        self.__config = config
+        self.__stacks = stacks
+        self.__path = os.path.realpath(config.get_dict()['support_api_path'])
+        self.__contents = {os.path.realpath(path): content
+                           for path, content in (contents or {}).items()}
+
+    def get_plan(self):
+        """
+        Compare current fingerprints with the ones of the last applied state.
+
+        Returns:
+            list: one dict per service with keys `service`, `role`, `action`
+            and `reasons` (inputs which have changed), sorted by role.
+        """
+        current = self.get_fingerprints()
+        previous = self.__read_state()
+        plan = []
+
+        for service, fingerprint in current['services'].items():
+            previous_fingerprint = previous['services'].get(service)
+            if previous_fingerprint is None:
+                action = self.NEW
+                reasons = []
+            else:
+                reasons = sorted(
+                    input_
+                    for input_ in set(fingerprint['inputs']) |
+                    set(previous_fingerprint['inputs'])
+                    if fingerprint['inputs'].get(input_) !=
+                    previous_fingerprint['inputs'].get(input_)
+                )
+                if previous_fingerprint['role'] != fingerprint['role']:
+                    reasons.append(self.COMPOSE_INPUT)
+                if current['config'] != previous['config']:
+                    reasons.insert(0, self.CONFIG_INPUT)
+                action = self.RESTART if reasons else self.UNCHANGED
+
+            plan.append({
+                'service': service,
+                'role': fingerprint['role'],
+                'action': action,
+                'reasons': reasons,
+            })
+
+        for service, fingerprint in previous['services'].items():
+            if service not in current['services']:
+                plan.append({
+                    'service': service,
+                    'role': fingerprint['role'],
+                    'action': self.REMOVE,
+                    'reasons': [],
+                })
+
+        roles = list(self.__stacks)
+        return sorted(plan, key=lambda x: (roles.index(x['role'])
+                                           if x['role'] in roles
+                                           else len(roles),
+                                           x['service']))
+
+    def get_fingerprints(self):
+        """
+        Returns:
+            dict: `config` fingerprint and per-service `inputs` fingerprints
+        """
+        dict_ = self.__config.get_dict()
+        config = {key: dict_.get(key) for key in self.GLOBAL_CONFIG_KEYS}
+        services = {}
+
+        for role, stack in self.__stacks.items():
+            blocks = {}
+            shared = []
+            for file_ in stack['files']:
+                file_shared, file_blocks = self.__split_compose_file(
+                    self.__read(os.path.join(self.__path, file_)))
+                shared.append(file_shared)
+                for service, block in file_blocks.items():
+                    blocks.setdefault(service, []).append(block)
+
+            for service, service_blocks in blocks.items():
+                inputs = {
+                    self.COMPOSE_INPUT: self.__hash(
+                        '\n'.join(shared + service_blocks))
+                }
+                for relative_path in self.__get_relative_paths(
+                        service_blocks):
+                    fingerprint = self.__hash_path(relative_path)
+                    if fingerprint is not None:
+                        inputs[relative_path] = fingerprint
+
+                services[service] = {'role': role, 'inputs': inputs}
+
+        return {
+            'config': self.__hash(json.dumps(config, sort_keys=True)),
+            'services': services,
+        }
+
+    def print_plan(self, plan):
+        colors = {
+            self.NEW: CLI.COLOR_SUCCESS,
+            self.RESTART: CLI.COLOR_WARNING,
+            self.REMOVE: CLI.COLOR_ERROR,
+        }
+        CLI.colored_print('Reconciliation plan:', CLI.COLOR_INFO)
+        width = max([len(item['service']) for item in plan] or [0])
+        for item in plan:
+            reasons = ' ({})'.format(', '.join(item['reasons'])) \
+                if item['reasons'] else ''
+            CLI.colored_print(
+                '\t{service:<{width}}  {action}{reasons}'.format(
+                    service=item['service'],
+                    width=width,
+                    action=item['action'],
+                    reasons=reasons,
+                ), colors.get(item['action'], CLI.NO_COLOR))
+
+    def save_state(self):
+        """
+        Store current fingerprints as the last applied state.
+        """
+        state_file = os.path.join(self.__path, self.STATE_FILE)
+        try:
+            with open(state_file, 'w') as f:
+                f.write(json.dumps(self.get_fingerprints(), indent=2,
+                                   sort_keys=True))
+            os.chmod(state_file, stat.S_IWRITE | stat.S_IREAD)
+        except (IOError, OSError):
+            CLI.colored_print('Could not write reconciliation state file',
+                              CLI.COLOR_ERROR)
+            return False
+
+        return True
+
+    def __get_relative_paths(self, blocks):
+        paths = []
+        for block in blocks:
+            for line in block.split('\n'):
+                match = self.RELATIVE_PATH_PATTERN.match(line)
+                if match:
+                    path = os.path.normpath(match.group(1))
+                    if path not in paths:
+                        paths.append(path)
+        return paths
+
+    def __hash_path(self, relative_path):
+        path = os.path.join(self.__path, relative_path)
+        if os.path.isfile(path) or os.path.realpath(path) in self.__contents:
+            return self.__hash(self.__read(path))
+
+        if relative_path not in self.MANAGED_DIRECTORIES \
+                or not os.path.isdir(path):
+            return None
+
+        hash_ = hashlib.sha256()
+        for root, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_path = os.path.join(root, filename)
+                hash_.update(os.path.relpath(file_path, path).encode())
+                hash_.update(b'\0')
+                with open(file_path, 'rb') as f:
+                    hash_.update(hashlib.sha256(f.read()).digest())
+        return hash_.hexdigest()
+
+    @staticmethod
+    def __hash(content):
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def __read(self, path):
+        try:
+            return self.__contents[os.path.realpath(path)]
+        except KeyError:
+            pass
+
+        try:
+            with open(path, 'r') as f:
+                return f.read()
+        except IOError:
+            return ''
+
+    def __read_state(self):
+        state_file = os.path.join(self.__path, self.STATE_FILE)
+        try:
+            with open(state_file, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {'config': None, 'services': {}}
+
+    @staticmethod
+    def __split_compose_file(content):
+        """
+        Split a compose file in two parts: the top-level sections other than
+        `services` and one block of lines per service.
+        Comments and blank lines are ignored.
+
+        Returns:
+            tuple: (str, dict)
+        """
+        shared = []
+        services = {}
+        in_services = False
+        service_indent = None
+        current = None
+
+        for line in content.split('\n'):
+            stripped = line.strip()
+            if not stripped or stripped.startswith('#'):
+                continue
+
+            indent = len(line) - len(line.lstrip())
+            if indent == 0:
+                in_services = stripped == 'services:'
+                current = None
+                if not in_services:
+                    shared.append(line)
+                continue
+
+            if not in_services:
+                shared.append(line)
+                continue
+
+            if service_indent is None:
+                service_indent = indent
+
+            if indent == service_indent:
+                current = stripped.rstrip(':').strip('\'"')
+                services[current] = []
+            elif current is not None:
+                services[current].append(line)
+
+        return '\n'.join(shared), {service: '\n'.join(lines)
+                                   for service, lines in services.items()}
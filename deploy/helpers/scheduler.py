@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from helpers.cli import CLI
+
+
+class Step:
+
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    SKIPPED = 'skipped'
+
+    def __init__(self, name, action, depends_on=None):
+        """
+        Args:
+            name (str): unique name of the step
+            action (callable): called without arguments when the step runs
+            depends_on (list): names of the steps which must succeed first
+        """
+        self.name = name
+        self.action = action
+        self.depends_on = list(depends_on or [])
+        self.status = self.PENDING
+        self.duration = None
+        self.error = None
+
+
+class Scheduler:
+    """
+    Run steps concurrently while respecting their dependencies.
+
+    A step starts as soon as all the steps it depends on have succeeded.
+    If a step fails, every step which depends on it (directly or not) is
+    skipped, the others keep running.
+    """
+
+    def __init__(self, max_workers=None):
+        self.__steps = {}
+        self.__max_workers = max_workers
+
+    def add(self, name, action, depends_on=None):
+        self.__steps[name] = Step(name, action, depends_on)
+
+    def run(self, title=None, exit_on_failure=True):
+        """
+        Run all steps and print their timings once they are all finished.
+
+        Args:
+            title (str): header of the timings table
+            exit_on_failure (bool): exit with an error code if any step fails
+
+        Returns:
+            bool: whether all steps succeeded
+        """
+        self.__validate()
+
+        if not self.__steps:
+            return True
+
+        pending = dict(self.__steps)
+        running = {}
+        max_workers = self.__max_workers or len(self.__steps)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                for step in list(pending.values()):
+                    statuses = [self.__steps[name].status
+                                for name in step.depends_on]
+                    if any(status in (Step.FAILED, Step.SKIPPED)
+                           for status in statuses):
+                        step.status = Step.SKIPPED
+                        del pending[step.name]
+                    elif all(status == Step.DONE for status in statuses):
+                        future = executor.submit(self.__run_step, step)
+                        running[future] = step
+                        del pending[step.name]
+
+                if not running:
+                    # Everything left is waiting on skipped steps.
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+
+        self.print_timings(title)
+
+        success = all(step.status == Step.DONE
+                      for step in self.__steps.values())
+        if not success and exit_on_failure:
+            CLI.colored_print('An error has occurred', CLI.COLOR_ERROR)
+            sys.exit(1)
+
+        return success
+
+    def print_timings(self, title=None):
+        if title:
+            CLI.colored_print(title, CLI.COLOR_INFO)
+
+        width = max(len(name) for name in self.__steps)
+        colors = {
+            Step.DONE: CLI.COLOR_SUCCESS,
+            Step.FAILED: CLI.COLOR_ERROR,
+            Step.SKIPPED: CLI.COLOR_WARNING,
+        }
+        for step in self.__steps.values():
+            duration = '{:.1f}s'.format(step.duration) \
+                if step.duration is not None else CLI.EMPTY_CHARACTER
+            CLI.colored_print('\t{name:<{width}}  {status:<7}  {duration}'.format(
+                name=step.name,
+                width=width,
+                status=step.status,
+                duration=duration,
+            ), colors.get(step.status, CLI.NO_COLOR))
+
+    @property
+    def steps(self):
+        return self.__steps
+
+    @staticmethod
+    def __run_step(step):
+        start = time.time()
+        try:
+            step.action()
+            step.status = Step.DONE
+        except SystemExit as e:
+            # `CLI.run_command()` exits on failure, once its error is
+            # printed. Catch it to let the other branches of the graph
+            # finish.
+            step.error = e
+            step.status = Step.FAILED
+        except Exception as e:
+            # Unexpected, nothing has been printed yet
+            for line in traceback.format_exc().splitlines():
+                CLI.print_line(line, prefix=step.name, error=True)
+            step.error = e
+            step.status = Step.FAILED
+        finally:
+            step.duration = time.time() - start
+
+    def __validate(self):
+        for step in self.__steps.values():
+            for name in step.depends_on:
+                if name not in self.__steps:
+                    raise ValueError('Step `{}` depends on unknown step '
+                                     '`{}`'.format(step.name, name))
+
+        # Detect cycles with a depth-first search
+        visiting = set()
+        visited = set()
+
+        def _visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError('Circular dependency on step `{}`'.format(
+                    name))
+            visiting.add(name)
+            for dependency in self.__steps[name].depends_on:
+                _visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.__steps:
+            _visit(name)
@@ -1,54 +1,77 @@
 import sys
 import os
 import shutil
+from helpers.cli import CLI
 from helpers.singleton import Singleton
 from helpers.config import Config
+from helpers.sync import DirectorySync
 
 #from distutils.dir_util import copy_tree
 
 class Support(metaclass=Singleton):
     
-    def copy_support_scripts(self):        
+    def copy_support_scripts(self, checksum=False):
+        """
+        Mirror support scripts into the directories mounted by the
+        containers. Only changed files are copied and files which do not
+        exist anymore in this repository are removed.
+
+        Args:
+            checksum (bool): compare files content, not only their size and
+                modification time
+        """
         
         config = Config()
         dict_ = config.get_dict()
         base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        sync = DirectorySync(checksum=checksum, delete=True,
+                             ignore=shutil.ignore_patterns('__pycache__',
+                                                           '*.pyc'))
 
-        self.copy_shiny(dict_, base_dir)
+        self.copy_shiny(dict_, base_dir, sync)
 
-        self.copy_postgres(dict_, base_dir)
+        self.copy_postgres(dict_, base_dir, sync)
 
-    def copy_shiny(self, dict_, base_dir):
+    def copy_shiny(self, dict_, base_dir, sync):
         # Environment
         shiny_scripts_path = os.path.join(base_dir,
                                        'shiny')
 
         shiny_scripts = os.path.join(dict_['support_api_path'], 'shiny-scripts') 
         
-        self.recursive_overwrite(shiny_scripts_path, shiny_scripts)
+        self.__sync(sync, shiny_scripts_path, shiny_scripts)
 
-    def copy_postgres(self, dict_, base_dir):
+    def copy_postgres(self, dict_, base_dir, sync):
         # Environment
-        shiny_scripts_path = os.path.join(base_dir,
+        postgres_scripts_path = os.path.join(base_dir,
                                        'postgres')
-        shiny_env = os.path.join(dict_['support_api_path'], 'postgres-scripts') 
-        self.recursive_overwrite(shiny_scripts_path, shiny_env)
+        postgres_scripts = os.path.join(dict_['support_api_path'],
+                                        'postgres-scripts')
+        # The S3 client of backup scripts signs its requests like
+        # `AWSValidation`
+        extra = {
+            os.path.join('helpers', 'aws_signature.py'): os.path.join(
+                base_dir, 'helpers', 'aws_signature.py'),
+        }
+        self.__sync(sync, postgres_scripts_path, postgres_scripts, extra)
 
+    @staticmethod
+    def __sync(sync, src, dest, extra=None):
+        try:
+            statuses = sync.sync(src, dest, extra)
+        except (IOError, OSError) as e:
+            CLI.colored_print('Could not copy {} to {}: {}'.format(
+                src, dest, e), CLI.COLOR_ERROR)
+            sys.exit(1)
 
-    def recursive_overwrite(self, src, dest, ignore=None):
-        
-        if os.path.isdir(src):
-            if not os.path.isdir(dest):
-                os.makedirs(dest)
-            files = os.listdir(src)
-            if ignore is not None:
-                ignored = ignore(src, files)
-            else:
-                ignored = set()
-            for f in files:
-                if f not in ignored:
-                    self.recursive_overwrite(os.path.join(src, f), 
-                                        os.path.join(dest, f), 
-                                        ignore)
-        else:
-            shutil.copyfile(src, dest)
\ No newline at end of file
+        changes = {status: [path for path, status_ in statuses.items()
+                            if status_ == status]
+                   for status in [DirectorySync.COPIED,
+                                  DirectorySync.DELETED]}
+        CLI.colored_print('{}: {} copied, {} deleted, {} unchanged'.format(
+            dest,
+            len(changes[DirectorySync.COPIED]),
+            len(changes[DirectorySync.DELETED]),
+            len(statuses) - len(changes[DirectorySync.COPIED]) -
+            len(changes[DirectorySync.DELETED])),
+            CLI.COLOR_SUCCESS)
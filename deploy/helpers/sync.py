@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import shutil
+import stat
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DirectorySync:
+    """
+    Mirror a directory into another one, rsync-style.
+
+    A file is copied only if its size, modification time or permissions
+    differ from the destination (or its content, when `checksum` is
+    enabled). Copied files get the permissions and modification time of
+    their source, so executable bits are kept and the next run can skip
+    them.
+    """
+
+    COPIED = 'copied'
+    DELETED = 'deleted'
+    UNCHANGED = 'unchanged'
+
+    # Bytes per `os.copy_file_range()` call
+    COPY_CHUNK_SIZE = 2 ** 30
+
+    def __init__(self, checksum=False, delete=False, max_workers=None,
+                 ignore=None):
+        """
+        Args:
+            checksum (bool): compare content hashes of files with same
+                size and modification time
+            delete (bool): remove destination files which do not exist in
+                source
+            max_workers (int): number of files copied concurrently
+            ignore (callable): same signature as `shutil.copytree()`'s
+                `ignore`
+        """
+        self.checksum = checksum
+        self.delete = delete
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.ignore = ignore
+
+    def sync(self, src, dest, extra=None):
+        """
+        Args:
+            src (str): source directory
+            dest (str): destination directory
+            extra (dict): files from outside `src` to mirror too, source
+                paths keyed by path relative to `dest`
+
+        Returns:
+            dict: status (`DirectorySync.COPIED`, `DirectorySync.DELETED` or
+            `DirectorySync.UNCHANGED`) keyed by path relative to `dest`
+        """
+        files = {}
+        directories = set()
+        for root, dirnames, filenames in os.walk(src):
+            if self.ignore is not None:
+                ignored = self.ignore(root, dirnames + filenames)
+                dirnames[:] = [d for d in dirnames if d not in ignored]
+                filenames = [f for f in filenames if f not in ignored]
+
+            relative_root = os.path.relpath(root, src)
+            directories.add(os.path.normpath(relative_root))
+            os.makedirs(os.path.join(dest, relative_root), exist_ok=True)
+            for filename in filenames:
+                relative_path = os.path.normpath(
+                    os.path.join(relative_root, filename))
+                files[relative_path] = os.path.join(src, relative_path)
+
+        for relative_path, path in (extra or {}).items():
+            relative_path = os.path.normpath(relative_path)
+            relative_root = os.path.dirname(relative_path)
+            while relative_root:
+                directories.add(relative_root)
+                relative_root = os.path.dirname(relative_root)
+            os.makedirs(os.path.dirname(os.path.join(dest, relative_path)),
+                        exist_ok=True)
+            files[relative_path] = path
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            statuses = dict(zip(files, executor.map(
+                lambda f: self.__sync_file(files[f], os.path.join(dest, f)),
+                files)))
+
+        if self.delete:
+            statuses.update(self.__delete_orphans(dest, set(files),
+                                                  directories))
+
+        return statuses
+
+    def __delete_orphans(self, dest, files, directories):
+        statuses = {}
+        for root, dirnames, filenames in os.walk(dest, topdown=False):
+            relative_root = os.path.normpath(os.path.relpath(root, dest))
+            for filename in filenames:
+                relative_path = os.path.normpath(
+                    os.path.join(relative_root, filename))
+                if relative_path not in files:
+                    os.unlink(os.path.join(root, filename))
+                    statuses[relative_path] = self.DELETED
+            if relative_root not in directories:
+                try:
+                    os.rmdir(root)
+                except OSError:
+                    pass
+        return statuses
+
+    def __sync_file(self, src, dest):
+        src_stat = os.stat(src)
+        try:
+            dest_stat = os.stat(dest)
+        except FileNotFoundError:
+            dest_stat = None
+
+        if dest_stat is not None \
+                and src_stat.st_size == dest_stat.st_size \
+                and src_stat.st_mtime_ns == dest_stat.st_mtime_ns \
+                and stat.S_IMODE(src_stat.st_mode) == \
+                stat.S_IMODE(dest_stat.st_mode) \
+                and (not self.checksum
+                     or self.__hash(src) == self.__hash(dest)):
+            return self.UNCHANGED
+
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dest),
+                                        prefix='.{}.'.format(
+                                            os.path.basename(dest)))
+        os.close(fd)
+        try:
+            self.__copy_content(src, tmp_path, src_stat.st_size)
+            os.chmod(tmp_path, stat.S_IMODE(src_stat.st_mode))
+            os.utime(tmp_path, ns=(src_stat.st_atime_ns,
+                                   src_stat.st_mtime_ns))
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return self.COPIED
+
+    @classmethod
+    def __copy_content(cls, src, dest, size):
+        """
+        Copy in kernel space with `copy_file_range()` (which may even
+        share blocks on filesystems supporting reflinks) when available.
+        Fall back on `shutil.copyfile()`, which uses `sendfile()` or
+        `fcopyfile()` fast paths itself.
+        """
+        if hasattr(os, 'copy_file_range'):
+            try:
+                with open(src, 'rb') as fsrc, open(dest, 'wb') as fdest:
+                    offset = 0
+                    while offset < size:
+                        copied = os.copy_file_range(
+                            fsrc.fileno(), fdest.fileno(),
+                            min(cls.COPY_CHUNK_SIZE, size - offset))
+                        if copied == 0:
+                            break
+                        offset += copied
+                if offset == size:
+                    return
+                # Source has been truncated meanwhile, start over
+            except OSError:
+                # Not supported, e.g. across devices on older kernels
+                pass
+
+        shutil.copyfile(src, dest)
+
+    @staticmethod
+    def __hash(path):
+        hash_ = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                hash_.update(block)
+        return hash_.hexdigest()
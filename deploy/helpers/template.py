@@ -1,11 +1,13 @@
 # -*- coding: utf-8 -*-
 import fnmatch
+import hashlib
 import json
 import os
 import re
 import stat
 import sys
-from string import Template as PyTemplate
+import tempfile
+import time
 from urllib.parse import quote_plus
 
 from helpers.cli import CLI
@@ -14,40 +16,55 @@ from helpers.config import Config
 
 class Template:
     UNIQUE_ID_FILE = '.uniqid'
+    MANIFEST_FILE = '.render-manifest.json'
+
+    CHANGED = 'changed'
+    UNCHANGED = 'unchanged'
 
     @classmethod
-    def render(cls, config, force=False):
+    def render(cls, config, force=False, dry_run=False):
         """
         Write configuration files based on `config`
 
+        Templates are rendered in memory first. Only files whose content
+        differs from what is on disk are (atomically) written, others are
+        left untouched to keep their modification time.
+
         Args:
             config (helpers.config.Config)
             force (bool)
+            dry_run (bool): render in memory only, nothing is written
+
+        Returns:
+            dict: rendered files, keyed by destination path. Values are
+            dicts with `content`, `sha256` and `status` (`Template.CHANGED`
+            or `Template.UNCHANGED`)
         """
 
         dict_ = config.get_dict()
         template_variables = cls.__get_template_variables(config)
 
         environment_directory = config.get_env_files_path()
-        unique_id = cls.__read_unique_id(environment_directory)
-        if (
-            not force and unique_id
-            and str(dict_.get('unique_id', '')) != str(unique_id)
-        ):
-            message = (
-                'WARNING!\n\n'
-                'Existing environment files are detected. Files will be '
-                'overwritten.'
-            )
-            CLI.framed_print(message)
-            response = CLI.yes_no_question(
-                'Do you want to continue?',
-                default=False
-            )
-            if not response:
-                sys.exit(0)
-
-        cls.__write_unique_id(environment_directory, dict_['unique_id'])
+        if not dry_run:
+            unique_id = cls.__read_unique_id(environment_directory)
+            if (
+                not force and unique_id
+                and str(dict_.get('unique_id', '')) != str(unique_id)
+            ):
+                message = (
+                    'WARNING!\n\n'
+                    'Existing environment files are detected. Files will be '
+                    'overwritten.'
+                )
+                CLI.framed_print(message)
+                response = CLI.yes_no_question(
+                    'Do you want to continue?',
+                    default=False
+                )
+                if not response:
+                    sys.exit(0)
+
+            cls.__write_unique_id(environment_directory, dict_['unique_id'])
 
         base_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
         templates_path_parent = os.path.join(base_dir, 'templates')
@@ -56,16 +73,24 @@ class Template:
         templates_path = os.path.join(templates_path_parent,
                                       Config.ENV_FILES_DIR,
                                       '')
+        contents = {}
         for root, dirnames, filenames in os.walk(templates_path):
-            destination_directory = cls.__create_directory(
+            destination_directory = os.path.realpath(os.path.join(
                 environment_directory,
-                root,
-                templates_path)
+                os.path.join(root, '').replace(templates_path, '')
+            ))
+            contents.update(cls.__render_templates(template_variables,
+                                                   root,
+                                                   destination_directory,
+                                                   filenames))
+
+        if dry_run:
+            return cls.__compare_files(contents)
 
-            cls.__write_templates(template_variables,
-                                  root,
-                                  destination_directory,
-                                  filenames)
+        files = cls.__write_files(contents)
+        cls.__write_manifest(environment_directory, files)
+        cls.__print_report(files)
+        return files
 
     @classmethod
     def render_maintenance(cls, config):
@@ -82,10 +107,10 @@ class Template:
             filenames = [filename
                          for filename in filenames if 'maintenance' in filename]
             destination_directory = dict_['kobodocker_path']
-            cls.__write_templates(template_variables,
-                                  root,
-                                  destination_directory,
-                                  filenames)
+            cls.__write_files(cls.__render_templates(template_variables,
+                                                     root,
+                                                     destination_directory,
+                                                     filenames))
 
     @classmethod
     def __create_directory(cls, template_root_directory, path='', base_dir=''):
@@ -118,7 +143,12 @@ class Template:
         Args:
             config (helpers.config.Config)
         """
-        dict_ = config.get_dict()
+        # Files may be rendered from a configuration saved by an older
+        # version, which lacks newer keys.
+        dict_ = config.get_upgraded_dict()
+
+        use_wal_archiving = dict_['use_backup'] and \
+            dict_['postgres_wal_archiving']
 
         def _get_value(property_, true_value='', false_value='#',
                        comparison_value=True):
@@ -128,6 +158,11 @@ class Template:
 
         return {
             'SUPPORT_API_PORT': dict_['support_api_port'],
+            'SUPPORT_API_ALTERNATE_PORT': dict_['support_api_alternate_port'],
+            'USE_ROLLING_UPDATE': _get_value('support_api_rolling_update'),
+            'SUPPORT_API_DOMAIN': dict_['support_api_domain'],
+            'USE_HTTPS': '' if dict_['support_api_domain'] else '#',
+            'LETSENCRYPT_PATH': dict_['letsencrypt_path'],
             'SUPPORT_DB_NAME': dict_['support_db_name'],
             'SUPPORT_DB_USER': dict_['support_db_user'],
             'SUPPORT_DB_PASSWORD': dict_['support_db_password'],
@@ -144,6 +179,30 @@ class Template:
             'KOBO_DB_PASSWORD': dict_['kobo_db_password'],
             'KOBO_API_URI': dict_['kobo_api_uri'],
             'POSTGRES_BACKUP_SCHEDULE': dict_['postgres_backup_schedule'],
+            'POSTGRES_BACKUP_DUMP_JOBS': dict_['postgres_backup_dump_jobs'],
+            'POSTGRES_BACKUP_COMPRESSION': dict_['postgres_backup_compression'],
+            'POSTGRES_BACKUP_COMPRESSION_LEVEL': dict_['postgres_backup_compression_level'],
+            'POSTGRES_BACKUP_COMPRESSION_THREADS': dict_['postgres_backup_compression_threads'],
+            'POSTGRES_BACKUP_PRIORITY': dict_['postgres_backup_priority'],
+            'POSTGRES_BACKUP_DEDUP': _get_value('postgres_backup_dedup',
+                                                'True', 'False'),
+            'USE_BACKUP_DEDUP': _get_value('postgres_backup_dedup'),
+            'POSTGRES_BACKUP_DEDUP_CHUNK_SIZE': dict_['postgres_backup_dedup_chunk_size'],
+            'POSTGRES_BACKUP_DEDUP_RETENTION': dict_['postgres_backup_dedup_retention'],
+            'POSTGRES_BACKUP_LOCAL_YEARLY_RETENTION': dict_['postgres_backup_local_yearly_retention'],
+            'POSTGRES_BACKUP_LOCAL_MONTHLY_RETENTION': dict_['postgres_backup_local_monthly_retention'],
+            'POSTGRES_BACKUP_LOCAL_WEEKLY_RETENTION': dict_['postgres_backup_local_weekly_retention'],
+            'POSTGRES_BACKUP_LOCAL_DAILY_RETENTION': dict_['postgres_backup_local_daily_retention'],
+            'POSTGRES_WAL_ARCHIVING': str(use_wal_archiving),
+            'USE_WAL_ARCHIVING': '' if use_wal_archiving else '#',
+            'USE_LOCAL_WAL_ARCHIVE': '' if (
+                use_wal_archiving and
+                dict_['postgres_wal_archive_destination'] == 'local') else '#',
+            'POSTGRES_WAL_ARCHIVE_DESTINATION': dict_['postgres_wal_archive_destination'],
+            'POSTGRES_WAL_BASE_BACKUP_SCHEDULE': dict_['postgres_wal_base_backup_schedule'],
+            'POSTGRES_WAL_BASE_BACKUP_RETENTION': dict_['postgres_wal_base_backup_retention'],
+            'POSTGRES_WAL_ARCHIVE_TIMEOUT': dict_['postgres_wal_archive_timeout'],
+            'POSTGRES_WAL_PUSH_JOBS': dict_['postgres_wal_push_jobs'],
             'AWS_POSTGRES_BACKUP_MINIMUM_SIZE': dict_['aws_postgres_backup_minimum_size'],
             'AWS_BACKUP_YEARLY_RETENTION': dict_['aws_backup_yearly_retention'],
             'AWS_BACKUP_MONTHLY_RETENTION': dict_['aws_backup_monthly_retention'],
@@ -160,6 +219,9 @@ class Template:
                                      dict_['use_backup']) else '#',
             'AWS_BACKUP_BUCKET_NAME': dict_['aws_backup_bucket_name'],
             'AWS_BACKUP_UPLOAD_CHUNK_SIZE': dict_['aws_backup_upload_chunk_size'],
+            'AWS_BACKUP_UPLOAD_PARTS_IN_FLIGHT': dict_['aws_backup_upload_parts_in_flight'],
+            'AWS_BACKUP_UPLOAD_RATE_LIMIT': dict_['aws_backup_upload_rate_limit'],
+            'AWS_BACKUP_UPLOAD_RATE_PROFILES': dict_['aws_backup_upload_rate_profiles'],
             
             'DASHBOARDS_PORT': dict_['dashboards_port'],
             'DASHBOARDS_KOBO_TOKEN': dict_['dashboards_kobo_token'],
@@ -188,14 +250,127 @@ class Template:
         return unique_id
 
     @staticmethod
-    def __write_templates(template_variables_, root_, destination_directory_,
-                          filenames_):
+    def __render_templates(template_variables_, root_, destination_directory_,
+                           filenames_):
+        """
+        Render templates in memory
+
+        Returns:
+            dict: rendered content keyed by destination path
+        """
+        contents = {}
         for filename in fnmatch.filter(filenames_, '*.tpl'):
             with open(os.path.join(root_, filename), 'r') as template:
-                t = ExtendedPyTemplate(template.read(), template_variables_)
-                with open(os.path.join(destination_directory_, filename[:-4]),
-                          'w') as f:
-                    f.write(t.substitute(template_variables_))
+                t = CompiledTemplate.compile(template.read())
+                destination = os.path.join(destination_directory_,
+                                           filename[:-4])
+                contents[destination] = t.render(template_variables_)
+        return contents
+
+    @staticmethod
+    def __compare_files(contents):
+        """
+        Compare rendered `contents` with files on disk
+
+        Returns:
+            dict: see `Template.render()`
+        """
+        files = {}
+        for destination, content in contents.items():
+            sha256 = hashlib.sha256(content.encode()).hexdigest()
+            try:
+                with open(destination, 'rb') as f:
+                    current_sha256 = hashlib.sha256(f.read()).hexdigest()
+            except IOError:
+                current_sha256 = None
+
+            files[destination] = {
+                'content': content,
+                'sha256': sha256,
+                'status': Template.UNCHANGED
+                if sha256 == current_sha256 else Template.CHANGED
+            }
+        return files
+
+    @classmethod
+    def __write_files(cls, contents):
+        """
+        Write changed files only. Content is written to a temporary file
+        in the same directory and renamed over the destination, so readers
+        never see a partially written file.
+
+        Returns:
+            dict: see `Template.render()`
+        """
+        files = cls.__compare_files(contents)
+        for destination, file_ in files.items():
+            if file_['status'] == cls.UNCHANGED:
+                continue
+
+            destination_directory = os.path.dirname(destination)
+            cls.__create_directory(destination_directory)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=destination_directory,
+                prefix='.{}.'.format(os.path.basename(destination)))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(file_['content'])
+                try:
+                    mode = stat.S_IMODE(os.stat(destination).st_mode)
+                except OSError:
+                    umask = os.umask(0)
+                    os.umask(umask)
+                    mode = 0o666 & ~umask
+                os.chmod(tmp_path, mode)
+                os.replace(tmp_path, destination)
+            except (IOError, OSError):
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                CLI.colored_print('Could not write {}. '
+                                  'Please verify permissions!'.format(
+                                      destination),
+                                  CLI.COLOR_ERROR)
+                sys.exit(1)
+
+        return files
+
+    @classmethod
+    def __write_manifest(cls, destination_directory, files):
+        """
+        Write the per-file hashes and status of last rendering to
+        `Template.MANIFEST_FILE`, for other tools to consume.
+        """
+        manifest = {
+            'date_rendered': int(time.time()),
+            'files': {
+                os.path.relpath(destination, destination_directory): {
+                    'sha256': file_['sha256'],
+                    'status': file_['status'],
+                }
+                for destination, file_ in files.items()
+            }
+        }
+        try:
+            manifest_file = os.path.join(destination_directory,
+                                         cls.MANIFEST_FILE)
+            with open(manifest_file, 'w') as f:
+                f.write(json.dumps(manifest, indent=2, sort_keys=True))
+        except (IOError, OSError):
+            CLI.colored_print('Could not write render manifest',
+                              CLI.COLOR_ERROR)
+
+    @staticmethod
+    def __print_report(files):
+        changed = sorted(destination
+                         for destination, file_ in files.items()
+                         if file_['status'] == Template.CHANGED)
+        for destination in changed:
+            CLI.colored_print('\t{}: changed'.format(destination),
+                              CLI.COLOR_INFO)
+        CLI.colored_print(
+            'Configuration files: {} changed, {} unchanged'.format(
+                len(changed), len(files) - len(changed)),
+            CLI.COLOR_SUCCESS)
 
     @classmethod
     def __write_unique_id(cls, destination_directory, unique_id):
@@ -217,9 +392,10 @@ class Template:
         return True
 
 
-class ExtendedPyTemplate(PyTemplate):
+class CompiledTemplate:
     """
-    Basic class to add conditional substitution to `string.Template`
+    Template engine which adds conditional substitution to `string.Template`
+    syntax.
 
     Usage example:
     ```
@@ -250,22 +426,180 @@ class ExtendedPyTemplate(PyTemplate):
     }
     ```
 
+    Whitespace following `{% if X %}` and preceding `{% endif X %}` is
+    removed when `X` is truthy. Conditions on variables which are not passed
+    to `render()` are left as is.
+
+    Templates are tokenized once with a single regular expression into a
+    tree of nodes, which is cached by content hash. Rendering is one linear
+    walk of that tree.
     """
-    IF_PATTERN = '{{% if {} %}}'
-    ENDIF_PATTERN = '{{% endif {} %}}'
-
-    def __init__(self, template, template_variables_):
-        for key, value in template_variables_.items():
-            if self.IF_PATTERN.format(key) in template:
-                if value:
-                    if_pattern = r'{}\s*'.format(self.IF_PATTERN.format(key))
-                    endif_pattern = r'\s*{}'.format(
-                        self.ENDIF_PATTERN.format(key))
-                    template = re.sub(if_pattern, '', template)
-                    template = re.sub(endif_pattern, '', template)
-                else:
-                    pattern = r'{}(.|\s)*?{}'.format(
-                        self.IF_PATTERN.format(key),
-                        self.ENDIF_PATTERN.format(key))
-                    template = re.sub(pattern, '', template)
-        super(ExtendedPyTemplate, self).__init__(template)
+    TOKEN_PATTERN = re.compile(r'''
+        \{%\ if\ (?P<if>\w+)\ %\}\s*                |
+        \{%\ endif\ (?P<endif>\w+)\ %\}               |
+        \$(?:
+            (?P<escaped>\$)                              |
+            (?P<named>(?ai:[_a-z][_a-z0-9]*))            |
+            {(?P<braced>(?ai:[_a-z][_a-z0-9]*))}         |
+            (?P<invalid>)
+        )
+    ''', re.VERBOSE)
+
+    # Node types
+    TEXT = 0
+    VARIABLE = 1
+    CONDITION = 2
+    INVALID = 3
+
+    __cache = {}
+
+    def __init__(self, template):
+        self.template = template
+        self.nodes = self.__parse(template)
+
+    @classmethod
+    def compile(cls, template):
+        """
+        Return compiled `template`, parsing it only if it has not been seen
+        yet.
+
+        Args:
+            template (str)
+
+        Returns:
+            CompiledTemplate
+        """
+        key = hashlib.sha256(template.encode()).hexdigest()
+        try:
+            return cls.__cache[key]
+        except KeyError:
+            compiled_template = cls(template)
+            cls.__cache[key] = compiled_template
+            return compiled_template
+
+    def render(self, template_variables_):
+        """
+        Args:
+            template_variables_ (dict)
+
+        Returns:
+            str
+        """
+        output = []
+        self.__render_nodes(self.nodes, template_variables_, output)
+        return ''.join(output)
+
+    def __parse(self, template):
+        """
+        Build a tree of nodes:
+            - `(TEXT, text)`
+            - `(VARIABLE, name)`
+            - `(INVALID, position)`
+            - `[CONDITION, name, opening_tag, children, closing_tag,
+                preceding_space]`
+              `closing_tag` is `None` when the condition is never closed.
+              `preceding_space` is the whitespace before an empty condition,
+              which is removed along with it when it is truthy.
+        """
+        root = []
+        # Open conditions, innermost last
+        stack = []
+        nodes = root
+        position = 0
+
+        for match in self.TOKEN_PATTERN.finditer(template):
+            start = match.start()
+            if start > position:
+                nodes.append((self.TEXT, template[position:start]))
+            position = match.end()
+
+            if match.group('if') is not None:
+                condition = [self.CONDITION, match.group('if'),
+                             match.group(0), [], None, '']
+                nodes.append(condition)
+                stack.append(condition)
+                nodes = condition[3]
+            elif match.group('endif') is not None:
+                name = match.group('endif')
+                if not stack or stack[-1][1] != name:
+                    nodes.append((self.TEXT, match.group(0)))
+                    continue
+                condition = stack.pop()
+                closing_tag = match.group(0)
+                # Strip whitespace preceding the closing tag
+                if nodes and nodes[-1][0] == self.TEXT:
+                    text = nodes[-1][1]
+                    stripped_text = text.rstrip()
+                    closing_tag = text[len(stripped_text):] + closing_tag
+                    if stripped_text:
+                        nodes[-1] = (self.TEXT, stripped_text)
+                    else:
+                        nodes.pop()
+                condition[4] = closing_tag
+                nodes = stack[-1][3] if stack else root
+                # Once the opening tag is removed, nothing separates the
+                # closing tag from the text preceding the condition.
+                if not condition[3] and len(nodes) > 1 \
+                        and nodes[-2][0] == self.TEXT:
+                    text = nodes[-2][1]
+                    stripped_text = text.rstrip()
+                    condition[5] = text[len(stripped_text):]
+                    if stripped_text:
+                        nodes[-2] = (self.TEXT, stripped_text)
+                    else:
+                        del nodes[-2]
+            elif match.group('escaped') is not None:
+                nodes.append((self.TEXT, '$'))
+            elif match.group('named') is not None:
+                nodes.append((self.VARIABLE, match.group('named')))
+            elif match.group('braced') is not None:
+                nodes.append((self.VARIABLE, match.group('braced')))
+            else:
+                nodes.append((self.INVALID, start))
+
+        if position < len(template):
+            nodes.append((self.TEXT, template[position:]))
+
+        return root
+
+    def __render_nodes(self, nodes, template_variables_, output):
+        for node in nodes:
+            type_ = node[0]
+            if type_ == self.TEXT:
+                output.append(node[1])
+            elif type_ == self.VARIABLE:
+                output.append(str(template_variables_[node[1]]))
+            elif type_ == self.CONDITION:
+                name, opening_tag, children, closing_tag, preceding_space = \
+                    node[1:]
+                if name not in template_variables_ \
+                        or not template_variables_[name]:
+                    output.append(preceding_space)
+
+                if name not in template_variables_:
+                    output.append(opening_tag)
+                    self.__render_nodes(children, template_variables_,
+                                        output)
+                    if closing_tag is not None:
+                        output.append(closing_tag)
+                elif template_variables_[name]:
+                    self.__render_nodes(children, template_variables_,
+                                        output)
+                elif closing_tag is None:
+                    # Never closed, there is nothing to remove
+                    output.append(opening_tag)
+                    self.__render_nodes(children, template_variables_,
+                                        output)
+            else:
+                self.__raise_invalid(node[1])
+
+    def __raise_invalid(self, position):
+        lines = self.template[:position].splitlines(keepends=True)
+        if not lines:
+            column = 1
+            line = 1
+        else:
+            column = position - len(''.join(lines[:-1]))
+            line = len(lines)
+        raise ValueError('Invalid placeholder in string: line {}, '
+                         'col {}'.format(line, column))
@@ -0,0 +1,21 @@
+#!/bin/sh
+# PostgreSQL `archive_command`, called with `%p %f`.
+# Copies a completed WAL file into the spool directory shared with
+# `support-postgres-backup`, whose `wal-archive.py push` sends it to the
+# archive. Runs in `support-postgres`, which has no bash.
+
+set -e
+
+WAL_PATH="$1"
+WAL_NAME="$2"
+SPOOL_DIR="${3:-/var/lib/postgresql/wal-spool}"
+
+# Already spooled (e.g. PostgreSQL restarted before it recorded the success)
+if [ -f "${SPOOL_DIR}/${WAL_NAME}" ]; then
+    cmp -s "${WAL_PATH}" "${SPOOL_DIR}/${WAL_NAME}"
+    exit $?
+fi
+
+# The file must be on disk before PostgreSQL recycles the segment
+dd if="${WAL_PATH}" of="${SPOOL_DIR}/.${WAL_NAME}.tmp" bs=1M conv=fsync 2> /dev/null
+mv "${SPOOL_DIR}/.${WAL_NAME}.tmp" "${SPOOL_DIR}/${WAL_NAME}"
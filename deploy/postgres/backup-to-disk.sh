@@ -1,11 +1,57 @@
 #!/bin/bash
 set -e
+set -o pipefail
 
 DBDATESTAMP="$(date +%Y.%m.%d.%H_%M)"
 BACKUP_FILENAME="postgres-support-${DBDATESTAMP}.pg_dump"
+DUMP_JOBS="${POSTGRES_BACKUP_DUMP_JOBS:-1}"
+COMPRESSION="${POSTGRES_BACKUP_COMPRESSION:-none}"
+COMPRESSION_LEVEL="${POSTGRES_BACKUP_COMPRESSION_LEVEL}"
+COMPRESSION_THREADS="${POSTGRES_BACKUP_COMPRESSION_THREADS:-0}"
+# CPU and I/O priority of `pg_dump` (same as `Priority` of
+# `helpers/throttle.py`)
+case "${POSTGRES_BACKUP_PRIORITY:-normal}" in
+    low) PRIORITY="nice -n 10" IONICE="ionice -c 2 -n 7" ;;
+    idle) PRIORITY="nice -n 19" IONICE="ionice -c 3" ;;
+    *) PRIORITY="" IONICE="" ;;
+esac
+if [[ -n "${IONICE}" ]] && command -v ionice > /dev/null; then
+    PRIORITY="${PRIORITY} ${IONICE}"
+fi
+
+if [[ "${POSTGRES_BACKUP_DEDUP}" == "True" ]]; then
+    # Chunks already stored by previous backups are not written again
+    exec python3 /postgres-scripts/dedup-backup.py backup
+fi
+
 cd /srv/backups
-rm -rf *.pg_dump
+# Dumps are written under a temporary name and only join the rotation (see
+# `rotate-backups.py`) once complete, so a failed dump never replaces a
+# previous backup. Leftovers of interrupted runs are removed.
+rm -rf .postgres-*.tmp
+TMP_FILENAME=".${BACKUP_FILENAME}.tmp"
+
+if [[ "${DUMP_JOBS}" -gt 1 ]]; then
+    # Directory format is the only one `pg_dump` can write with several jobs.
+    # Each job compresses its own files, no external compression stage.
+    BACKUP_FILENAME="${BACKUP_FILENAME}.d"
+    PGPASSWORD=${SUPPORT_DB_PASSWORD} ${PRIORITY} pg_dump -U ${SUPPORT_DB_USER} --port ${SUPPORT_DB_PORT} -h ${KOBO_DB_SERVER} -d ${SUPPORT_DB_NAME} --format=directory --jobs="${DUMP_JOBS}" --file="${TMP_FILENAME}"
+elif [[ "${COMPRESSION}" == "zstd" ]]; then
+    # `pg_dump` writes uncompressed data, multi-threaded `zstd` compresses it
+    BACKUP_FILENAME="${BACKUP_FILENAME}.zst"
+    PGPASSWORD=${SUPPORT_DB_PASSWORD} ${PRIORITY} pg_dump -U ${SUPPORT_DB_USER} --port ${SUPPORT_DB_PORT} -h ${KOBO_DB_SERVER} -d ${SUPPORT_DB_NAME} --format=custom --compress=0 \
+        | zstd --quiet --stdout -"${COMPRESSION_LEVEL:-3}" --threads="${COMPRESSION_THREADS}" > "${TMP_FILENAME}"
+elif [[ "${COMPRESSION}" == "gzip" ]]; then
+    # Unlike `zstd`, `pigz` does not accept 0 threads
+    [[ "${COMPRESSION_THREADS}" -eq 0 ]] && COMPRESSION_THREADS="$(nproc)"
+    BACKUP_FILENAME="${BACKUP_FILENAME}.gz"
+    PGPASSWORD=${SUPPORT_DB_PASSWORD} ${PRIORITY} pg_dump -U ${SUPPORT_DB_USER} --port ${SUPPORT_DB_PORT} -h ${KOBO_DB_SERVER} -d ${SUPPORT_DB_NAME} --format=custom --compress=0 \
+        | pigz --stdout -"${COMPRESSION_LEVEL:-6}" --processes "${COMPRESSION_THREADS}" > "${TMP_FILENAME}"
+else
+    PGPASSWORD=${SUPPORT_DB_PASSWORD} ${PRIORITY} pg_dump -U ${SUPPORT_DB_USER} --port ${SUPPORT_DB_PORT} -h ${KOBO_DB_SERVER} -d ${SUPPORT_DB_NAME} --format=custom > "${TMP_FILENAME}"
+fi
 
-PGPASSWORD=${SUPPORT_DB_PASSWORD} pg_dump -U ${SUPPORT_DB_USER} --port ${SUPPORT_DB_PORT} -h ${KOBO_DB_SERVER} -d ${SUPPORT_DB_NAME} --format=custom > "${BACKUP_FILENAME}"
+sync
+python3 /postgres-scripts/rotate-backups.py "${TMP_FILENAME}" "${BACKUP_FILENAME}"
 
-echo "Backup files at ${BACKUP_FILENAME} created successfully."
\ No newline at end of file
+echo "Backup files at ${BACKUP_FILENAME} created successfully."
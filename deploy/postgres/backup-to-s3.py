@@ -1,18 +1,29 @@
-# pip install humanize smart-open
+# pip install -r requirements.txt (shipped in the image, see `ensure-virtualenv.sh`)
 # pass `--hush` to avoid output for each chunk
+# pass `--dry-run` to print the retention plan without backing up or deleting
+# pass `--verify` to check backups against their checksums, without
+# downloading them, instead of backing up
 
 # jnm 20160925, 20161201, 20180517
 import datetime
+import hashlib
+import json
 import os
 import re
-import subprocess
 import sys
 from threading import Thread
 
 import humanize
-import smart_open
-from boto.s3.connection import S3Connection
-from boto.utils import parse_ts
+
+from helpers.backup_catalog import BackupCatalog
+from helpers.backup_metrics import BackupMetrics
+from helpers.chunk_store import ChunkStore
+from helpers.compressor import CompressedStream, Compressor
+from helpers.multipart_upload import UploadPool
+from helpers.parallel_dump import ParallelDump
+from helpers.retention_planner import RetentionPlanner
+from helpers.s3_client import S3Client
+from helpers.throttle import Priority, TokenBucket
 
 
 APP_CODES = {
@@ -24,11 +35,16 @@ monthly_retention = int(os.environ.get("AWS_BACKUP_MONTHLY_RETENTION", 12))
 weekly_retention = int(os.environ.get("AWS_BACKUP_WEEKLY_RETENTION", 4))
 daily_retention = int(os.environ.get("AWS_BACKUP_DAILY_RETENTION", 30))
 
+# `keeps` is a number of backups, one per `period` (see `RetentionPlanner`)
 DIRECTORIES = [
-    {'name': 'postgres/yearly', 'keeps': yearly_retention, 'days': 365},
-    {'name': 'postgres/monthly', 'keeps': monthly_retention, 'days': 30},
-    {'name': 'postgres/weekly', 'keeps': weekly_retention, 'days': 7},
-    {'name': 'postgres/daily', 'keeps': daily_retention, 'days': 1},
+    {'name': 'postgres/yearly', 'keeps': yearly_retention, 'days': 365,
+     'period': RetentionPlanner.YEARLY},
+    {'name': 'postgres/monthly', 'keeps': monthly_retention, 'days': 30,
+     'period': RetentionPlanner.MONTHLY},
+    {'name': 'postgres/weekly', 'keeps': weekly_retention, 'days': 7,
+     'period': RetentionPlanner.WEEKLY},
+    {'name': 'postgres/daily', 'keeps': daily_retention, 'days': 1,
+     'period': RetentionPlanner.DAILY},
 ]
 
 # Consider backups invalid whose (compressed) size is below this number of
@@ -39,19 +55,88 @@ MINIMUM_SIZE = int(os.environ.get("AWS_POSTGRES_BACKUP_MINIMUM_SIZE", 100)) * 10
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
 AWS_BUCKET = os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME')
-CHUNK_SIZE = int(os.environ.get("AWS_BACKUP_CHUNK_SIZE", 250)) * 1024 ** 2
+# Region of the bucket, discovered when empty, and URL of an S3-compatible
+# server to use instead of AWS, e.g. a local stand-in for tests
+AWS_REGION = os.environ.get('AWS_BACKUP_REGION') or None
+AWS_ENDPOINT_URL = os.environ.get('AWS_BACKUP_ENDPOINT_URL') or None
+# Size of multipart upload parts
+CHUNK_SIZE = int(os.environ.get(
+    'AWS_BACKUP_UPLOAD_CHUNK_SIZE',
+    os.environ.get('AWS_BACKUP_CHUNK_SIZE', 250))) * 1024 ** 2
+# Parts sent concurrently. Memory usage is roughly this number times
+# `CHUNK_SIZE`
+PARTS_IN_FLIGHT = int(os.environ.get('AWS_BACKUP_UPLOAD_PARTS_IN_FLIGHT', 4))
+# Attempts per part before giving up
+UPLOAD_RETRIES = int(os.environ.get('AWS_BACKUP_UPLOAD_RETRIES', 5))
+# Upload bandwidth in MB/s (0 for no limit), and time-of-day profiles (UTC)
+# with their own limit, e.g. `08:00-18:00=2,18:00-20:00=10` (see
+# `TokenBucket`)
+UPLOAD_RATE_LIMIT = float(os.environ.get('AWS_BACKUP_UPLOAD_RATE_LIMIT')
+                          or 0) * 1024 ** 2
+UPLOAD_RATE_PROFILES = TokenBucket.parse_profiles(
+    os.environ.get('AWS_BACKUP_UPLOAD_RATE_PROFILES'), 1024 ** 2)
+
+# CPU and I/O priority of `pg_dump`: `normal`, `low` or `idle` (see
+# `Priority`)
+PRIORITY = os.environ.get('POSTGRES_BACKUP_PRIORITY') or Priority.NORMAL
+
+# Number of `pg_dump` processes sharing the same snapshot. When greater than
+# 1, a backup is a "directory" of pieces (see `ParallelDump`) instead of a
+# single custom-format dump
+DUMP_JOBS = int(os.environ.get('POSTGRES_BACKUP_DUMP_JOBS', 1))
+PARALLEL_DUMP_SUFFIX = '.pg_dump.d'
+# Written last, a parallel backup without it is incomplete
+PARALLEL_DUMP_TOC = 'toc.json'
+
+# Compression stage of `pg_dump` output, see `Compressor`
+COMPRESSION = os.environ.get('POSTGRES_BACKUP_COMPRESSION') or Compressor.NONE
+COMPRESSION_LEVEL = int(os.environ.get('POSTGRES_BACKUP_COMPRESSION_LEVEL')
+                        or 0) or None
+COMPRESSION_THREADS = int(os.environ.get(
+    'POSTGRES_BACKUP_COMPRESSION_THREADS') or 0)
+
+# Deduplicated backups (see `ChunkStore`): the uncompressed dump is split
+# into chunks of `DEDUP_CHUNK_SIZE` MiB on average, stored once under
+# `DEDUP_CHUNKS_PREFIX`. The backup itself is an index of its chunks, stored
+# in its tier. Always dumped with a single process, `DUMP_JOBS` is ignored
+DEDUP = os.environ.get('POSTGRES_BACKUP_DEDUP', 'False') == 'True'
+DEDUP_CHUNK_SIZE = int(os.environ.get('POSTGRES_BACKUP_DEDUP_CHUNK_SIZE',
+                                      1)) * 1024 ** 2
+DEDUP_CHUNKS_PREFIX = 'postgres/chunks/'
+DEDUP_INDEX_SUFFIX = '.pg_dump.dedup'
+
+# Backups are looked up in the catalog instead of listing the bucket. It is
+# rebuilt from a listing every `CATALOG_RECONCILE_DAYS` days, when it is
+# missing, or when `--reconcile-catalog` is passed
+CATALOG_KEY = 'postgres/catalog.json'
+CATALOG_CACHE = os.environ.get('AWS_BACKUP_CATALOG_CACHE',
+                               '/srv/backups/.s3-catalog.json')
+CATALOG_RECONCILE_DAYS = int(os.environ.get(
+    'AWS_BACKUP_CATALOG_RECONCILE_DAYS', 7))
+
+# Metrics of each run: Prometheus textfile, replaced on each run, and
+# JSON-lines history (see `BackupMetrics`)
+METRICS_DIR = os.environ.get('POSTGRES_BACKUP_METRICS_DIR', '/srv/logs')
+METRICS_TEXTFILE = os.path.join(METRICS_DIR, 'postgres_backup.prom')
+METRICS_HISTORY = os.path.join(METRICS_DIR, 'postgres_backup_history.jsonl')
 
 ###############################################################################
 
 
 class Backup(Thread):
 
-    def __init__(self, app_code_):
+    def __init__(self, app_code_, client, catalog, metrics=None):
         """
         Args:
             app_code_ (str): `kc` or `kpi`
+            client (S3Client)
+            catalog (BackupCatalog)
+            metrics (BackupMetrics)
         """
         self.__app_code = app_code_
+        self.__client = client
+        self.__catalog = catalog
+        self.__metrics = metrics or BackupMetrics()
         super().__init__()
 
     def run(self):
@@ -59,50 +144,63 @@ class Backup(Thread):
         Backup postgres database for specific `app_code`.
         """
 
-        s3connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
-        s3bucket = s3connection.get_bucket(AWS_BUCKET)
-
         DBDATESTAMP = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
 
         DBURL = APP_CODES.get(self.__app_code)
         
-        DUMPFILE = 'postgres-{}-{}.pg_dump'.format(
+        compressor = Compressor(COMPRESSION, COMPRESSION_LEVEL,
+                                COMPRESSION_THREADS)
+        DUMPFILE = 'postgres-{}-{}.pg_dump{}'.format(
             self.__app_code,
-            DBDATESTAMP
+            DBDATESTAMP,
+            compressor.suffix
         )
 
-        BACKUP_COMMAND = 'pg_dump --format=c --dbname="{}"'.format(DBURL)
+        BACKUP_COMMAND = Priority.wrap(['pg_dump', '--format=c',
+                                        '--dbname={}'.format(DBURL)],
+                                       PRIORITY)
 
         # Determine where to put this backup
-        now = datetime.datetime.now()
+        now = datetime.datetime.utcnow()
         for directory in DIRECTORIES:
             prefix = directory['name'] + '/'
             earliest_current_date = now - datetime.timedelta(days=directory['days'])
-            s3keys = s3bucket.list(prefix=prefix)
-            large_enough_backups = filter(lambda x: x.size >= MINIMUM_SIZE, s3keys)
+            backups = self.__catalog.get_backups(directory['name'])
+            large_enough_backups = filter(lambda x: x['size'] >= MINIMUM_SIZE, backups)
             young_enough_backup_found = False
             for backup in large_enough_backups:
-                if parse_ts(backup.last_modified) >= earliest_current_date:
+                if backup['last_modified'] >= earliest_current_date:
                     young_enough_backup_found = True
             if not young_enough_backup_found:
                 # This directory doesn't have any current backups; stop here and use it
                 # as the destination
                 break
 
+        if DEDUP:
+            self.__dedup_backup(directory['name'], DBURL, DBDATESTAMP,
+                                compressor)
+            return  # Close thread
+
+        if DUMP_JOBS > 1:
+            self.__parallel_backup(directory['name'], DBURL, DBDATESTAMP,
+                                   compressor)
+            return  # Close thread
+
         # Perform the backup
         filename = ''.join((prefix, DUMPFILE))
         print('Backing up to "{}"...'.format(filename))
-        upload = s3bucket.new_key(filename)
+        started = datetime.datetime.utcnow()
         chunks_done = 0
-        with smart_open.smart_open(upload, 'wb') as s3backup:
-            process = subprocess.Popen(
-                BACKUP_COMMAND, shell=True, stdout=subprocess.PIPE)
+        metadata = {'compression': compressor.codec}
+        with get_upload_pool(self.__client, self.__metrics) as upload_pool, \
+                upload_pool.open(filename, metadata) as s3backup, \
+                compressor.open(BACKUP_COMMAND) as stream:
             while True:
-                chunk = process.stdout.read(CHUNK_SIZE)
+                chunk = stream.read(CHUNK_SIZE)
                 if not len(chunk):
                     print('Finished! Wrote {} chunks; {}'.format(
                         chunks_done,
-                        humanize.naturalsize(chunks_done * CHUNK_SIZE)
+                        humanize.naturalsize(s3backup.size)
                     ))
                     break
                 s3backup.write(chunk)
@@ -110,42 +208,389 @@ class Backup(Thread):
                 if '--hush' not in sys.argv:
                     print('Wrote {} chunks; {}'.format(
                         chunks_done,
-                        humanize.naturalsize(chunks_done * CHUNK_SIZE)
+                        humanize.naturalsize(s3backup.size)
                     ))
+            # Fail before `s3backup` completes the upload
+            stream.close()
 
+        self.__record(directory['name'], 'custom', s3backup.size, started)
+        self.__catalog.add({
+            'name': filename,
+            'tier': directory['name'],
+            'format': 'custom',
+            'compression': compressor.codec,
+            'keys': [filename],
+            'etags': {filename: s3backup.etag},
+            'size': s3backup.size,
+            'sha256': s3backup.sha256,
+            'started': started,
+            'last_modified': datetime.datetime.utcnow(),
+        })
         print('Backup `{}` successfully sent to S3.'.format(filename))
         return  # Close thread
 
+    def __record(self, tier, format_, size, started):
+        """
+        Report a successful dump to metrics.
+        """
+        duration = (datetime.datetime.utcnow() - started).total_seconds()
+        self.__metrics.labels.update(tier=tier, format=format_)
+        self.__metrics.set('dump_duration_seconds', duration)
+        self.__metrics.set('dump_bytes', size)
+        self.__metrics.set('dump_throughput_bytes_per_second',
+                           size / duration if duration else 0)
+        self.__metrics.success = True
+
+    def __dedup_backup(self, tier, dburl, dbdatestamp, compressor):
+        """
+        Stream an uncompressed dump into the chunk store. Only chunks which
+        are not stored yet are compressed and uploaded.
+        """
+        name = '{}/postgres-{}-{}{}'.format(tier, self.__app_code,
+                                            dbdatestamp, DEDUP_INDEX_SUFFIX)
+        print('Backing up to "{}" (deduplicated)...'.format(name))
+
+        started = datetime.datetime.utcnow()
+        command = Priority.wrap(['pg_dump', '--format=c', '--compress=0',
+                                 '--dbname={}'.format(dburl)], PRIORITY)
+        metadata = {'format': 'custom', 'compression': compressor.codec}
+        with get_upload_pool(self.__client, self.__metrics) as upload_pool, \
+                get_chunk_store(upload_pool, compressor).open(
+                    name, metadata) as writer, \
+                CompressedStream(command) as stream:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not len(chunk):
+                    break
+                writer.write(chunk)
+                if '--hush' not in sys.argv:
+                    print('Dumped {}; {} new chunks'.format(
+                        humanize.naturalsize(writer.size),
+                        writer.new_chunks
+                    ))
+            # Fail before `writer` writes the index
+            stream.close()
+
+        self.__record(tier, 'dedup', writer.size, started)
+        self.__metrics.set('dedup_new_chunks', writer.new_chunks)
+        self.__metrics.set('dedup_new_bytes', writer.new_size)
+        self.__catalog.add({
+            'name': name,
+            'tier': tier,
+            'format': 'dedup',
+            'compression': compressor.codec,
+            'keys': [name],
+            'etags': {name: writer.etag},
+            'size': writer.size,
+            'sha256': writer.sha256,
+            'started': started,
+            'last_modified': datetime.datetime.utcnow(),
+        })
+        print('Finished! {} chunks; {} new ({})'.format(
+            len(writer.chunks),
+            writer.new_chunks,
+            humanize.naturalsize(writer.new_size)
+        ))
+        print('Backup `{}` successfully sent to S3.'.format(name))
+
+    def __parallel_backup(self, tier, dburl, dbdatestamp, compressor):
+        """
+        Dump database with `DUMP_JOBS` processes, each piece being streamed
+        to its own S3 object. The table of contents is uploaded last.
+        """
+        name = '{}/postgres-{}-{}{}'.format(tier, self.__app_code,
+                                            dbdatestamp, PARALLEL_DUMP_SUFFIX)
+        directory = name + '/'
+        print('Backing up to "{}" with {} jobs...'.format(directory,
+                                                          DUMP_JOBS))
+
+        started = datetime.datetime.utcnow()
+        uploaders = {}
+        with get_upload_pool(self.__client, self.__metrics) as upload_pool:
+
+            def _open_piece(name_):
+                if '--hush' not in sys.argv:
+                    print('Dumping `{}`...'.format(name_))
+                uploaders[name_] = upload_pool.open(
+                    '{}{}.pg_dump{}'.format(directory, name_,
+                                            compressor.suffix),
+                    {'compression': compressor.codec})
+                return uploaders[name_]
+
+            parallel_dump = ParallelDump(dburl, DUMP_JOBS, CHUNK_SIZE,
+                                         compressor, PRIORITY)
+            pieces = parallel_dump.run(_open_piece)
+
+        toc = {
+            'format': 'parallel',
+            'compression': compressor.codec,
+            'started': started.isoformat(),
+            'finished': datetime.datetime.utcnow().isoformat(),
+            'pieces': [dict(piece,
+                            key='{}.pg_dump{}'.format(piece['name'],
+                                                      compressor.suffix),
+                            sha256=uploaders[piece['name']].sha256)
+                       for piece in pieces],
+        }
+        toc_content = json.dumps(toc, indent=2).encode()
+        self.__client.put_object(directory + PARALLEL_DUMP_TOC, toc_content)
+
+        size = sum(piece['size'] for piece in pieces)
+        self.__record(tier, 'parallel', size, started)
+        self.__catalog.add({
+            'name': name,
+            'tier': tier,
+            'format': 'parallel',
+            'compression': compressor.codec,
+            'keys': [directory + piece['key'] for piece in toc['pieces']] +
+                    [directory + PARALLEL_DUMP_TOC],
+            'etags': dict(
+                [(directory + piece['key'], uploaders[piece['name']].etag)
+                 for piece in toc['pieces']] +
+                [(directory + PARALLEL_DUMP_TOC,
+                  hashlib.md5(toc_content).hexdigest())]),
+            'size': size + len(toc_content),
+            # Pieces checksums are stored in the table of contents
+            'sha256': hashlib.sha256(toc_content).hexdigest(),
+            'started': started,
+            'last_modified': datetime.datetime.utcnow(),
+        })
+        print('Finished! Wrote {} pieces; {}'.format(
+            len(pieces),
+            humanize.naturalsize(size)
+        ))
+        print('Backup `{}` successfully sent to S3.'.format(directory))
+
 
-def cleanup():
+def get_upload_pool(client, metrics=None):
+    """
+    All uploads of a backup share the same pool, which bounds the number
+    of parts in memory.
+
+    Returns:
+        UploadPool
+    """
+    return UploadPool(client, CHUNK_SIZE, PARTS_IN_FLIGHT, UPLOAD_RETRIES,
+                      metrics=metrics)
+
+
+def get_chunk_store(upload_pool, compressor=None):
+    """
+    Returns:
+        ChunkStore
+    """
+    return ChunkStore(upload_pool, DEDUP_CHUNKS_PREFIX,
+                      compressor or Compressor(), DEDUP_CHUNK_SIZE)
+
+
+def get_backups(client, tier):
+    """
+    List backups of `tier`. A parallel backup is made of several keys which
+    are grouped together; it is ignored until its table of contents exists.
+    The size of a deduplicated backup is read from its index.
+
+    Returns:
+        list: dicts with the attributes of `BackupCatalog` entries, which can
+        be retrieved from a listing
+    """
+    prefix = tier + '/'
+    backups = {}
+    for object_ in client.list_objects(prefix=prefix):
+        name, _, piece = object_['key'][len(prefix):].partition('/')
+        backup = backups.setdefault(name, {
+            'name': prefix + name,
+            'tier': tier,
+            'format': 'parallel' if piece else 'custom',
+            'compression': Compressor.NONE,
+            'size': 0,
+            'last_modified': None,
+            'keys': [],
+            'complete': not piece,
+        })
+        backup['size'] += object_['size']
+        backup['keys'].append(object_['key'])
+        if backup['last_modified'] is None \
+                or object_['last_modified'] > backup['last_modified']:
+            backup['last_modified'] = object_['last_modified']
+        if piece == PARALLEL_DUMP_TOC:
+            backup['complete'] = True
+        elif name.endswith(DEDUP_INDEX_SUFFIX):
+            index = json.loads(client.get_object(object_['key'])[0].decode())
+            backup['format'] = 'dedup'
+            backup['compression'] = index['compression']
+            backup['size'] = index['size']
+        else:
+            backup['compression'] = Compressor.detect(object_['key'])
+
+    return [backup for backup in backups.values() if backup.pop('complete')]
+
+
+def collect_chunks(client):
+    """
+    Delete chunks which no deduplicated backup refers to anymore. Indexes
+    are listed from the bucket rather than read from the catalog: a chunk
+    must never be deleted because the catalog missed a backup.
+    """
+    index_keys = [object_['key']
+                  for directory in DIRECTORIES
+                  for object_ in client.list_objects(
+                      prefix=directory['name'] + '/')
+                  if object_['key'].endswith(DEDUP_INDEX_SUFFIX)]
+    with get_upload_pool(client) as upload_pool:
+        deleted, errors = get_chunk_store(upload_pool).collect_garbage(
+            index_keys)
+    print('Deleted {} unreferenced chunks'.format(len(deleted)))
+    for key in errors:
+        print('Could not delete "{}"'.format(key))
+
+
+def verify(client, catalog):
+    """
+    Check backups of the catalog with HEAD requests only: each key must
+    exist and have the ETag computed while it was sent (see
+    `MultipartUploader.etag`), which covers the MD5 of every part. Chunks
+    of deduplicated backups are looked up in a listing of the chunk store;
+    their keys are their SHA-256, checked on restore.
+
+    Returns:
+        bool: `False` if a backup is damaged
+    """
+    backups = catalog.get_backups()
+    chunk_keys = None
+    if any(backup.get('format') == 'dedup' for backup in backups):
+        chunk_keys = set(object_['key'] for object_ in client.list_objects(
+            prefix=DEDUP_CHUNKS_PREFIX))
+
+    valid = True
+    with get_upload_pool(client) as upload_pool:
+        for backup in backups:
+            etags = backup.get('etags')
+            if not etags:
+                print('{}: not verified, no checksum recorded'.format(
+                    backup['name']))
+                continue
+
+            futures = [(key_name, upload_pool.submit(
+                            upload_pool.call_with_retries,
+                            client.head_object, key_name))
+                       for key_name in backup['keys']]
+            errors = []
+            for key_name, future in futures:
+                etag = future.result()
+                if etag is None:
+                    errors.append('`{}` is missing'.format(key_name))
+                elif etag != etags.get(key_name):
+                    errors.append('`{}` has ETag {}, expected {}'.format(
+                        key_name, etag, etags.get(key_name)))
+
+            if not errors and backup.get('format') == 'dedup':
+                index = get_chunk_store(upload_pool).get_index(backup['name'])
+                missing = set(key_name for key_name, _ in index['chunks']
+                              if key_name not in chunk_keys)
+                errors += ['`{}` is missing'.format(key_name)
+                           for key_name in sorted(missing)]
+
+            if errors:
+                valid = False
+                print('{}: DAMAGED'.format(backup['name']))
+                for error in errors:
+                    print('\t{}'.format(error))
+            else:
+                print('{}: OK'.format(backup['name']))
+
+    return valid
+
+
+def reconcile_catalog(client, catalog, save=True):
+    """
+    Rebuild the catalog from a listing of every tier.
+    """
+    print('Reconciling backup catalog...')
+    backups = []
+    for directory in DIRECTORIES:
+        backups += get_backups(client, directory['name'])
+    added, removed = catalog.reconcile(backups)
+    for name in added:
+        print('Found backup "{}" missing from catalog'.format(name))
+    for name in removed:
+        print('Removed missing backup "{}" from catalog'.format(name))
+    if save:
+        catalog.save()
+
+
+def cleanup(client, catalog, dry_run=False, metrics=None):
     aws_lifecycle = os.environ.get("AWS_BACKUP_BUCKET_DELETION_RULE_ENABLED", "False") == "True"
 
-    s3connection = S3Connection(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
-    s3bucket = s3connection.get_bucket(AWS_BUCKET)
+    if aws_lifecycle:
+        return
 
-    if not aws_lifecycle:
-        # Remove old backups beyond desired retention
-        for directory in DIRECTORIES:
-            prefix = directory['name'] + '/'
-            keeps = directory['keeps']
-            s3keys = s3bucket.list(prefix=prefix)
-            large_enough_backups = filter(lambda x: x.size >= MINIMUM_SIZE, s3keys)
-            large_enough_backups = sorted(large_enough_backups, key=lambda x: x.last_modified, reverse=True)
-
-            for l in large_enough_backups:
-                now = datetime.datetime.now()
-                delta = now - parse_ts(l.last_modified)
-                if delta.days > keeps:
-                    print('Deleting old backup "{}"...'.format(l.name))
-                    l.delete()
-
-
-database_urls = set(APP_CODES.values())
-# Avoid backup twice the same DB
-if len(database_urls) == 1:
-    backup = Backup('support')
-    backup.start()
-
-cleanup()
+    # Remove old backups beyond desired retention
+    planner = RetentionPlanner(
+        {directory['period']: directory['keeps'] for directory in DIRECTORIES},
+        MINIMUM_SIZE)
+    plan = planner.get_plan(catalog.get_backups())
+    if dry_run or '--hush' not in sys.argv:
+        planner.print_plan(plan)
+
+    deleted_backups = [item['backup'] for item in plan
+                       if item['action'] == RetentionPlanner.DELETE]
+    if metrics is not None:
+        metrics.set('cleanup_kept_backups', len(plan) - len(deleted_backups))
+        metrics.set('cleanup_deleted_backups', len(deleted_backups))
+    if dry_run or not deleted_backups:
+        return
+
+    print('Deleting {} old backups...'.format(len(deleted_backups)))
+    errors = set(client.delete_objects([key
+                                        for backup in deleted_backups
+                                        for key in backup['keys']]))
+    for key in sorted(errors):
+        print('Could not delete "{}"'.format(key))
+    if metrics is not None:
+        metrics.set('cleanup_errors', len(errors))
+
+    # A backup partially deleted stays in the catalog, to be retried
+    catalog.remove([backup['name'] for backup in deleted_backups
+                    if not errors.intersection(backup['keys'])])
+    catalog.save()
+
+    if any(backup.get('format') == 'dedup' for backup in deleted_backups):
+        collect_chunks(client)
+
+
+dry_run = '--dry-run' in sys.argv
+# The log of cron runs is appended to, separate runs
+print('=== {} ==='.format(datetime.datetime.utcnow().strftime(
+    '%Y-%m-%d %H:%M:%S UTC')))
+throttle = None
+if UPLOAD_RATE_LIMIT or UPLOAD_RATE_PROFILES:
+    throttle = TokenBucket(UPLOAD_RATE_LIMIT, profiles=UPLOAD_RATE_PROFILES)
+client = S3Client(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY, AWS_BUCKET,
+                  throttle=throttle, region=AWS_REGION,
+                  endpoint_url=AWS_ENDPOINT_URL)
+catalog = BackupCatalog(client, CATALOG_KEY, CATALOG_CACHE)
+if not catalog.load() \
+        or catalog.needs_reconcile(CATALOG_RECONCILE_DAYS) \
+        or '--reconcile-catalog' in sys.argv:
+    reconcile_catalog(client, catalog, save=not dry_run)
+
+if '--verify' in sys.argv:
+    sys.exit(0 if verify(client, catalog) else 1)
+
+metrics = BackupMetrics()
+try:
+    database_urls = set(APP_CODES.values())
+    # Avoid backup twice the same DB
+    if len(database_urls) == 1 and not dry_run:
+        backup = Backup('support', client, catalog, metrics)
+        backup.start()
+        # Retention must see the new backup, and both update the catalog
+        backup.join()
+        catalog.save()
+
+    cleanup(client, catalog, dry_run=dry_run, metrics=metrics)
+finally:
+    if not dry_run:
+        metrics.write(METRICS_TEXTFILE, METRICS_HISTORY)
 
 print('Done!')
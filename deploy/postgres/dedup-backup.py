@@ -0,0 +1,171 @@
+# Deduplicated backups of `support-postgres` (see `ChunkStore`).
+#
+#   dedup-backup.py backup
+#   dedup-backup.py list
+#   dedup-backup.py restore NAME [--output FILE]
+#
+# Backups are stored on S3 when AWS credentials are set, on local disk
+# otherwise. On S3, backups are taken by `backup-to-s3.py` (with
+# `POSTGRES_BACKUP_DEDUP=True`) which sorts them in tiers; `backup` only
+# writes to local disk.
+#
+# `restore` writes the custom-format dump to stdout by default, e.g.
+#   dedup-backup.py restore NAME | pg_restore --dbname=...
+import argparse
+import datetime
+import os
+import sys
+
+from helpers.chunk_store import ChunkStore
+from helpers.compressor import CompressedStream, Compressor
+from helpers.multipart_upload import UploadPool
+from helpers.throttle import Priority
+
+
+USE_S3 = bool(os.environ.get('AWS_ACCESS_KEY_ID')
+              and os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME'))
+# Store on local disk, chunks are under `chunks/`
+LOCAL_DIR = os.environ.get('POSTGRES_BACKUP_DEDUP_DIR', '/srv/backups/dedup')
+LOCAL_RETENTION = int(os.environ.get('POSTGRES_BACKUP_DEDUP_RETENTION', 7))
+# Same layout as `backup-to-s3.py`
+S3_CHUNKS_PREFIX = 'postgres/chunks/'
+S3_CATALOG_KEY = 'postgres/catalog.json'
+INDEX_SUFFIX = '.pg_dump.dedup'
+
+CHUNK_SIZE = int(os.environ.get('POSTGRES_BACKUP_DEDUP_CHUNK_SIZE',
+                                1)) * 1024 ** 2
+# Chunks compressed and stored, or fetched, concurrently
+JOBS = int(os.environ.get('POSTGRES_BACKUP_DEDUP_JOBS', 4))
+DBURL = os.environ.get('SUPPORT_DATABASE_URL')
+
+COMPRESSION = os.environ.get('POSTGRES_BACKUP_COMPRESSION') or Compressor.NONE
+COMPRESSION_LEVEL = int(os.environ.get('POSTGRES_BACKUP_COMPRESSION_LEVEL')
+                        or 0) or None
+COMPRESSION_THREADS = int(os.environ.get(
+    'POSTGRES_BACKUP_COMPRESSION_THREADS') or 0)
+
+# CPU and I/O priority of `pg_dump` (see `Priority`)
+PRIORITY = os.environ.get('POSTGRES_BACKUP_PRIORITY') or Priority.NORMAL
+
+READ_SIZE = 16 * 1024 ** 2
+
+###############################################################################
+
+
+def get_storage():
+    if USE_S3:
+        from helpers.s3_client import S3Client
+
+        return S3Client(os.environ.get('AWS_ACCESS_KEY_ID'),
+                        os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                        os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME'),
+                        region=os.environ.get('AWS_BACKUP_REGION') or None,
+                        endpoint_url=os.environ.get(
+                            'AWS_BACKUP_ENDPOINT_URL') or None)
+
+    from helpers.local_storage import LocalStorage
+
+    return LocalStorage(LOCAL_DIR)
+
+
+def get_chunk_store(upload_pool):
+    compressor = Compressor(COMPRESSION, COMPRESSION_LEVEL,
+                            COMPRESSION_THREADS)
+    prefix = S3_CHUNKS_PREFIX if USE_S3 else 'chunks/'
+    return ChunkStore(upload_pool, prefix, compressor, CHUNK_SIZE)
+
+
+def get_backup_names(storage):
+    """
+    Returns:
+        list: names (i.e. index keys) of backups, oldest first
+    """
+    if USE_S3:
+        from helpers.backup_catalog import BackupCatalog
+
+        catalog = BackupCatalog(storage, S3_CATALOG_KEY)
+        catalog.load()
+        return [backup['name'] for backup in catalog.get_backups()
+                if backup.get('format') == 'dedup']
+
+    # Names start with their date
+    return sorted(object_['key'] for object_ in storage.list_objects()
+                  if object_['key'].endswith(INDEX_SUFFIX))
+
+
+def backup(storage, upload_pool):
+    if USE_S3:
+        print('Backups on S3 are taken by `backup-to-s3.py`.')
+        return False
+
+    chunk_store = get_chunk_store(upload_pool)
+    name = 'postgres-support-{}{}'.format(
+        datetime.datetime.now().strftime('%Y%m%d_%H%M%S'), INDEX_SUFFIX)
+    print('Backing up to "{}"...'.format(name))
+    command = Priority.wrap(['pg_dump', '--format=c', '--compress=0',
+                             '--dbname={}'.format(DBURL)], PRIORITY)
+    with chunk_store.open(name, {'format': 'custom',
+                                 'compression': COMPRESSION}) as writer, \
+            CompressedStream(command) as stream:
+        while True:
+            chunk = stream.read(READ_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+        # Fail before `writer` writes the index
+        stream.close()
+    print('Finished! {} chunks; {} new ({} bytes)'.format(
+        len(writer.chunks), writer.new_chunks, writer.new_size))
+
+    obsolete = get_backup_names(storage)[:-max(LOCAL_RETENTION, 1)]
+    if obsolete:
+        storage.delete_objects(obsolete)
+        for name in obsolete:
+            print('Deleted obsolete backup "{}"'.format(name))
+        deleted, _ = chunk_store.collect_garbage(get_backup_names(storage))
+        print('Deleted {} unreferenced chunks'.format(len(deleted)))
+    return True
+
+
+def list_backups(storage, upload_pool):
+    chunk_store = get_chunk_store(upload_pool)
+    for name in get_backup_names(storage):
+        index = chunk_store.get_index(name)
+        print('{}  {}  {} bytes  {} chunks'.format(
+            name, index['finished'], index['size'], len(index['chunks'])))
+    return True
+
+
+def restore(upload_pool, name, output):
+    destination = open(output, 'wb') if output else sys.stdout.buffer
+    try:
+        index = get_chunk_store(upload_pool).read(name, destination, JOBS)
+    finally:
+        if output:
+            destination.close()
+    # stdout may be the dump
+    print('Restored "{}" ({} bytes)'.format(name, index['size']),
+          file=sys.stderr)
+    return True
+
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command', required=True)
+subparsers.add_parser('backup', help='back up to local disk')
+subparsers.add_parser('list', help='list deduplicated backups')
+restore_parser = subparsers.add_parser('restore', help='rebuild a dump')
+restore_parser.add_argument('name')
+restore_parser.add_argument('--output', metavar='FILE',
+                            help='defaults to stdout')
+args = parser.parse_args()
+
+storage_ = get_storage()
+with UploadPool(storage_, CHUNK_SIZE, JOBS) as upload_pool_:
+    if args.command == 'backup':
+        success = backup(storage_, upload_pool_)
+    elif args.command == 'list':
+        success = list_backups(storage_, upload_pool_)
+    else:
+        success = restore(upload_pool_, args.name, args.output)
+
+sys.exit(0 if success else 1)
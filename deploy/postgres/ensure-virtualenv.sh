@@ -0,0 +1,25 @@
+#!/usr/bin/env bash
+# Linux Alpine Compatible
+# Makes sure the virtualenv of backup scripts on S3 has the dependencies
+# pinned in `requirements.txt`, and prints its python interpreter.
+#
+# The image ships the virtualenv ready (see `build/postgres-backup/Dockerfile`)
+# with a copy of the requirements it was built from: when they match, nothing
+# is installed, which keeps startup fast and works offline. Otherwise (image
+# built before the pins changed) the virtualenv is created or updated from
+# PyPI.
+
+VIRTUALENV_DIR=/opt/backup-virtualenv
+REQUIREMENTS=/postgres-scripts/requirements.txt
+
+if ! cmp -s "${REQUIREMENTS}" "${VIRTUALENV_DIR}/requirements.txt"; then
+    echo "Installing virtualenv for PostgreSQL backup on S3..." >&2
+    if [[ ! -x "${VIRTUALENV_DIR}/bin/python" ]]; then
+        python3 -m venv "${VIRTUALENV_DIR}" >&2 || exit 1
+    fi
+    "${VIRTUALENV_DIR}/bin/pip" install --quiet --no-cache-dir \
+        -r "${REQUIREMENTS}" >&2 || exit 1
+    cp "${REQUIREMENTS}" "${VIRTUALENV_DIR}/requirements.txt"
+fi
+
+echo "${VIRTUALENV_DIR}/bin/python"
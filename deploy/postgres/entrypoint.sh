@@ -3,6 +3,13 @@ set -e
 export POSTGRES_BACKUPS_DIR=/srv/backups
 export POSTGRES_LOGS_DIR=/srv/logs
 
+# Seconds since the container started, i.e. since PID 1 started
+seconds_since_start() {
+    awk -v ticks="$(getconf CLK_TCK 2> /dev/null || echo 100)" \
+        'NR == 1 { uptime = $1 } NR == 2 { printf "%.2f", uptime - $22 / ticks }' \
+        /proc/uptime /proc/1/stat
+}
+
 echo "Copying init scripts ..."
 
 if [[ ! -d $POSTGRES_LOGS_DIR ]]; then
@@ -13,13 +20,16 @@ if [[ ! -d $POSTGRES_BACKUPS_DIR ]]; then
     mkdir -p $POSTGRES_BACKUPS_DIR
 fi
 
-# Restore permissions
-chmod +x -R ./postgres-scripts/
-
 # Send backup installation process in background to avoid blocking PostgreSQL startup
 
 echo "Registering Cron expression"
 # Send backup installation process in background to avoid blocking PostgreSQL startup
 bash ./postgres-scripts/register-cron.sh
+bash ./postgres-scripts/register-wal-archiving.sh
+
+# Starting crond, once every job is in the crontab
+crond &
+
+echo "Backup container ready in $(seconds_since_start)s (cron scheduled)"
 
 exec sleep infinity
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import datetime
+import json
+import os
+import tempfile
+from threading import Lock
+
+
+class BackupCatalog:
+    """
+    JSON document stored in the bucket next to the backups, which lists
+    them with their tier, keys, size, checksum and timestamps. Reading it
+    replaces listing every tier prefix.
+
+    A copy is cached on local disk with the ETag of the remote document, so
+    an unchanged catalog costs a single HEAD request.
+
+    The catalog can drift (e.g. objects deleted by a lifecycle rule or by
+    hand); `reconcile()` rebuilds it from a listing of the bucket.
+    """
+
+    VERSION = 1
+    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, client, key_name, cache_path=None):
+        """
+        Args:
+            client: S3 client (e.g. `S3Client`)
+            key_name (str): key of the catalog in the bucket
+            cache_path (str): local copy of the catalog, not cached if `None`
+        """
+        self.__client = client
+        self.__key_name = key_name
+        self.__cache_path = cache_path
+        self.__lock = Lock()
+        self.__document = None
+
+    def add(self, backup):
+        """
+        Args:
+            backup (dict): `name`, `tier`, `format`, `compression`, `keys`,
+                `etags` (expected ETag of each key), `size`, `sha256`,
+                `started` and `last_modified` (naive UTC datetimes)
+        """
+        with self.__lock:
+            self.__remove([backup['name']])
+            self.__document['backups'].append(self.__serialize(backup))
+
+    def get_backups(self, tier=None):
+        """
+        Args:
+            tier (str): only return backups of this tier
+
+        Returns:
+            list: dicts (see `add()`), oldest first
+        """
+        with self.__lock:
+            backups = [self.__deserialize(backup)
+                       for backup in self.__document['backups']
+                       if tier is None or backup['tier'] == tier]
+        return sorted(backups, key=lambda x: x['last_modified'])
+
+    def load(self):
+        """
+        Read the catalog from the bucket, or from the local cache when the
+        remote document has not changed.
+
+        Returns:
+            bool: `False` if the catalog does not exist or cannot be read;
+            it is then empty and needs to be reconciled.
+        """
+        cache = self.__read_cache()
+        etag = self.__client.head_object(self.__key_name)
+        document = None
+
+        if etag is not None and cache.get('etag') == etag:
+            document = cache.get('catalog')
+        elif etag is not None:
+            content, etag = self.__client.get_object(self.__key_name)
+            try:
+                document = json.loads(content.decode())
+            except (AttributeError, ValueError):
+                document = None
+            else:
+                self.__write_cache(etag, document)
+
+        if not isinstance(document, dict) \
+                or document.get('version') != self.VERSION:
+            self.__document = self.__get_empty_document()
+            return False
+
+        self.__document = document
+        return True
+
+    def needs_reconcile(self, max_age):
+        """
+        Args:
+            max_age (int): days between reconciliations
+
+        Returns:
+            bool
+        """
+        reconciled = self.__document.get('reconciled')
+        if reconciled is None:
+            return True
+        reconciled = datetime.datetime.strptime(reconciled, self.DATE_FORMAT)
+        return datetime.datetime.utcnow() - reconciled >= \
+            datetime.timedelta(days=max_age)
+
+    def reconcile(self, backups):
+        """
+        Replace catalog entries with backups found in the bucket. Details
+        which cannot be retrieved from a listing (checksums, start time) are
+        kept from existing entries. ETags are never taken from the listing:
+        they must be those computed when the backup was sent.
+
+        Args:
+            backups (list): dicts (see `add()`) built from a listing
+
+        Returns:
+            tuple: names of added and removed backups
+        """
+        with self.__lock:
+            existing = {backup['name']: backup
+                        for backup in self.__document['backups']}
+            entries = []
+            for backup in backups:
+                entry = self.__serialize(backup)
+                previous = existing.get(backup['name'])
+                if previous is not None:
+                    for attribute in ('format', 'sha256', 'etags',
+                                      'started'):
+                        if entry.get(attribute) is None:
+                            entry[attribute] = previous.get(attribute)
+                entries.append(entry)
+
+            names = set(backup['name'] for backup in backups)
+            added = sorted(names - set(existing))
+            removed = sorted(set(existing) - names)
+            self.__document['backups'] = entries
+            self.__document['reconciled'] = \
+                datetime.datetime.utcnow().strftime(self.DATE_FORMAT)
+
+        return added, removed
+
+    def remove(self, names):
+        with self.__lock:
+            self.__remove(names)
+
+    def save(self):
+        """
+        Upload the catalog and refresh the local cache.
+        """
+        with self.__lock:
+            self.__document['updated'] = \
+                datetime.datetime.utcnow().strftime(self.DATE_FORMAT)
+            self.__document['backups'].sort(
+                key=lambda x: (x['tier'], x['last_modified']))
+            content = json.dumps(self.__document, indent=2, sort_keys=True)
+            etag = self.__client.put_object(self.__key_name, content.encode())
+            self.__write_cache(etag, self.__document)
+
+    def __deserialize(self, backup):
+        backup = dict(backup)
+        for attribute in ('started', 'last_modified'):
+            if backup.get(attribute) is not None:
+                backup[attribute] = datetime.datetime.strptime(
+                    backup[attribute], self.DATE_FORMAT)
+        return backup
+
+    def __get_empty_document(self):
+        return {
+            'version': self.VERSION,
+            'updated': None,
+            'reconciled': None,
+            'backups': [],
+        }
+
+    def __read_cache(self):
+        if self.__cache_path is None:
+            return {}
+        try:
+            with open(self.__cache_path, 'r') as f:
+                return json.loads(f.read())
+        except (IOError, ValueError):
+            return {}
+
+    def __remove(self, names):
+        self.__document['backups'] = [
+            backup for backup in self.__document['backups']
+            if backup['name'] not in names
+        ]
+
+    def __serialize(self, backup):
+        backup = dict(backup)
+        for attribute in ('started', 'last_modified'):
+            if isinstance(backup.get(attribute), datetime.datetime):
+                backup[attribute] = backup[attribute].strftime(
+                    self.DATE_FORMAT)
+        return backup
+
+    def __write_cache(self, etag, document):
+        """
+        Cache is only an optimization, failing to write it is not an error.
+        """
+        if self.__cache_path is None:
+            return
+        directory = os.path.dirname(self.__cache_path) or '.'
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.catalog.')
+            with os.fdopen(fd, 'w') as f:
+                f.write(json.dumps({'etag': etag, 'catalog': document}))
+            os.replace(tmp_path, self.__cache_path)
+        except (IOError, OSError) as e:
+            print('Could not write catalog cache: {}'.format(e))
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+import time
+from threading import Lock
+
+
+class BackupMetrics:
+    """
+    Metrics of a backup run, written at the end of the run:
+        - as a Prometheus textfile (e.g. for the textfile collector of
+          `node_exporter`), replaced on each run;
+        - as a line appended to a JSON-lines history, to follow trends
+          over many runs.
+
+    Metrics are updated from several threads (upload workers).
+    """
+
+    PREFIX = 'support_postgres_backup'
+    # Upper bounds (seconds) of the buckets of the part latency histogram
+    LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+    def __init__(self):
+        self.started = time.time()
+        self.success = False
+        self.labels = {}
+        self.values = {}
+        self.__part_latencies = [0] * len(self.LATENCY_BUCKETS)
+        self.__part_count = 0
+        self.__part_seconds = 0.0
+        self.__part_bytes = 0
+        self.__retries = 0
+        self.__lock = Lock()
+
+    def add_retry(self):
+        with self.__lock:
+            self.__retries += 1
+
+    def observe_part(self, seconds, size):
+        """
+        Args:
+            seconds (float): time to send the part, retries included
+            size (int): bytes
+        """
+        with self.__lock:
+            for i, bound in enumerate(self.LATENCY_BUCKETS):
+                if seconds <= bound:
+                    self.__part_latencies[i] += 1
+            self.__part_count += 1
+            self.__part_seconds += seconds
+            self.__part_bytes += size
+
+    def set(self, name, value):
+        """
+        Args:
+            name (str): e.g. `dump_duration_seconds`
+            value (float)
+        """
+        with self.__lock:
+            self.values[name] = value
+
+    def write(self, textfile_path, history_path):
+        """
+        Write the textfile (atomically) and append to the history. Metrics
+        must not make a backup fail: errors are printed and ignored.
+        """
+        finished = time.time()
+        with self.__lock:
+            record = dict(self.values,
+                          started=self.started,
+                          finished=finished,
+                          duration_seconds=finished - self.started,
+                          success=self.success,
+                          retries=self.__retries,
+                          parts=self.__part_count,
+                          part_seconds=self.__part_seconds,
+                          part_bytes=self.__part_bytes,
+                          part_latency_buckets=dict(zip(
+                              map(str, self.LATENCY_BUCKETS),
+                              self.__part_latencies)))
+            record.update(self.labels)
+
+        last_success = finished if self.success \
+            else self.__get_last_success(history_path)
+        try:
+            self.__write_textfile(textfile_path, record, last_success)
+            os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+            with open(history_path, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        except (IOError, OSError) as e:
+            print('Could not write backup metrics: {}'.format(e))
+
+    @staticmethod
+    def __get_last_success(history_path):
+        last_success = None
+        try:
+            with open(history_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('success'):
+                        last_success = record['finished']
+        except (IOError, OSError):
+            pass
+        return last_success
+
+    def __write_textfile(self, path, record, last_success):
+        labels = ['{}="{}"'.format(name, str(value).replace('"', ''))
+                  for name, value in sorted(self.labels.items())]
+        lines = []
+
+        def _header(name, type_, help_):
+            lines.append('# HELP {}_{} {}'.format(self.PREFIX, name, help_))
+            lines.append('# TYPE {}_{} {}'.format(self.PREFIX, name, type_))
+
+        def _sample(name, value, extra_labels=()):
+            labels_ = ','.join(labels + list(extra_labels))
+            lines.append('{}_{}{} {}'.format(
+                self.PREFIX, name,
+                '{{{}}}'.format(labels_) if labels_ else '', value))
+
+        def _gauge(name, help_, value):
+            _header(name, 'gauge', help_)
+            _sample(name, value)
+
+        _gauge('success', 'Whether the last run succeeded.',
+               int(record['success']))
+        if last_success is not None:
+            _gauge('last_success_timestamp_seconds',
+                   'End of the last successful run.', last_success)
+        _gauge('duration_seconds', 'Duration of the last run.',
+               record['duration_seconds'])
+        for name, value in sorted(self.values.items()):
+            _gauge(name, name.replace('_', ' ').capitalize() + '.', value)
+        _gauge('retries', 'Failed requests which were retried.',
+               record['retries'])
+        _gauge('upload_part_bytes', 'Bytes sent in parts.',
+               record['part_bytes'])
+
+        histogram = 'upload_part_duration_seconds'
+        _header(histogram, 'histogram', 'Time to send each part.')
+        for bound in self.LATENCY_BUCKETS:
+            _sample(histogram + '_bucket',
+                    record['part_latency_buckets'][str(bound)],
+                    ['le="{}"'.format(bound)])
+        _sample(histogram + '_bucket', record['parts'], ['le="+Inf"'])
+        _sample(histogram + '_sum', record['part_seconds'])
+        _sample(histogram + '_count', record['parts'])
+
+        directory = os.path.dirname(path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.metrics.')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import json
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+from helpers.compressor import Compressor
+
+
+class Chunker:
+    """
+    Content-defined chunking: boundaries depend on the bytes before them,
+    not on their offset, so data inserted or removed in a dump only changes
+    the chunks around the edit. Following chunks are found again as is.
+
+    A boundary is placed after a byte when a hash of the window of bytes
+    ending with it falls under a threshold, which happens once every
+    `average_size - min_size` bytes on average. Hashing each position in
+    Python would be far too slow, so positions are filtered in two steps:
+        1. Cheap hash of the last 7 bytes (XOR of a substitution table),
+           computed for a whole segment at once with `bytes.translate()`
+           and big integers, i.e. in C. About 1 position out of 256 hashes
+           to 0 and is a candidate.
+        2. Candidates are checked with the CRC32 of the last `WINDOW` bytes.
+
+    Chunks are at least `min_size` bytes long (scanning starts there) and at
+    most `max_size`.
+    """
+
+    WINDOW = 32
+    # Bytes hashed at once
+    SEGMENT_SIZE = 256 * 1024
+    # Candidates of step 1 are 1/256 of positions
+    CANDIDATE_RATIO = 256
+
+    def __init__(self, average_size):
+        """
+        Args:
+            average_size (int): bytes, at least 4 KiB
+        """
+        if average_size < 4096:
+            raise ValueError('Average chunk size must be at least 4 KiB')
+        self.average_size = average_size
+        self.min_size = average_size // 4
+        self.max_size = average_size * 4
+        self.__threshold = 2 ** 32 * self.CANDIDATE_RATIO // (
+            average_size - self.min_size)
+        # Must never change, or chunks of previous backups would not be
+        # found again. No value is 0, so runs of the same byte are never
+        # candidates.
+        self.__table = bytes(
+            next(byte_ for byte_ in hashlib.sha256(bytes([value])).digest()
+                 if byte_)
+            for value in range(256))
+
+    def find_boundary(self, data, final=False):
+        """
+        Args:
+            data (bytes-like): starts with a new chunk, at least `max_size`
+                bytes long unless `final`
+            final (bool): no data follows `data`
+
+        Returns:
+            int: length of the first chunk of `data`
+        """
+        if len(data) < self.max_size and not final:
+            raise ValueError('Not enough data to find a chunk boundary')
+
+        end = min(len(data), self.max_size)
+        position = self.min_size
+        while position < end:
+            segment_end = min(position + self.SEGMENT_SIZE, end)
+            boundary = self.__scan(data, position, segment_end)
+            if boundary is not None:
+                return boundary
+            position = segment_end
+        return end
+
+    def __scan(self, data, start, end):
+        """
+        Returns:
+            int: first boundary after a byte of `data[start:end]`, `None`
+            if there is none
+        """
+        window = bytes(data[start - 6:end])
+        x = int.from_bytes(window.translate(self.__table), 'little')
+        # Each byte of `h` is the XOR of the 7 substituted bytes ending at
+        # the same offset of `window`
+        y = x ^ (x << 8)
+        z = y ^ (y << 16)
+        h = z ^ (y << 32) ^ (x << 48)
+        hashes = h.to_bytes(len(window) + 6, 'little')[6:len(window)]
+
+        index = hashes.find(0)
+        while index != -1:
+            position = start + index
+            window_start = position + 1 - self.WINDOW
+            if zlib.crc32(data[window_start:position + 1]) < \
+                    self.__threshold:
+                return position + 1
+            index = hashes.find(0, index + 1)
+        return None
+
+
+class ChunkStore:
+    """
+    Deduplicating backup store. Streams are split into content-defined
+    chunks (see `Chunker`) and each distinct chunk is stored once,
+    compressed, under `<prefix><sha256[:2]>/<sha256><suffix>`. A backup is a
+    small JSON index which lists its chunks, so each run only uploads the
+    chunks which are not in the store yet.
+
+    Chunks are shared between backups: deleting a backup only deletes its
+    index, and `collect_garbage()` deletes chunks no index refers to.
+    """
+
+    VERSION = 1
+
+    def __init__(self, pool, prefix, compressor, average_size):
+        """
+        Args:
+            pool (UploadPool): sends chunks, its client (e.g. `S3Client`
+                or `LocalStorage`) is the storage of the store
+            prefix (str): prefix of chunk keys
+            compressor (Compressor): compresses new chunks
+            average_size (int): average size of chunks, in bytes
+        """
+        self.__pool = pool
+        self.__storage = pool.client
+        self.__prefix = prefix
+        self.__compressor = compressor
+        self.__chunker = Chunker(average_size)
+        self.__lock = Lock()
+        self.__chunks = None
+
+    def claim(self, sha256):
+        """
+        Register a chunk which is about to be stored.
+
+        Returns:
+            tuple: key of the chunk, and whether it must be uploaded (i.e.
+            it is neither in the store nor claimed already)
+        """
+        with self.__lock:
+            if self.__chunks is None:
+                self.__chunks = {
+                    self.__get_sha256(object_['key']): object_['key']
+                    for object_ in self.__storage.list_objects(self.__prefix)
+                }
+            if sha256 in self.__chunks:
+                return self.__chunks[sha256], False
+            key_name = '{}{}/{}{}'.format(self.__prefix, sha256[:2], sha256,
+                                          self.__compressor.suffix)
+            self.__chunks[sha256] = key_name
+            return key_name, True
+
+    def collect_garbage(self, index_keys):
+        """
+        Delete chunks which are not referenced by any of `index_keys`. Must
+        not run while a backup is being written to the store.
+
+        Args:
+            index_keys (list): indexes of all backups which are kept
+
+        Returns:
+            tuple: deleted keys and keys which could not be deleted
+        """
+        referenced = set()
+        for index_key in index_keys:
+            referenced.update(key_name for key_name, _
+                              in self.get_index(index_key)['chunks'])
+
+        unreferenced = [object_['key']
+                        for object_ in self.__storage.list_objects(
+                            self.__prefix)
+                        if object_['key'] not in referenced]
+        errors = self.__storage.delete_objects(unreferenced)
+        with self.__lock:
+            # Reload on next `claim()`
+            self.__chunks = None
+        failed = set(errors)
+        return [key_name for key_name in unreferenced
+                if key_name not in failed], errors
+
+    def get_index(self, index_key):
+        """
+        Returns:
+            dict: `version`, `size`, `sha256`, `chunk_size`, `started`,
+            `finished`, `chunks` (list of `[key, size]`, in order) and
+            metadata passed to `open()`
+        """
+        content, _ = self.__storage.get_object(index_key)
+        if content is None:
+            raise FileNotFoundError('Index `{}` not found'.format(index_key))
+        return json.loads(content.decode())
+
+    def open(self, index_key, metadata=None):
+        """
+        Args:
+            index_key (str): key of the index, written when the returned
+                writer is closed
+            metadata (dict): extra attributes stored in the index
+
+        Returns:
+            ChunkWriter
+        """
+        return ChunkWriter(self, self.__pool, self.__chunker, index_key,
+                           metadata)
+
+    def read(self, index_key, destination, jobs=4):
+        """
+        Rebuild the stream of a backup. Chunks are downloaded and
+        decompressed `jobs` at a time, and written in order.
+
+        Args:
+            index_key (str)
+            destination: writable file-like object
+            jobs (int): chunks fetched concurrently
+
+        Returns:
+            dict: the index
+        """
+        index = self.get_index(index_key)
+        hash_ = hashlib.sha256()
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for key_name, size in index['chunks']:
+                # Bound memory to twice the number of workers
+                if len(pending) >= jobs * 2:
+                    self.__write_chunk(pending.popleft(), destination, hash_)
+                pending.append(executor.submit(self.__fetch_chunk, key_name,
+                                               size))
+            while pending:
+                self.__write_chunk(pending.popleft(), destination, hash_)
+
+        if hash_.hexdigest() != index['sha256']:
+            raise RuntimeError('Checksum of `{}` does not match'.format(
+                index_key))
+        return index
+
+    def store_chunk(self, key_name, chunk):
+        """
+        Compress and upload `chunk`, with retries. Runs in the pool.
+        """
+        try:
+            data = self.__compressor.compress(chunk)
+            started = time.monotonic()
+            self.__pool.call_with_retries(
+                self.__storage.put_object, key_name, data,
+                {'compression': self.__compressor.codec})
+            self.__pool.record_part(time.monotonic() - started, len(data))
+        except BaseException:
+            with self.__lock:
+                # Not in the store, it must be uploaded again if needed
+                if self.__chunks is not None:
+                    self.__chunks.pop(self.__get_sha256(key_name), None)
+            raise
+
+    def __fetch_chunk(self, key_name, size):
+        content, _ = self.__pool.call_with_retries(self.__storage.get_object,
+                                                   key_name)
+        if content is None:
+            raise FileNotFoundError('Chunk `{}` not found'.format(key_name))
+        chunk = Compressor.decompress(Compressor.detect(key_name), content)
+        if len(chunk) != size \
+                or hashlib.sha256(chunk).hexdigest() != \
+                self.__get_sha256(key_name):
+            raise RuntimeError('Chunk `{}` is corrupted'.format(key_name))
+        return chunk
+
+    @staticmethod
+    def __get_sha256(key_name):
+        return key_name.rsplit('/', 1)[-1].split('.', 1)[0]
+
+    @staticmethod
+    def __write_chunk(future, destination, hash_):
+        chunk = future.result()
+        hash_.update(chunk)
+        destination.write(chunk)
+
+
+class ChunkWriter:
+    """
+    Writable file-like object which splits data into chunks, uploads the
+    new ones through the pool and writes the index of the backup on close.
+    """
+
+    def __init__(self, store, pool, chunker, index_key, metadata=None):
+        self.index_key = index_key
+        self.metadata = metadata or {}
+        self.size = 0
+        self.chunks = []
+        # ETag of the index, once written
+        self.etag = None
+        # Chunks which were not in the store, and their size
+        self.new_chunks = 0
+        self.new_size = 0
+        self.__store = store
+        self.__pool = pool
+        self.__chunker = chunker
+        self.__hash = hashlib.sha256()
+        self.__buffer = bytearray()
+        self.__futures = []
+        self.__started = datetime.datetime.utcnow()
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def sha256(self):
+        return self.__hash.hexdigest()
+
+    def abort(self):
+        """
+        Stop uploading. Chunks already sent stay in the store until the
+        next garbage collection, or are reused by the next backup.
+        """
+        self.__closed = True
+        self.__buffer = bytearray()
+        for future in self.__futures:
+            future.cancel()
+        for future in self.__futures:
+            try:
+                future.result()
+            except BaseException:
+                pass
+
+    def close(self):
+        """
+        Store remaining data, wait for all chunks and write the index.
+
+        Returns:
+            dict: the index
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        while self.__buffer:
+            self.__cut(final=True)
+        try:
+            for future in self.__futures:
+                future.result()
+        except BaseException:
+            self.abort()
+            raise
+
+        index = dict(self.metadata,
+                     version=ChunkStore.VERSION,
+                     size=self.size,
+                     sha256=self.sha256,
+                     chunk_size=self.__chunker.average_size,
+                     started=self.__started.isoformat(),
+                     finished=datetime.datetime.utcnow().isoformat(),
+                     chunks=self.chunks)
+        content = json.dumps(index).encode()
+        self.__pool.call_with_retries(self.__pool.client.put_object,
+                                      self.index_key, content)
+        self.etag = hashlib.md5(content).hexdigest()
+        return index
+
+    def write(self, data):
+        self.__hash.update(data)
+        self.__buffer.extend(data)
+        self.size += len(data)
+        while len(self.__buffer) >= self.__chunker.max_size:
+            self.__cut()
+        return len(data)
+
+    def __cut(self, final=False):
+        length = self.__chunker.find_boundary(self.__buffer, final)
+        chunk = bytes(self.__buffer[:length])
+        del self.__buffer[:length]
+
+        key_name, new = self.__store.claim(hashlib.sha256(chunk).hexdigest())
+        self.chunks.append([key_name, length])
+        if not new:
+            return
+
+        # Fail fast if a previous chunk could not be sent
+        pending = []
+        for future in self.__futures:
+            if not future.done():
+                pending.append(future)
+            elif future.exception() is not None:
+                raise future.exception()
+        self.__futures = pending
+        self.new_chunks += 1
+        self.new_size += length
+        self.__futures.append(self.__pool.submit(self.__store.store_chunk,
+                                                 key_name, chunk))
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import subprocess
+from threading import Thread
+
+
+class Compressor:
+    """
+    Compression stage of the backup pipeline: `pg_dump` writes an
+    uncompressed dump (`-Z0`) which is piped through a multi-threaded
+    compressor.
+
+    The codec is recorded in the file name with `CODECS[codec]['suffix']`,
+    so the decompressor can be found from the name only (see `detect()`).
+
+    With `NONE`, no external stage is added and `pg_dump` compresses with
+    its built-in (single-threaded) zlib, as before.
+    """
+
+    NONE = 'none'
+    ZSTD = 'zstd'
+    GZIP = 'gzip'
+
+    CODECS = {
+        NONE: {
+            'suffix': '',
+            'compress': None,
+            'decompress': None,
+        },
+        ZSTD: {
+            'suffix': '.zst',
+            'compress': ['zstd', '--quiet', '--stdout', '-{level}',
+                         '--threads={threads}'],
+            'decompress': ['zstd', '--quiet', '--decompress', '--stdout'],
+        },
+        GZIP: {
+            'suffix': '.gz',
+            # `pigz` compresses with several threads, output is regular gzip
+            'compress': ['pigz', '--stdout', '-{level}',
+                         '--processes', '{threads}'],
+            'decompress': ['pigz', '--decompress', '--stdout'],
+        },
+    }
+
+    DEFAULT_LEVELS = {
+        ZSTD: 3,
+        GZIP: 6,
+    }
+
+    def __init__(self, codec=NONE, level=None, threads=0):
+        """
+        Args:
+            codec (str): `Compressor.NONE`, `ZSTD` or `GZIP`
+            level (int): compression level, codec's default if `None`
+            threads (int): compression threads, all cores if 0
+        """
+        if codec not in self.CODECS:
+            raise ValueError('Unknown compression codec `{}`'.format(codec))
+        self.codec = codec
+        self.level = level or self.DEFAULT_LEVELS.get(codec)
+        self.threads = threads
+
+    @property
+    def dump_args(self):
+        """
+        Returns:
+            list: extra `pg_dump` arguments
+        """
+        if self.codec == self.NONE:
+            return []
+        return ['--compress=0']
+
+    @property
+    def suffix(self):
+        return self.CODECS[self.codec]['suffix']
+
+    @classmethod
+    def detect(cls, filename):
+        """
+        Returns:
+            str: codec of `filename`, guessed from its suffix
+        """
+        for codec, properties in cls.CODECS.items():
+            if properties['suffix'] and filename.endswith(
+                    properties['suffix']):
+                return codec
+        return cls.NONE
+
+    @classmethod
+    def get_decompress_command(cls, codec):
+        """
+        Returns:
+            list: command reading compressed data on stdin, `None` if `codec`
+            does not need any
+        """
+        return cls.CODECS[codec]['decompress']
+
+    @classmethod
+    def decompress(cls, codec, data):
+        """
+        Returns:
+            bytes: decompressed `data`
+        """
+        command = cls.get_decompress_command(codec)
+        if command is None:
+            return data
+        return subprocess.run(command, input=data, stdout=subprocess.PIPE,
+                              check=True).stdout
+
+    @classmethod
+    def decompress_file(cls, codec, source, destination):
+        """
+        Args:
+            codec (str)
+            source (str): path of compressed file
+            destination (str): path of decompressed file
+        """
+        command = cls.get_decompress_command(codec)
+        if command is None:
+            shutil.copyfile(source, destination)
+            return
+        with open(source, 'rb') as fsrc, open(destination, 'wb') as fdest:
+            subprocess.run(command, stdin=fsrc, stdout=fdest, check=True)
+
+    @classmethod
+    def open_decompressed(cls, codec, path):
+        """
+        Returns:
+            file-like object: decompressed content of `path`
+        """
+        command = cls.get_decompress_command(codec)
+        if command is None:
+            return open(path, 'rb')
+        with open(path, 'rb') as f:
+            return CompressedStream(command, stdin=f)
+
+    def compress(self, data):
+        """
+        Returns:
+            bytes: compressed `data`
+        """
+        command = self.get_compress_command()
+        if command is None:
+            return data
+        return subprocess.run(command, input=data, stdout=subprocess.PIPE,
+                              check=True).stdout
+
+    def get_compress_command(self):
+        """
+        Returns:
+            list: command compressing stdin to stdout, `None` if there is no
+            external stage
+        """
+        command = self.CODECS[self.codec]['compress']
+        if command is None:
+            return None
+        threads = self.threads
+        if threads == 0 and self.codec == self.GZIP:
+            # Unlike `zstd`, `pigz` does not accept 0
+            threads = len(os.sched_getaffinity(0))
+        return [arg.format(level=self.level, threads=threads)
+                for arg in command]
+
+    def open(self, command):
+        """
+        Start `command` and pipe its output through the compressor.
+
+        Returns:
+            CompressedStream
+        """
+        return CompressedStream(command + self.dump_args,
+                                self.get_compress_command())
+
+    def open_file(self, path):
+        """
+        Returns:
+            file-like object: compressed content of `path`
+        """
+        command = self.get_compress_command()
+        if command is None:
+            return open(path, 'rb')
+        with open(path, 'rb') as f:
+            return CompressedStream(command, stdin=f)
+
+    def wrap(self, destination):
+        """
+        Args:
+            destination: writable file-like object
+
+        Returns:
+            file-like object: compresses what is written to it into
+            `destination`
+        """
+        command = self.get_compress_command()
+        if command is None:
+            return destination
+        return CompressingWriter(command, destination)
+
+
+class CompressedStream:
+    """
+    Readable output of a command, optionally piped through a compressor.
+    """
+
+    def __init__(self, command, compress_command=None, stdin=None):
+        self.__processes = [subprocess.Popen(command, stdin=stdin,
+                                             stdout=subprocess.PIPE)]
+        if compress_command is not None:
+            producer = self.__processes[0]
+            self.__processes.append(subprocess.Popen(compress_command,
+                                                     stdin=producer.stdout,
+                                                     stdout=subprocess.PIPE))
+            # Let the compressor own the pipe, so the producer gets SIGPIPE
+            # if the compressor dies
+            producer.stdout.close()
+        self.stdout = self.__processes[-1].stdout
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
+
+    def read(self, size=-1):
+        return self.stdout.read(size)
+
+    def close(self):
+        """
+        Wait for all processes of the pipeline.
+
+        Raises:
+            RuntimeError: if one of them failed
+        """
+        self.stdout.close()
+        for process in self.__processes:
+            if process.wait() != 0:
+                raise RuntimeError('`{}` failed with code {}'.format(
+                    process.args[0], process.returncode))
+
+    def kill(self):
+        self.stdout.close()
+        for process in self.__processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+
+
+class CompressingWriter:
+    """
+    Writable file-like object which pipes data through a compressor into
+    `destination`. Compressor output is copied by a background thread.
+    """
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self, compress_command, destination):
+        self.__destination = destination
+        self.__process = subprocess.Popen(compress_command,
+                                          stdin=subprocess.PIPE,
+                                          stdout=subprocess.PIPE)
+        self.__error = None
+        self.__thread = Thread(target=self.__copy_output, daemon=True)
+        self.__thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.kill()
+
+    def write(self, data):
+        try:
+            self.__process.stdin.write(data)
+        except BrokenPipeError:
+            self.close()
+            raise
+        return len(data)
+
+    def close(self):
+        """
+        Raises:
+            RuntimeError: if the compressor failed
+        """
+        if not self.__process.stdin.closed:
+            self.__process.stdin.close()
+        self.__thread.join()
+        if self.__error is not None:
+            raise self.__error
+        if self.__process.wait() != 0:
+            raise RuntimeError('`{}` failed with code {}'.format(
+                self.__process.args[0], self.__process.returncode))
+
+    def kill(self):
+        if self.__process.poll() is None:
+            self.__process.kill()
+        self.__process.wait()
+        self.__thread.join()
+
+    def __copy_output(self):
+        try:
+            while True:
+                chunk = self.__process.stdout.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                self.__destination.write(chunk)
+        except Exception as e:
+            self.__error = e
+            # Unblock writer
+            self.__process.kill()
+        finally:
+            self.__process.stdout.close()
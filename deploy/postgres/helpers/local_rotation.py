@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+import datetime
+import os
+import shutil
+
+from helpers.retention_planner import RetentionPlanner
+
+
+class LocalRotation:
+    """
+    Rotating backups on local disk, sorted in tiers like on S3:
+    `<root>/daily`, `<root>/weekly`, `<root>/monthly` and `<root>/yearly`.
+
+    Each new dump is added to every tier, and each tier keeps the newest
+    backup of each of its `keeps` most recent periods (see
+    `RetentionPlanner`). Tiers hold hard links to the same file instead of
+    copies, so a dump kept by several tiers is stored once and disk usage
+    is about one dump per distinct backup kept by any tier.
+
+    Backups are either files or directories (`pg_dump --format=directory`),
+    whose files are linked one by one.
+    """
+
+    TIERS = [
+        ('daily', RetentionPlanner.DAILY),
+        ('weekly', RetentionPlanner.WEEKLY),
+        ('monthly', RetentionPlanner.MONTHLY),
+        ('yearly', RetentionPlanner.YEARLY),
+    ]
+
+    def __init__(self, root, rules, prefix='postgres-'):
+        """
+        Args:
+            root (str)
+            rules (dict): number of periods to keep, keyed by period
+                (`RetentionPlanner.DAILY`, `WEEKLY`, `MONTHLY` or `YEARLY`)
+            prefix (str): prefix of backup names, other files are ignored
+        """
+        self.root = root
+        self.__rules = rules
+        self.__prefix = prefix
+
+    def add(self, path, name):
+        """
+        Move a complete dump to the first tier and link it in the others.
+        Each step is atomic: a tier never contains a partial backup.
+
+        Args:
+            path (str): dump, on the same filesystem as `root`
+            name (str): name of the backup
+
+        Returns:
+            list: paths of the backup, one per tier
+        """
+        paths = []
+        for tier, _ in self.TIERS:
+            directory = os.path.join(self.root, tier)
+            os.makedirs(directory, exist_ok=True)
+            destination = os.path.join(directory, name)
+            if not paths:
+                os.replace(path, destination)
+            else:
+                self.__link(paths[0], destination)
+            paths.append(destination)
+        return paths
+
+    def get_backups(self, tier=None):
+        """
+        Args:
+            tier (str): all tiers when `None`
+
+        Returns:
+            list: dicts with `name`, `tier`, `path`, `size` and
+            `last_modified` (naive UTC datetime), one per tier a backup is
+            in, oldest first
+        """
+        backups = []
+        for tier_, _ in self.TIERS:
+            if tier is not None and tier_ != tier:
+                continue
+            directory = os.path.join(self.root, tier_)
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if not name.startswith(self.__prefix):
+                    continue
+                path = os.path.join(directory, name)
+                backups.append({
+                    'name': name,
+                    'tier': tier_,
+                    'path': path,
+                    'size': self.__get_size(path),
+                    'last_modified': datetime.datetime.utcfromtimestamp(
+                        os.path.getmtime(path)),
+                })
+        return sorted(backups, key=lambda x: x['last_modified'])
+
+    def rotate(self, dry_run=False):
+        """
+        Apply the rule of each tier to its own backups. Deleting a link only
+        frees space once the backup is in no other tier.
+
+        Returns:
+            list: paths deleted (or to delete when `dry_run`)
+        """
+        deleted = []
+        for tier, period in self.TIERS:
+            planner = RetentionPlanner({period: self.__rules.get(period, 0)})
+            plan = planner.get_plan(self.get_backups(tier))
+            for item in plan:
+                if item['action'] != RetentionPlanner.DELETE:
+                    continue
+                path = item['backup']['path']
+                if not dry_run:
+                    self.__delete(path)
+                deleted.append(path)
+        return deleted
+
+    @staticmethod
+    def __delete(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.unlink(path)
+
+    @staticmethod
+    def __get_size(path):
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        return sum(os.path.getsize(os.path.join(root, filename))
+                   for root, _, filenames in os.walk(path)
+                   for filename in filenames)
+
+    @classmethod
+    def __link(cls, source, destination):
+        """
+        Hard link `source` (file or directory tree) as `destination`. Files
+        are copied if the filesystem does not support hard links.
+        """
+        tmp_destination = os.path.join(
+            os.path.dirname(destination),
+            '.{}.tmp'.format(os.path.basename(destination)))
+        if os.path.lexists(tmp_destination):
+            cls.__delete(tmp_destination)
+
+        if os.path.isdir(source):
+            shutil.copytree(source, tmp_destination,
+                            copy_function=cls.__link_file)
+        else:
+            cls.__link_file(source, tmp_destination)
+        os.replace(tmp_destination, destination)
+
+    @staticmethod
+    def __link_file(source, destination):
+        try:
+            os.link(source, destination)
+        except OSError:
+            shutil.copy2(source, destination)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import datetime
+import hashlib
+import os
+import shutil
+import tempfile
+
+
+class LocalStorage:
+    """
+    Local directory with the same interface as `S3Client`, e.g. to archive
+    on a mounted volume or to test against a local directory instead of S3.
+
+    Keys are paths relative to `root`. Objects are written to a temporary
+    file which is synced then renamed, so readers never see partial objects.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def delete_object(self, key_name):
+        path = self.__get_path(key_name)
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+        # Like S3, a prefix does not exist without objects
+        directory = os.path.dirname(path)
+        while directory != os.path.normpath(self.root):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def delete_objects(self, key_names):
+        """
+        Returns:
+            list: keys which could not be deleted
+        """
+        errors = []
+        for key_name in key_names:
+            try:
+                self.delete_object(key_name)
+            except OSError:
+                errors.append(key_name)
+        return errors
+
+    def download_object(self, key_name, fileobj):
+        with open(self.__get_path(key_name), 'rb') as f:
+            shutil.copyfileobj(f, fileobj)
+
+    def get_object(self, key_name):
+        """
+        Returns:
+            tuple: (bytes, ETag), `(None, None)` if the object does not exist
+        """
+        try:
+            with open(self.__get_path(key_name), 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None, None
+        return content, hashlib.md5(content).hexdigest()
+
+    def get_object_range(self, key_name, start, end):
+        """
+        Returns:
+            bytes: content of the object from `start` to `end` (inclusive)
+        """
+        with open(self.__get_path(key_name), 'rb') as f:
+            f.seek(start)
+            return f.read(end - start + 1)
+
+    def head_object(self, key_name):
+        """
+        Returns:
+            str: ETag of the object, `None` if it does not exist
+        """
+        return self.get_object(key_name)[1]
+
+    def list_objects(self, prefix=''):
+        """
+        Yields:
+            dict: `key`, `size`, `last_modified` (naive UTC datetime) and
+            `etag` (always `None`, computing it would read every file) of
+            each object under `prefix`
+        """
+        for root, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(root, filename)
+                key_name = os.path.relpath(path, self.root)
+                if filename.startswith('.') or \
+                        not key_name.startswith(prefix):
+                    continue
+                stat = os.stat(path)
+                yield {
+                    'key': key_name,
+                    'size': stat.st_size,
+                    'last_modified': datetime.datetime.utcfromtimestamp(
+                        stat.st_mtime),
+                    'etag': None,
+                }
+
+    def open(self, key_name, metadata=None):
+        """
+        Args:
+            key_name (str)
+            metadata (dict): ignored, local files have no metadata
+
+        Returns:
+            LocalWriter
+        """
+        return LocalWriter(self.__get_path(key_name))
+
+    def put_object(self, key_name, data, metadata=None):
+        with self.open(key_name) as f:
+            f.write(data)
+        return hashlib.md5(data).hexdigest()
+
+    def reset(self):
+        """
+        Nothing to reset, exists for `UploadPool` retries.
+        """
+
+    def __get_path(self, key_name):
+        path = os.path.normpath(os.path.join(self.root, key_name))
+        if not path.startswith(os.path.join(os.path.normpath(self.root), '')):
+            raise ValueError('Invalid key `{}`'.format(key_name))
+        return path
+
+
+class LocalWriter:
+    """
+    Writable file-like object with the same attributes as
+    `MultipartUploader`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self.__hash = hashlib.sha256()
+        self.__md5 = hashlib.md5()
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, self.__tmp_path = tempfile.mkstemp(
+            dir=directory, prefix='.{}.'.format(os.path.basename(path)))
+        self.__file = os.fdopen(fd, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def sha256(self):
+        return self.__hash.hexdigest()
+
+    @property
+    def etag(self):
+        """
+        Returns:
+            str: same as `LocalStorage.head_object()` once written
+        """
+        return self.__md5.hexdigest()
+
+    def abort(self):
+        if not self.__file.closed:
+            self.__file.close()
+        if os.path.exists(self.__tmp_path):
+            os.unlink(self.__tmp_path)
+
+    def close(self):
+        if self.__file.closed:
+            return
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+        self.__file.close()
+        os.chmod(self.__tmp_path, 0o644)
+        os.replace(self.__tmp_path, self.path)
+
+    def write(self, data):
+        self.__hash.update(data)
+        self.__md5.update(data)
+        self.size += len(data)
+        return self.__file.write(data)
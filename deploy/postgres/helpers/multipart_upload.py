@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+
+class UploadPool:
+    """
+    Worker pool shared by all uploads of a backup, which bounds the number
+    of parts in flight (being sent or waiting to be sent) and therefore
+    memory usage to roughly `parts_in_flight` * `part_size`.
+    """
+
+    # S3 rejects smaller parts, except the last one
+    MIN_PART_SIZE = 5 * 1024 ** 2
+
+    def __init__(self, client, part_size, parts_in_flight, retries=5,
+                 backoff=1, metrics=None):
+        """
+        Args:
+            client: S3 client (e.g. `S3Client`)
+            part_size (int): bytes per part, at least `MIN_PART_SIZE`
+            parts_in_flight (int): parts sent concurrently
+            retries (int): attempts per part before giving up
+            backoff (float): seconds before first retry, doubled each time
+            metrics (BackupMetrics): receives part latencies and retries
+        """
+        self.client = client
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics
+        self.__executor = ThreadPoolExecutor(max_workers=parts_in_flight)
+        self.__slots = BoundedSemaphore(parts_in_flight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def open(self, key_name, metadata=None):
+        """
+        Args:
+            key_name (str)
+            metadata (dict): user metadata of the object
+
+        Returns:
+            MultipartUploader
+        """
+        return MultipartUploader(self, key_name, metadata)
+
+    def record_part(self, seconds, size):
+        """
+        Report the time taken to send a part (or a chunk) to `metrics`.
+        """
+        if self.metrics is not None:
+            self.metrics.observe_part(seconds, size)
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=True)
+
+    def submit(self, func, *args):
+        """
+        Run `func` in the pool. Block while all slots are taken.
+
+        Returns:
+            concurrent.futures.Future
+        """
+        self.__slots.acquire()
+        try:
+            future = self.__executor.submit(func, *args)
+        except BaseException:
+            self.__slots.release()
+            raise
+        future.add_done_callback(lambda _: self.__slots.release())
+        return future
+
+    def call_with_retries(self, func, *args):
+        """
+        Call `func` until it succeeds, at most `retries` times, with
+        exponential backoff (and jitter) between attempts.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                delay = self.backoff * 2 ** (attempt - 1)
+                delay += random.uniform(0, delay / 2)
+                print('Attempt #{} failed ({}), retrying in {:.1f}s'.format(
+                    attempt, e, delay))
+                if self.metrics is not None:
+                    self.metrics.add_retry()
+                # Start over with a fresh connection
+                self.client.reset()
+                time.sleep(delay)
+
+
+class MultipartUploader:
+    """
+    Writable file-like object which uploads data to S3 with a multipart
+    upload, sending parts concurrently through an `UploadPool`.
+
+    Data which fits in a single part is sent with a simple PUT.
+
+    Checksums are computed while data is sent: the SHA-256 of the whole
+    object, and the MD5 of each part (in the pool's workers), from which
+    the ETag S3 gives the object is derived (see `etag`). Keeping the ETag
+    is enough to verify the object later with a HEAD request.
+    """
+
+    def __init__(self, pool, key_name, metadata=None):
+        self.key_name = key_name
+        self.metadata = metadata
+        self.size = 0
+        self.parts = []
+        # Hex MD5 digests, keyed by part number
+        self.part_md5s = {}
+        self.__hash = hashlib.sha256()
+        self.__pool = pool
+        self.__buffer = bytearray()
+        self.__upload_id = None
+        self.__futures = []
+        self.__lock = Lock()
+        self.__closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    @property
+    def sha256(self):
+        """
+        Returns:
+            str: hex digest of data written so far
+        """
+        return self.__hash.hexdigest()
+
+    @property
+    def etag(self):
+        """
+        ETag of the object once uploaded: the MD5 of its content for a
+        simple PUT, the MD5 of the concatenated MD5 digests of the parts
+        followed by `-<number of parts>` for a multipart upload. Objects
+        encrypted with SSE-KMS or SSE-C have other ETags.
+
+        Returns:
+            str: `None` until `close()` has succeeded
+        """
+        if not self.part_md5s:
+            return None
+        if self.__upload_id is None:
+            return self.part_md5s[1]
+        digests = b''.join(bytes.fromhex(self.part_md5s[part_number])
+                           for part_number in sorted(self.part_md5s))
+        return '{}-{}'.format(hashlib.md5(digests).hexdigest(),
+                              len(self.part_md5s))
+
+    def write(self, data):
+        self.__hash.update(data)
+        self.__buffer.extend(data)
+        self.size += len(data)
+        part_size = self.__pool.part_size
+        while len(self.__buffer) >= part_size:
+            part = bytes(self.__buffer[:part_size])
+            del self.__buffer[:part_size]
+            self.__submit_part(part)
+        return len(data)
+
+    def close(self):
+        """
+        Send remaining data and wait for all parts to be uploaded.
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+
+        if self.__upload_id is None:
+            data = bytes(self.__buffer)
+            self.__pool.call_with_retries(self.__pool.client.put_object,
+                                          self.key_name, data, self.metadata)
+            self.__buffer = bytearray()
+            self.part_md5s[1] = hashlib.md5(data).hexdigest()
+            return
+
+        if self.__buffer:
+            self.__submit_part(bytes(self.__buffer))
+            self.__buffer = bytearray()
+
+        try:
+            for future in self.__futures:
+                future.result()
+            self.__pool.call_with_retries(
+                self.__pool.client.complete_multipart_upload,
+                self.key_name, self.__upload_id, self.parts)
+        except BaseException:
+            self.abort()
+            raise
+
+    def abort(self):
+        """
+        Cancel the upload. Parts which are already sent are discarded.
+        """
+        self.__closed = True
+        self.__buffer = bytearray()
+        if self.__upload_id is None:
+            return
+
+        for future in self.__futures:
+            future.cancel()
+        for future in self.__futures:
+            try:
+                future.result()
+            except BaseException:
+                pass
+        try:
+            self.__pool.client.abort_multipart_upload(self.key_name,
+                                                      self.__upload_id)
+        except Exception as e:
+            print('Could not abort upload of `{}`: {}'.format(self.key_name,
+                                                               e))
+
+    def __submit_part(self, data):
+        if self.__upload_id is None:
+            self.__upload_id = self.__pool.call_with_retries(
+                self.__pool.client.create_multipart_upload, self.key_name,
+                self.metadata)
+
+        # Fail fast if a previous part could not be sent
+        for future in self.__futures:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+        part_number = len(self.__futures) + 1
+        self.__futures.append(self.__pool.submit(self.__upload_part,
+                                                 part_number, data))
+
+    def __upload_part(self, part_number, data):
+        md5 = hashlib.md5(data).hexdigest()
+        started = time.monotonic()
+        etag = self.__pool.call_with_retries(self.__pool.client.upload_part,
+                                             self.key_name,
+                                             self.__upload_id,
+                                             part_number,
+                                             data)
+        self.__pool.record_part(time.monotonic() - started, len(data))
+        with self.__lock:
+            self.parts.append((part_number, etag))
+            self.part_md5s[part_number] = md5
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+import os
+
+
+class ParallelDownload:
+    """
+    Download objects with concurrent ranged GETs. Each part is written at
+    its offset of the local file as soon as it arrives, so parts do not
+    need to be reassembled in order.
+
+    Parts go through an `UploadPool`, which bounds the number of parts in
+    memory and retries failed requests.
+    """
+
+    def __init__(self, pool):
+        """
+        Args:
+            pool (UploadPool): its `part_size` is the size of ranges
+        """
+        self.__pool = pool
+
+    def download(self, key_name, size, path):
+        """
+        Args:
+            key_name (str)
+            size (int): size of the object, e.g. from a listing
+            path (str): local file, created or truncated
+        """
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # Allocate the whole file at once, parts are written anywhere
+            os.ftruncate(fd, size)
+            futures = [
+                self.__pool.submit(self.__download_part, key_name, fd, start,
+                                   min(start + self.__pool.part_size, size)
+                                   - 1)
+                for start in range(0, size, self.__pool.part_size)
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def __download_part(self, key_name, fd, start, end):
+        data = self.__pool.call_with_retries(
+            self.__pool.client.get_object_range, key_name, start, end)
+        if len(data) != end - start + 1:
+            raise IOError('Incomplete range {}-{} of `{}`'.format(
+                start, end, key_name))
+        os.pwrite(fd, data, start)
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.compressor import Compressor
+from helpers.psql_session import PsqlSession
+from helpers.throttle import Priority
+
+
+class ParallelDump:
+    """
+    Dump a database with several `pg_dump` processes sharing the same
+    snapshot, like `pg_dump --format=directory --jobs N` does, but without
+    writing a directory on local disk: each piece is a custom-format dump
+    streamed to its own destination.
+
+    Pieces are:
+        - `pre-data`: schema (tables, types, functions...)
+        - `data-<schema>.<table>`: data of each table larger than
+          `TABLE_MIN_SIZE`, largest first
+        - `data`: data of everything else (small tables, sequences, large
+          objects, extension configuration tables)
+        - `post-data`: indexes, constraints, triggers...
+
+    To restore, `pre-data` must be restored first, then all data pieces
+    (in parallel), then `post-data`.
+    """
+
+    PRE_DATA = 'pre-data'
+    DATA = 'data'
+    POST_DATA = 'post-data'
+
+    # Smaller tables are dumped together in the `data` piece
+    TABLE_MIN_SIZE = 16 * 1024 ** 2
+
+    TABLES_QUERY = """
+        SELECT pg_relation_size(c.oid),
+               '"' || replace(n.nspname, '"', '""') || '"."' ||
+               replace(c.relname, '"', '""') || '"',
+               n.nspname || '.' || c.relname
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relkind = 'r'
+          AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+          AND n.nspname NOT LIKE 'pg\\_toast%'
+          AND n.nspname NOT LIKE 'pg\\_temp%'
+          AND NOT EXISTS (
+              SELECT 1 FROM pg_depend d
+              WHERE d.classid = 'pg_class'::regclass
+                AND d.objid = c.oid
+                AND d.deptype = 'e'
+          )
+          AND pg_relation_size(c.oid) >= {min_size}
+        ORDER BY 1 DESC;
+    """
+
+    def __init__(self, dburl, jobs, chunk_size, compressor=None,
+                 priority=Priority.NORMAL):
+        """
+        Args:
+            dburl (str): database URL
+            jobs (int): number of `pg_dump` processes running at once
+            chunk_size (int): bytes read at once from `pg_dump`
+            compressor (Compressor): compression stage of each piece
+            priority (str): CPU and I/O priority of `pg_dump` (see
+                `Priority`)
+        """
+        self.__dburl = dburl
+        self.__jobs = jobs
+        self.__chunk_size = chunk_size
+        self.__compressor = compressor or Compressor()
+        self.__priority = priority
+
+    def run(self, open_piece):
+        """
+        Args:
+            open_piece (callable): receives the name of a piece, returns a
+                writable file-like context manager
+
+        Returns:
+            list: one dict per piece with `name`, `section` and `size`,
+            in restore order
+        """
+        with PsqlSession(self.__dburl) as session:
+            snapshot = session.export_snapshot()
+            tables = [row.split('|', 2)
+                      for row in session.query(self.TABLES_QUERY.format(
+                          min_size=self.TABLE_MIN_SIZE))]
+
+            # Large objects metadata would be created twice otherwise: it
+            # belongs to pre-data, but data-only dumps include it as well.
+            pieces = [{
+                'name': self.PRE_DATA,
+                'section': self.PRE_DATA,
+                'args': ['--section=pre-data', '--no-blobs'],
+            }]
+            for size, pattern, table in tables:
+                pieces.append({
+                    'name': 'data-{}'.format(table),
+                    'section': self.DATA,
+                    'args': ['--data-only', '--table={}'.format(pattern)],
+                })
+            pieces.append({
+                'name': self.DATA,
+                'section': self.DATA,
+                'args': ['--data-only'] + [
+                    '--exclude-table-data={}'.format(pattern)
+                    for size, pattern, table in tables
+                ],
+            })
+            pieces.append({
+                'name': self.POST_DATA,
+                'section': self.POST_DATA,
+                'args': ['--section=post-data'],
+            })
+
+            with ThreadPoolExecutor(max_workers=self.__jobs) as executor:
+                sizes = list(executor.map(
+                    lambda piece: self.__dump(snapshot, piece, open_piece),
+                    pieces))
+
+        return [{'name': piece['name'],
+                 'section': piece['section'],
+                 'size': size}
+                for piece, size in zip(pieces, sizes)]
+
+    def __dump(self, snapshot, piece, open_piece):
+        command = Priority.wrap(['pg_dump',
+                                 '--format=c',
+                                 '--snapshot={}'.format(snapshot),
+                                 '--dbname={}'.format(self.__dburl)] +
+                                piece['args'], self.__priority)
+        size = 0
+        with self.__compressor.open(command) as stream, \
+                open_piece(piece['name']) as destination:
+            while True:
+                chunk = stream.read(self.__chunk_size)
+                if not chunk:
+                    break
+                destination.write(chunk)
+                size += len(chunk)
+            # Fail before `destination` completes the upload
+            stream.close()
+
+        return size
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import tempfile
+import time
+
+
+class PsqlSession:
+    """
+    Keep a `psql` session (and its transaction) open in the background.
+
+    Used to export a snapshot which other processes (e.g. `pg_dump
+    --snapshot`) can import as long as the transaction which exported it is
+    alive.
+
+    psql output is block-buffered when it is not a terminal, results are
+    therefore read from a file which psql closes (and thus flushes) after
+    each query.
+    """
+
+    QUERY_TIMEOUT = 60
+
+    def __init__(self, dburl):
+        self.__directory = tempfile.mkdtemp(prefix='psql-session-')
+        self.__counter = 0
+        self.__process = subprocess.Popen(
+            ['psql',
+             '--no-psqlrc',
+             '--quiet',
+             '--no-align',
+             '--tuples-only',
+             '--set', 'ON_ERROR_STOP=1',
+             '--dbname', dburl],
+            stdin=subprocess.PIPE,
+            universal_newlines=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self.__process.poll() is None:
+            try:
+                self.__process.stdin.close()
+            except BrokenPipeError:
+                pass
+            try:
+                self.__process.wait(self.QUERY_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self.__process.kill()
+                self.__process.wait()
+
+        for filename in os.listdir(self.__directory):
+            os.unlink(os.path.join(self.__directory, filename))
+        os.rmdir(self.__directory)
+
+    def export_snapshot(self):
+        """
+        Start a repeatable read transaction and export its snapshot.
+
+        Returns:
+            str: snapshot id
+        """
+        self.execute('BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;')
+        return self.query('SELECT pg_export_snapshot();')[0]
+
+    def execute(self, sql):
+        self.__process.stdin.write('{}\n'.format(sql))
+        self.__process.stdin.flush()
+
+    def query(self, sql, timeout=QUERY_TIMEOUT):
+        """
+        Run `sql` in the session and wait for its result.
+
+        Args:
+            sql (str)
+            timeout (int): seconds, wait forever if `None`
+
+        Returns:
+            list: one string per row, columns separated by `|`
+        """
+        self.__counter += 1
+        output_file = os.path.join(self.__directory,
+                                   '{}.out'.format(self.__counter))
+        done_file = os.path.join(self.__directory,
+                                 '{}.done'.format(self.__counter))
+        # `\o` without argument closes the output file. The second file
+        # tells when the first one is complete.
+        self.execute('\\o {output}\n{sql}\n\\o {done}\n\\o'.format(
+            output=output_file, sql=sql, done=done_file))
+
+        deadline = time.time() + timeout if timeout is not None else None
+        while not os.path.exists(done_file):
+            if self.__process.poll() is not None:
+                raise RuntimeError('psql exited with code {}'.format(
+                    self.__process.returncode))
+            if deadline is not None and time.time() > deadline:
+                raise RuntimeError('psql query timed out')
+            time.sleep(0.05)
+
+        with open(output_file, 'r') as f:
+            return [line for line in f.read().split('\n') if line]
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+
+
+class RetentionPlanner:
+    """
+    Grandfather-father-son retention, computed in a single pass over all
+    backups whatever their tier.
+
+    For each rule, backups are grouped by period (day, ISO week, month or
+    year) and the newest backup of each of the `keeps` most recent periods
+    is kept. A backup is kept when at least one rule keeps it, e.g. the
+    last backup of a month may be kept by both the daily and the monthly
+    rules. Every other backup is deleted.
+
+    Backups smaller than `minimum_size` are considered invalid: they are not
+    counted and never deleted.
+    """
+
+    KEEP = 'keep'
+    DELETE = 'delete'
+
+    DAILY = 'daily'
+    WEEKLY = 'weekly'
+    MONTHLY = 'monthly'
+    YEARLY = 'yearly'
+
+    PERIODS = {
+        DAILY: lambda date: (date.year, date.month, date.day),
+        WEEKLY: lambda date: tuple(date.isocalendar()[:2]),
+        MONTHLY: lambda date: (date.year, date.month),
+        YEARLY: lambda date: (date.year,),
+    }
+
+    def __init__(self, rules, minimum_size=0):
+        """
+        Args:
+            rules (dict): number of periods to keep, keyed by period
+                (`RetentionPlanner.DAILY`, `WEEKLY`, `MONTHLY` or `YEARLY`)
+            minimum_size (int): bytes
+        """
+        unknown_periods = set(rules) - set(self.PERIODS)
+        if unknown_periods:
+            raise ValueError('Unknown periods: {}'.format(
+                ', '.join(sorted(unknown_periods))))
+        self.__rules = rules
+        self.__minimum_size = minimum_size
+
+    def get_plan(self, backups):
+        """
+        Args:
+            backups (list): dicts with at least `name`, `size` and
+                `last_modified` (datetime)
+
+        Returns:
+            list: one dict per backup with keys `backup`, `action` and
+            `reasons` (rules which keep it), newest first
+        """
+        backups = sorted(backups, key=lambda x: x['last_modified'],
+                         reverse=True)
+        valid_backups = [backup for backup in backups
+                         if backup['size'] >= self.__minimum_size]
+        reasons = {backup['name']: [] for backup in backups}
+
+        for period, keeps in self.__rules.items():
+            get_period = self.PERIODS[period]
+            seen_periods = set()
+            for backup in valid_backups:
+                if len(seen_periods) >= keeps:
+                    break
+                backup_period = get_period(backup['last_modified'])
+                if backup_period not in seen_periods:
+                    # Newest first: first backup met is the newest of its
+                    # period
+                    seen_periods.add(backup_period)
+                    reasons[backup['name']].append(period)
+
+        plan = []
+        for backup in backups:
+            backup_reasons = reasons[backup['name']]
+            if backup['size'] < self.__minimum_size:
+                backup_reasons = ['below minimum size']
+            plan.append({
+                'backup': backup,
+                'action': self.KEEP if backup_reasons else self.DELETE,
+                'reasons': backup_reasons,
+            })
+
+        return plan
+
+    @classmethod
+    def print_plan(cls, plan):
+        print('Retention plan:')
+        width = max([len(item['backup']['name']) for item in plan] or [0])
+        for item in plan:
+            reasons = ' ({})'.format(', '.join(item['reasons'])) \
+                if item['reasons'] else ''
+            print('\t{name:<{width}}  {action}{reasons}'.format(
+                name=item['backup']['name'],
+                width=width,
+                action=item['action'],
+                reasons=reasons,
+            ))
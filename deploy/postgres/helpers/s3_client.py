@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+import base64
+import datetime
+import hashlib
+import http.client
+import shutil
+from threading import local
+from urllib.parse import urlsplit
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from helpers.aws_signature import AWSSignature
+from helpers.throttle import ThrottledReader
+
+
+class S3Error(Exception):
+    """
+    Error response of S3, e.g. `404 NoSuchKey`.
+    """
+
+    def __init__(self, status, code, message):
+        super().__init__('{} {}: {}'.format(status, code, message))
+        self.status = status
+        self.code = code
+
+
+class S3Client:
+    """
+    S3 client with the operations needed by backup scripts, built on the
+    standard library only: requests are signed by `AWSSignature` and sent
+    over persistent connections.
+
+    Each thread keeps its own connection alive between requests, so the
+    TCP and TLS handshakes are paid once per thread instead of once per
+    request. A connection closed by S3 while idle is reopened
+    transparently.
+
+    The region of the bucket is discovered from the first response when it
+    is not given. `endpoint_url` points the client to an S3-compatible
+    server (e.g. a local stand-in for tests), with path-style URLs.
+
+    Uploads (parts and simple PUTs) can be rate limited by a `TokenBucket`
+    shared by all threads.
+    """
+
+    # Maximum number of keys of a `DeleteObjects` request
+    MAX_DELETE_KEYS = 1000
+    # Seconds to wait for each socket operation
+    TIMEOUT = 60
+    DEFAULT_REGION = 'us-east-1'
+
+    def __init__(self, access_key, secret_key, bucket_name, throttle=None,
+                 region=None, endpoint_url=None):
+        """
+        Args:
+            throttle (TokenBucket): limits upload bandwidth when not `None`
+            region (str): region of the bucket, discovered when `None`
+            endpoint_url (str): e.g. `http://localhost:9000`, AWS when
+                `None`
+        """
+        self.throttle = throttle
+        self.region = region
+        self.__bucket_name = bucket_name
+        self.__endpoint = urlsplit(endpoint_url) if endpoint_url else None
+        self.__signature = AWSSignature(access_key, secret_key, 's3')
+        self.__local = local()
+
+    def reset(self):
+        """
+        Close the connection of the current thread, e.g. after a network
+        error.
+        """
+        connection = getattr(self.__local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self.__local.connection = None
+
+    def list_objects(self, prefix=''):
+        """
+        Yields:
+            dict: `key`, `size`, `last_modified` (naive UTC datetime) and
+            `etag` of each object under `prefix`
+        """
+        query = {'list-type': 2, 'prefix': prefix}
+        while True:
+            _, content = self.__request('GET', query=query)
+            result = ElementTree.fromstring(content)
+            for item in result.iterfind('{*}Contents'):
+                yield {
+                    'key': item.findtext('{*}Key'),
+                    'size': int(item.findtext('{*}Size')),
+                    'last_modified': self.__parse_timestamp(
+                        item.findtext('{*}LastModified')),
+                    'etag': item.findtext('{*}ETag').strip('"'),
+                }
+            if result.findtext('{*}IsTruncated') != 'true':
+                break
+            query['continuation-token'] = result.findtext(
+                '{*}NextContinuationToken')
+
+    def head_object(self, key_name):
+        """
+        Returns:
+            str: ETag of the object, `None` if it does not exist
+        """
+        response, _ = self.__request('HEAD', key_name, expected=(200, 404))
+        if response.status == 404:
+            return None
+        return response.getheader('ETag').strip('"')
+
+    def download_object(self, key_name, fileobj):
+        self.__request('GET', key_name, fileobj=fileobj)
+
+    def get_object(self, key_name):
+        """
+        Returns:
+            tuple: (bytes, ETag), `(None, None)` if the object does not exist
+        """
+        response, content = self.__request('GET', key_name,
+                                           expected=(200, 404))
+        if response.status == 404:
+            return None, None
+        return content, response.getheader('ETag').strip('"')
+
+    def get_object_range(self, key_name, start, end):
+        """
+        Returns:
+            bytes: content of the object from `start` to `end` (inclusive)
+        """
+        _, content = self.__request(
+            'GET', key_name,
+            headers={'Range': 'bytes={}-{}'.format(start, end)},
+            expected=(206,))
+        return content
+
+    def put_object(self, key_name, data, metadata=None):
+        """
+        Returns:
+            str: ETag of the object
+        """
+        response, _ = self.__request('PUT', key_name,
+                                     headers=self.__get_metadata_headers(
+                                         metadata),
+                                     data=data)
+        return response.getheader('ETag').strip('"')
+
+    def copy_object(self, source_key_name, key_name, metadata=None):
+        """
+        Copy an object of the bucket on the server side. Objects over 5 GB
+        cannot be copied in one request.
+
+        Args:
+            metadata (dict): replaces the metadata of the source when not
+                `None`
+
+        Returns:
+            str: ETag of the copy
+        """
+        headers = self.__get_metadata_headers(metadata)
+        headers['x-amz-copy-source'] = AWSSignature.quote(
+            '/{}/{}'.format(self.__bucket_name, source_key_name), safe='/')
+        if metadata is not None:
+            headers['x-amz-metadata-directive'] = 'REPLACE'
+        _, content = self.__request('PUT', key_name, headers=headers)
+        return self.__parse(content).findtext('{*}ETag').strip('"')
+
+    def delete_object(self, key_name):
+        self.__request('DELETE', key_name, expected=(204, 200))
+
+    def delete_objects(self, key_names):
+        """
+        Delete keys with batch requests of `MAX_DELETE_KEYS` keys.
+
+        Returns:
+            list: keys which could not be deleted
+        """
+        errors = []
+        for i in range(0, len(key_names), self.MAX_DELETE_KEYS):
+            xml = ['<Delete><Quiet>true</Quiet>']
+            for key_name in key_names[i:i + self.MAX_DELETE_KEYS]:
+                xml.append('<Object><Key>{}</Key></Object>'.format(
+                    escape(key_name)))
+            xml.append('</Delete>')
+            _, content = self.__request('POST', query={'delete': ''},
+                                        data=''.join(xml).encode())
+            errors += [error.findtext('{*}Key') for error in
+                       self.__parse(content).iterfind('{*}Error')]
+        return errors
+
+    def create_multipart_upload(self, key_name, metadata=None):
+        _, content = self.__request('POST', key_name, query={'uploads': ''},
+                                    headers=self.__get_metadata_headers(
+                                        metadata))
+        return ElementTree.fromstring(content).findtext('{*}UploadId')
+
+    def upload_part(self, key_name, upload_id, part_number, data):
+        """
+        Returns:
+            str: ETag of the part
+        """
+        response, _ = self.__request('PUT', key_name,
+                                     query={'partNumber': part_number,
+                                            'uploadId': upload_id},
+                                     data=data)
+        return response.getheader('ETag')
+
+    def complete_multipart_upload(self, key_name, upload_id, parts):
+        """
+        Args:
+            parts (list): `(part_number, etag)` tuples
+
+        Returns:
+            str: ETag of the object
+        """
+        xml = ['<CompleteMultipartUpload>']
+        for part_number, etag in sorted(parts):
+            xml.append('<Part><PartNumber>{}</PartNumber>'
+                       '<ETag>{}</ETag></Part>'.format(part_number,
+                                                       escape(etag)))
+        xml.append('</CompleteMultipartUpload>')
+        _, content = self.__request('POST', key_name,
+                                    query={'uploadId': upload_id},
+                                    data=''.join(xml).encode())
+        return self.__parse(content).findtext('{*}ETag').strip('"')
+
+    def abort_multipart_upload(self, key_name, upload_id):
+        self.__request('DELETE', key_name, query={'uploadId': upload_id},
+                       expected=(204, 200))
+
+    def __get_connection(self, host):
+        """
+        Returns:
+            tuple: connection of the current thread to `host`, and whether
+            it has already been used
+        """
+        connection = getattr(self.__local, 'connection', None)
+        if connection is not None and self.__local.host == host:
+            return connection, True
+
+        self.reset()
+        if self.__endpoint is not None \
+                and self.__endpoint.scheme == 'http':
+            connection = http.client.HTTPConnection(host,
+                                                    timeout=self.TIMEOUT)
+        else:
+            connection = http.client.HTTPSConnection(host,
+                                                     timeout=self.TIMEOUT)
+        self.__local.connection = connection
+        self.__local.host = host
+        return connection, False
+
+    def __get_location(self, key_name):
+        """
+        Returns:
+            tuple: host and URI-encoded path of `key_name`
+        """
+        key_path = '/' + AWSSignature.quote(key_name, safe='/-_.~')
+        if self.__endpoint is not None:
+            return (self.__endpoint.netloc,
+                    '{}/{}{}'.format(self.__endpoint.path.rstrip('/'),
+                                     self.__bucket_name,
+                                     key_path if key_name else ''))
+
+        domain = 's3.amazonaws.com' if self.region is None \
+            else 's3.{}.amazonaws.com'.format(self.region)
+        if '.' in self.__bucket_name:
+            # Dots do not match the wildcard certificate of virtual hosts
+            return domain, '/{}{}'.format(self.__bucket_name,
+                                          key_path if key_name else '')
+        return '{}.{}'.format(self.__bucket_name, domain), key_path
+
+    @staticmethod
+    def __get_metadata_headers(metadata):
+        return {'x-amz-meta-{}'.format(name): value
+                for name, value in (metadata or {}).items()}
+
+    @staticmethod
+    def __parse(content):
+        """
+        Some operations report errors in the body of a `200 OK` response.
+        """
+        result = ElementTree.fromstring(content)
+        if result.tag.rpartition('}')[2] == 'Error':
+            raise S3Error(200, result.findtext('Code'),
+                          result.findtext('Message'))
+        return result
+
+    @staticmethod
+    def __parse_timestamp(value):
+        try:
+            return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+        except ValueError:
+            return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%SZ')
+
+    def __request(self, method, key_name='', query=None, headers=None,
+                  data=None, fileobj=None, expected=(200,)):
+        """
+        Args:
+            data (bytes): body
+            fileobj: receives the body of the response instead of
+                returning it
+            expected (tuple): statuses of a successful response
+
+        Returns:
+            tuple: response, and its body (`None` with `fileobj`)
+        """
+        headers = dict(headers or {})
+        payload_hash = AWSSignature.EMPTY_PAYLOAD_HASH
+        if data is not None:
+            md5 = hashlib.md5(data).digest()
+            headers['Content-MD5'] = base64.b64encode(md5).decode()
+            headers['Content-Length'] = str(len(data))
+            # The MD5 already protects the content, hashing it again with
+            # SHA256 would only cost CPU
+            payload_hash = AWSSignature.UNSIGNED_PAYLOAD
+
+        region_discovered = False
+        while True:
+            host, path = self.__get_location(key_name)
+            signed_headers = self.__signature.sign(
+                method, host, path, query, headers, payload_hash,
+                self.region or self.DEFAULT_REGION)
+            target = path
+            if query:
+                target += '?' + '&'.join(
+                    '{}={}'.format(AWSSignature.quote(name),
+                                   AWSSignature.quote(str(value)))
+                    for name, value in sorted(query.items()))
+
+            connection, reused = self.__get_connection(host)
+            try:
+                connection.request(method, target,
+                                   body=self.__get_body(data),
+                                   headers=signed_headers)
+                response = connection.getresponse()
+            except (http.client.RemoteDisconnected, BrokenPipeError,
+                    ConnectionResetError):
+                self.reset()
+                # S3 closes idle connections, retry once with a new one
+                if reused:
+                    continue
+                raise
+
+            try:
+                if response.status in expected and fileobj is not None:
+                    shutil.copyfileobj(response, fileobj, 2 ** 20)
+                    content = None
+                else:
+                    content = response.read()
+            except BaseException:
+                self.reset()
+                raise
+
+            region = response.getheader('x-amz-bucket-region')
+            if response.status not in expected and region \
+                    and region != self.region and not region_discovered:
+                # Wrong region, S3 tells which one is right
+                self.region = region
+                region_discovered = True
+                continue
+
+            if response.status not in expected:
+                code = message = None
+                if content:
+                    try:
+                        error = ElementTree.fromstring(content)
+                        code = error.findtext('Code')
+                        message = error.findtext('Message')
+                    except ElementTree.ParseError:
+                        pass
+                raise S3Error(response.status, code or response.reason,
+                              message or '{} {}'.format(method, target))
+            return response, content
+
+    def __get_body(self, data):
+        if data is None or self.throttle is None:
+            return data
+        # `http.client` reads file-like bodies by blocks, each block waits
+        # for its tokens
+        return ThrottledReader(data, self.throttle)
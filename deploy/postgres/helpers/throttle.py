@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import datetime
+import io
+import re
+import shutil
+import time
+from threading import Lock
+
+
+class TokenBucket:
+    """
+    Rate limit shared by several threads, e.g. all uploads of a backup.
+
+    Tokens (bytes) are added at `rate` per second, up to `burst`.
+    `consume()` takes tokens and, when there are not enough, blocks for the
+    time needed to earn the missing ones. Consumers which go in debt wait in
+    turn, so the total rate stays under the limit whatever the number of
+    threads.
+
+    The rate can depend on the time of day (UTC): each profile is a window
+    with its own rate, e.g. a low limit during business hours. A rate of 0
+    means no limit.
+    """
+
+    PROFILE_PATTERN = re.compile(
+        r'^(\d{1,2}):(\d{2})-(\d{1,2}):(\d{2})=(\d+(?:\.\d+)?)$')
+
+    def __init__(self, rate, burst=None, profiles=None):
+        """
+        Args:
+            rate (float): bytes per second outside profiles, 0 for no limit
+            burst (int): bytes which can be sent at once, one second at the
+                current rate if `None`
+            profiles (list): `(start, end, rate)` tuples, `start` and `end`
+                in minutes since midnight UTC (see `parse_profiles()`)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.profiles = profiles or []
+        self.__tokens = 0
+        self.__updated = None
+        self.__lock = Lock()
+
+    @classmethod
+    def parse_profiles(cls, text, unit=1):
+        """
+        Args:
+            text (str): comma-separated `HH:MM-HH:MM=RATE`, e.g.
+                `08:00-18:00=2,18:00-20:00=10`. Windows may span midnight.
+            unit (int): bytes per unit of `RATE`
+
+        Returns:
+            list: `(start, end, rate)` tuples
+        """
+        profiles = []
+        for profile in filter(None, (text or '').replace(' ', '').split(',')):
+            match = cls.PROFILE_PATTERN.match(profile)
+            if not match:
+                raise ValueError('Invalid rate profile `{}`'.format(profile))
+            start_hour, start_minute, end_hour, end_minute, rate = \
+                match.groups()
+            profiles.append((int(start_hour) * 60 + int(start_minute),
+                             int(end_hour) * 60 + int(end_minute),
+                             float(rate) * unit))
+        return profiles
+
+    def consume(self, size):
+        """
+        Block until `size` bytes may be sent.
+        """
+        with self.__lock:
+            rate = self.get_rate()
+            now = time.monotonic()
+            if not rate:
+                self.__updated = None
+                return
+            if self.__updated is None:
+                self.__tokens = 0
+            else:
+                self.__tokens = min(
+                    self.burst or rate,
+                    self.__tokens + (now - self.__updated) * rate)
+            self.__updated = now
+            self.__tokens -= size
+            wait = -self.__tokens / rate if self.__tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+    def get_rate(self, now=None):
+        """
+        Args:
+            now (datetime.datetime): naive UTC, current time if `None`
+
+        Returns:
+            float: bytes per second, 0 for no limit
+        """
+        now = now or datetime.datetime.utcnow()
+        minute = now.hour * 60 + now.minute
+        for start, end, rate in self.profiles:
+            if start <= end:
+                in_window = start <= minute < end
+            else:
+                in_window = minute >= start or minute < end
+            if in_window:
+                return rate
+        return self.rate
+
+
+class ThrottledReader(io.BytesIO):
+    """
+    In-memory file whose reads consume tokens of a `TokenBucket`. HTTP
+    clients send a body by reading it in small blocks, so the upload itself
+    is paced instead of sent in bursts of a whole part.
+    """
+
+    def __init__(self, data, bucket):
+        super().__init__(data)
+        self.__bucket = bucket
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.__bucket.consume(len(data))
+        return data
+
+
+class Priority:
+    """
+    CPU and I/O priority of backup processes, applied by prefixing their
+    command with `nice` and `ionice`.
+
+    Only processes of the backup container are affected (`pg_dump`,
+    compressors): the backend which reads the database for `pg_dump` runs in
+    the database container. It is slowed down indirectly, when `pg_dump`
+    reads more slowly.
+    """
+
+    NORMAL = 'normal'
+    LOW = 'low'
+    IDLE = 'idle'
+
+    COMMANDS = {
+        NORMAL: ([], []),
+        # Best-effort I/O class, lowest level
+        LOW: (['nice', '-n', '10'], ['ionice', '-c', '2', '-n', '7']),
+        # Idle I/O class: disk access only when nobody else needs it
+        IDLE: (['nice', '-n', '19'], ['ionice', '-c', '3']),
+    }
+
+    @classmethod
+    def wrap(cls, command, priority):
+        """
+        Args:
+            command (list)
+            priority (str): `Priority.NORMAL`, `LOW` or `IDLE`
+
+        Returns:
+            list: `command` with its prefix. `ionice` is left out when it
+            is not installed.
+        """
+        if priority not in cls.COMMANDS:
+            raise ValueError('Unknown priority `{}`'.format(priority))
+        nice, ionice = cls.COMMANDS[priority]
+        if ionice and shutil.which(ionice[0]) is None:
+            ionice = []
+        return nice + ionice + list(command)
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.compressor import Compressor
+from helpers.psql_session import PsqlSession
+
+
+class WalArchive:
+    """
+    Continuous archiving of PostgreSQL write-ahead log and base backups,
+    which allow point-in-time recovery.
+
+    PostgreSQL's `archive_command` (see `archive-wal.sh`) copies each
+    completed WAL file into a spool directory. `push()` sends spooled files
+    to the archive concurrently, then removes them from the spool.
+
+    Layout of the archive (under `prefix`):
+        - `wal/<WAL file name><compression suffix>`
+        - `base/<label>/base.tar<compression suffix>`: copy of the data
+          directory taken with the low-level backup API
+        - `base/<label>/backup_info.json`: written last, a base backup
+          without it is incomplete
+
+    Tablespaces outside of the data directory are not supported.
+    """
+
+    WAL_PREFIX = 'wal/'
+    BASE_PREFIX = 'base/'
+    BASE_BACKUP_FILE = 'base.tar'
+    BACKUP_INFO_FILE = 'backup_info.json'
+
+    DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    # Contents of these directories are not needed to restore (see
+    # PostgreSQL documentation, "Making a Base Backup Using the Low Level
+    # API"). Directories themselves are kept.
+    EXCLUDED_DIRECTORY_CONTENTS = ['pg_dynshmem', 'pg_notify', 'pg_replslot',
+                                   'pg_serial', 'pg_snapshots', 'pg_stat_tmp',
+                                   'pg_subtrans', 'pg_wal']
+    EXCLUDED_FILES = ['postmaster.pid', 'postmaster.opts', 'backup_label',
+                      'backup_label.old', 'tablespace_map',
+                      'tablespace_map.old', 'pg_internal.init',
+                      'current_logfiles']
+    TEMPORARY_PREFIX = 'pgsql_tmp'
+
+    SEGMENT_PATTERN = re.compile(r'^[0-9A-F]{24}$')
+    HISTORY_PATTERN = re.compile(r'^[0-9A-F]{8}\.history$')
+
+    CHUNK_SIZE = 2 ** 20
+
+    def __init__(self, storage, open_object, compressor, prefix='', jobs=4):
+        """
+        Args:
+            storage: `S3Client` or `LocalStorage`
+            open_object (callable): receives a key and its metadata, returns
+                a writable file-like context manager (e.g.
+                `UploadPool.open()` or `LocalStorage.open()`)
+            compressor (Compressor)
+            prefix (str): prefix of all keys
+            jobs (int): files transferred concurrently
+        """
+        self.__storage = storage
+        self.__open_object = open_object
+        self.__compressor = compressor
+        self.__prefix = prefix
+        self.__jobs = jobs
+
+    def base_backup(self, dburl, data_directory):
+        """
+        Copy `data_directory` between `pg_backup_start()` and
+        `pg_backup_stop()` (`pg_start_backup()` and `pg_stop_backup()` before
+        PostgreSQL 15), in non-exclusive mode.
+
+        Returns:
+            dict: backup information
+        """
+        if not os.path.isfile(os.path.join(data_directory, 'PG_VERSION')):
+            raise RuntimeError('`{}` is not a PostgreSQL data directory'.format(
+                data_directory))
+
+        started = datetime.datetime.utcnow()
+        label = started.strftime('%Y%m%dT%H%M%SZ')
+        directory = '{}{}{}/'.format(self.__prefix, self.BASE_PREFIX, label)
+        key_name = '{}{}{}'.format(directory, self.BASE_BACKUP_FILE,
+                                   self.__compressor.suffix)
+
+        with PsqlSession(dburl) as session:
+            version = int(session.query('SHOW server_version_num;')[0])
+            if version >= 150000:
+                start_sql = "SELECT pg_backup_start('{}', true);"
+                stop_function = 'pg_backup_stop(true)'
+            else:
+                start_sql = "SELECT pg_start_backup('{}', true, false);"
+                stop_function = 'pg_stop_backup(false, true)'
+
+            # Waits for a checkpoint
+            start_lsn = session.query(start_sql.format(label),
+                                      timeout=None)[0]
+
+            with self.__open_object(key_name, {
+                'compression': self.__compressor.codec,
+            }) as destination, \
+                    self.__compressor.wrap(destination) as writer:
+                tar = tarfile.open(fileobj=writer, mode='w|',
+                                   format=tarfile.PAX_FORMAT)
+                self.__add_directory(tar, data_directory)
+
+                # Waits for the last WAL file to be archived
+                stop_lsn, label_file, tablespace_map = session.query(
+                    "SELECT lsn, "
+                    "encode(convert_to(labelfile, 'UTF8'), 'hex'), "
+                    "encode(convert_to(coalesce(spcmapfile, ''), 'UTF8'), "
+                    "'hex') FROM {};".format(stop_function),
+                    timeout=None)[0].split('|')
+                # Owned by PostgreSQL, like other files
+                owner = os.stat(data_directory)
+                self.__add_bytes(tar, 'backup_label',
+                                 bytes.fromhex(label_file), owner)
+                if tablespace_map:
+                    self.__add_bytes(tar, 'tablespace_map',
+                                     bytes.fromhex(tablespace_map), owner)
+                tar.close()
+
+            start_wal, stop_wal = session.query(
+                "SELECT pg_walfile_name('{}'), pg_walfile_name('{}');".format(
+                    start_lsn, stop_lsn))[0].split('|')
+
+        info = {
+            'label': label,
+            'key': key_name,
+            'compression': self.__compressor.codec,
+            'size': destination.size,
+            'sha256': destination.sha256,
+            'server_version': version,
+            'start_lsn': start_lsn,
+            'stop_lsn': stop_lsn,
+            'start_wal': start_wal,
+            'stop_wal': stop_wal,
+            'start_time': started.strftime(self.DATE_FORMAT),
+            'stop_time': datetime.datetime.utcnow().strftime(
+                self.DATE_FORMAT),
+        }
+        self.__storage.put_object(directory + self.BACKUP_INFO_FILE,
+                                  json.dumps(info, indent=2).encode())
+        return info
+
+    def delete_obsolete(self, retention):
+        """
+        Keep the `retention` most recent base backups and the WAL needed to
+        restore them (and to recover up to now). Incomplete base backups
+        older than the oldest kept one are deleted too.
+
+        Returns:
+            list: deleted keys
+        """
+        base_backups = self.get_base_backups()
+        if retention < 1 or len(base_backups) <= retention:
+            return []
+
+        oldest_kept = base_backups[-retention]
+        obsolete_keys = []
+        for object_ in self.__storage.list_objects(
+                self.__prefix + self.BASE_PREFIX):
+            label = object_['key'][len(self.__prefix + self.BASE_PREFIX):] \
+                .split('/')[0]
+            if label < oldest_kept['label']:
+                obsolete_keys.append(object_['key'])
+
+        for object_ in self.__storage.list_objects(
+                self.__prefix + self.WAL_PREFIX):
+            name = self.__get_wal_name(object_['key'])
+            # Timelines history files are tiny and needed to follow timeline
+            # switches
+            if self.HISTORY_PATTERN.match(name):
+                continue
+            # Compare log and segment numbers, whatever the timeline
+            if name[8:24] < oldest_kept['start_wal'][8:24]:
+                obsolete_keys.append(object_['key'])
+
+        errors = self.__storage.delete_objects(obsolete_keys)
+        return [key for key in obsolete_keys if key not in errors]
+
+    def get_base_backups(self):
+        """
+        Returns:
+            list: information of complete base backups, oldest first
+        """
+        base_backups = []
+        for object_ in self.__storage.list_objects(
+                self.__prefix + self.BASE_PREFIX):
+            if object_['key'].endswith('/' + self.BACKUP_INFO_FILE):
+                content, _ = self.__storage.get_object(object_['key'])
+                base_backups.append(json.loads(content.decode()))
+        return sorted(base_backups, key=lambda x: x['stop_time'])
+
+    def push(self, spool_directory):
+        """
+        Send spooled WAL files to the archive concurrently. Files are
+        removed from the spool once sent.
+
+        Returns:
+            tuple: names of sent files, and of files which could not be sent
+        """
+        filenames = sorted(
+            filename for filename in os.listdir(spool_directory)
+            if not filename.startswith('.')
+            and os.path.isfile(os.path.join(spool_directory, filename))
+        )
+        if not filenames:
+            return [], []
+
+        with ThreadPoolExecutor(max_workers=self.__jobs) as executor:
+            results = list(executor.map(
+                lambda filename: self.__push_file(spool_directory, filename),
+                filenames))
+
+        return ([filename for filename, ok in zip(filenames, results) if ok],
+                [filename for filename, ok in zip(filenames, results)
+                 if not ok])
+
+    def restore(self, data_directory, wal_directory, target_time=None,
+                force=False):
+        """
+        Restore the most recent base backup completed before `target_time`,
+        fetch the WAL files recorded since then concurrently into
+        `wal_directory`, and configure PostgreSQL (12 or later) to replay
+        them up to `target_time` when it starts.
+
+        Args:
+            data_directory (str): PostgreSQL data directory, which must be
+                empty unless `force` is `True`
+            wal_directory (str): where fetched WAL files are stored. It must
+                be readable at the same path by PostgreSQL.
+            target_time (datetime): naive UTC datetime, recover until the
+                end of the archive if `None`
+            force (bool): delete the content of `data_directory`
+
+        Returns:
+            dict: information of restored base backup, with the number of
+            fetched WAL files in `wal_files`
+        """
+        candidates = [
+            base_backup for base_backup in self.get_base_backups()
+            if target_time is None or base_backup['stop_time'] <=
+            target_time.strftime(self.DATE_FORMAT)
+        ]
+        if not candidates:
+            raise RuntimeError('No base backup completed before {}'.format(
+                target_time))
+        base_backup = candidates[-1]
+
+        if os.listdir(data_directory):
+            if not force:
+                raise RuntimeError('`{}` is not empty'.format(data_directory))
+            self.__empty_directory(data_directory)
+
+        owner = os.stat(data_directory)
+        # Files of a previous restore may belong to another timeline
+        if os.path.isdir(wal_directory):
+            self.__empty_directory(wal_directory)
+        os.makedirs(wal_directory, exist_ok=True)
+
+        # Download the base backup first, extraction from a stream would
+        # hold the connection open for the whole extraction
+        fd, tmp_path = tempfile.mkstemp(dir=wal_directory, prefix='.base.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.__storage.download_object(base_backup['key'], f)
+            with Compressor.open_decompressed(base_backup['compression'],
+                                              tmp_path) as stream:
+                with tarfile.open(fileobj=stream, mode='r|') as tar:
+                    tar.extractall(data_directory, numeric_owner=True)
+                # Read padding after end of archive, the decompressor would
+                # get SIGPIPE otherwise
+                while stream.read(self.CHUNK_SIZE):
+                    pass
+        finally:
+            os.unlink(tmp_path)
+
+        wal_files = self.__fetch_wal(base_backup['start_wal'], wal_directory)
+
+        recovery_settings = [
+            '',
+            '# Added by point-in-time recovery of base backup {}'.format(
+                base_backup['label']),
+            "restore_command = 'cp {}/%f %p'".format(wal_directory),
+            "recovery_target_action = 'promote'",
+        ]
+        if target_time is not None:
+            recovery_settings.append(
+                "recovery_target_time = '{}+00'".format(
+                    target_time.strftime('%Y-%m-%d %H:%M:%S')))
+        auto_conf = os.path.join(data_directory, 'postgresql.auto.conf')
+        with open(auto_conf, 'a') as f:
+            f.write('\n'.join(recovery_settings) + '\n')
+        recovery_signal = os.path.join(data_directory, 'recovery.signal')
+        open(recovery_signal, 'w').close()
+        for path in (auto_conf, recovery_signal):
+            os.chown(path, owner.st_uid, owner.st_gid)
+
+        return dict(base_backup, wal_files=len(wal_files))
+
+    def __add_bytes(self, tar, arcname, content, owner):
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.uid = owner.st_uid
+        tarinfo.gid = owner.st_gid
+        tarinfo.size = len(content)
+        tarinfo.mtime = int(datetime.datetime.utcnow().timestamp())
+        tarinfo.mode = 0o600
+        tar.addfile(tarinfo, io.BytesIO(content))
+
+    def __add_directory(self, tar, data_directory):
+        for root, dirnames, filenames in os.walk(data_directory):
+            relative_root = os.path.relpath(root, data_directory)
+            if relative_root != '.':
+                self.__add_path(tar, root, relative_root)
+
+            if relative_root in self.EXCLUDED_DIRECTORY_CONTENTS:
+                # `pg_wal/archive_status` must exist when restoring
+                if relative_root == 'pg_wal':
+                    dirnames[:] = ['archive_status']
+                else:
+                    dirnames[:] = []
+                continue
+            if relative_root == os.path.join('pg_wal', 'archive_status'):
+                continue
+
+            dirnames[:] = sorted(dirname for dirname in dirnames
+                                 if not dirname.startswith(
+                                     self.TEMPORARY_PREFIX))
+            # Not walked into, e.g. tablespaces links in `pg_tblspc`
+            for dirname in dirnames:
+                if os.path.islink(os.path.join(root, dirname)):
+                    self.__add_path(tar, os.path.join(root, dirname),
+                                    os.path.join(relative_root, dirname))
+            for filename in sorted(filenames):
+                if filename in self.EXCLUDED_FILES \
+                        or filename.startswith(self.TEMPORARY_PREFIX):
+                    continue
+                self.__add_path(tar, os.path.join(root, filename),
+                                os.path.join(relative_root, filename))
+
+    @staticmethod
+    def __add_path(tar, path, arcname):
+        """
+        Files may be modified, truncated or deleted while they are copied;
+        WAL replay makes them consistent. Deleted files are skipped and
+        truncated ones are padded with zeros to the size which was announced
+        in their header.
+        """
+        try:
+            tarinfo = tar.gettarinfo(path, os.path.normpath(arcname))
+        except FileNotFoundError:
+            return
+        if tarinfo is None:
+            # Sockets and other special files
+            return
+        if not tarinfo.isreg():
+            tar.addfile(tarinfo)
+            return
+
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            tar.addfile(tarinfo, _FixedSizeReader(f, tarinfo.size))
+
+    @staticmethod
+    def __empty_directory(directory):
+        for filename in os.listdir(directory):
+            path = os.path.join(directory, filename)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+    def __fetch_wal(self, start_wal, wal_directory):
+        """
+        Fetch every WAL file from `start_wal` (whatever its timeline), and
+        every timeline history file.
+
+        Returns:
+            list: names of fetched files
+        """
+        keys = {}
+        for object_ in self.__storage.list_objects(
+                self.__prefix + self.WAL_PREFIX):
+            name = self.__get_wal_name(object_['key'])
+            if self.HISTORY_PATTERN.match(name) or (
+                self.SEGMENT_PATTERN.match(name)
+                and name[8:24] >= start_wal[8:24]
+            ):
+                keys[name] = object_['key']
+
+        with ThreadPoolExecutor(max_workers=self.__jobs) as executor:
+            list(executor.map(
+                lambda name: self.__fetch_file(keys[name], name,
+                                               wal_directory),
+                sorted(keys)))
+        return sorted(keys)
+
+    def __fetch_file(self, key_name, name, wal_directory):
+        codec = Compressor.detect(key_name)
+        fd, tmp_path = tempfile.mkstemp(dir=wal_directory,
+                                        prefix='.{}.'.format(name))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.__storage.download_object(key_name, f)
+            Compressor.decompress_file(codec, tmp_path,
+                                       os.path.join(wal_directory, name))
+        finally:
+            os.unlink(tmp_path)
+
+    def __get_wal_name(self, key_name):
+        name = os.path.basename(key_name)
+        codec = Compressor.detect(name)
+        suffix = Compressor.CODECS[codec]['suffix']
+        return name[:-len(suffix)] if suffix else name
+
+    def __push_file(self, spool_directory, filename):
+        path = os.path.join(spool_directory, filename)
+        key_name = '{}{}{}{}'.format(self.__prefix, self.WAL_PREFIX, filename,
+                                     self.__compressor.suffix)
+        try:
+            with self.__compressor.open_file(path) as stream, \
+                    self.__open_object(key_name, {
+                        'compression': self.__compressor.codec,
+                    }) as destination:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+                # Fail before `destination` completes the upload
+                stream.close()
+        except Exception as e:
+            print('Could not archive `{}`: {}'.format(filename, e))
+            return False
+
+        os.unlink(path)
+        return True
+
+
+class _FixedSizeReader:
+    """
+    Read exactly `size` bytes from `fileobj`, padding with zeros if it is
+    shorter.
+    """
+
+    def __init__(self, fileobj, size):
+        self.__fileobj = fileobj
+        self.__remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.__remaining:
+            size = self.__remaining
+        chunk = self.__fileobj.read(size)
+        if len(chunk) < size:
+            chunk += b'\0' * (size - len(chunk))
+        self.__remaining -= len(chunk)
+        return chunk
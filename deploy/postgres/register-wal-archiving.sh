@@ -0,0 +1,32 @@
+#!/usr/bin/env bash
+# Linux Alpine Compatible
+# Starts the process which sends WAL files spooled by `archive-wal.sh` to the
+# archive, and schedules base backups. Must run after `register-cron.sh`,
+# which overwrites the crontab, and before `crond` starts (see `entrypoint.sh`).
+
+if [[ "${POSTGRES_WAL_ARCHIVING}" != "True" ]]; then
+    exit 0
+fi
+
+SPOOL_DIR=/var/lib/postgresql/wal-spool
+DATA_DIR=/var/lib/postgresql/data
+
+# PostgreSQL writes into the spool volume, which is created owned by root
+chown "$(stat -c '%u:%g' "${DATA_DIR}")" "${SPOOL_DIR}"
+
+PYTHON=python3
+if [[ "${POSTGRES_WAL_ARCHIVE_DESTINATION}" == "s3" ]]; then
+    PYTHON="$(bash /postgres-scripts/ensure-virtualenv.sh)"
+    if [[ -z "${PYTHON}" ]]; then
+        echo "Virtual environment creation failed!"
+        exit 1
+    fi
+fi
+
+echo "Starting WAL archiving to ${POSTGRES_WAL_ARCHIVE_DESTINATION}..."
+nohup "${PYTHON}" /postgres-scripts/wal-archive.py push --loop 5 >> /srv/logs/wal-archive.log 2>&1 &
+
+CRON_CMD="${POSTGRES_WAL_BASE_BACKUP_SCHEDULE} BASH_ENV=/.env ${PYTHON} /postgres-scripts/wal-archive.py base-backup >> /srv/logs/base-backup.log 2>&1"
+echo "${CRON_CMD}" >> /etc/crontabs/root
+
+echo "Crontab job to perform base backups set at: /etc/crontabs/root with expression: '${CRON_CMD}'"
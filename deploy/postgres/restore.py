@@ -0,0 +1,360 @@
+# Restore the support database from a backup, as fast as possible.
+#
+#   restore.py list
+#   restore.py restore NAME [--jobs N] [--keep-spool]
+#
+# NAME is a key of the S3 tiers (see `backup-to-s3.py`) or a path of the
+# local tiers under `/srv/backups` (see `rotate-backups.py`). The database is
+# dropped and created again, then restored in phases whose durations are
+# reported at the end:
+#   - download: S3 objects are fetched with concurrent ranged GETs, and
+#     deduplicated backups rebuilt, into a local spool
+#   - decompress: `zstd`/`gzip` dumps are decompressed in the spool, as
+#     `pg_restore --jobs` needs a seekable file
+#   - pre-data: tables, types, functions...
+#   - data: `pg_restore --jobs N`, without any index or constraint yet
+#   - post-data: indexes, constraints and triggers, `--jobs N`
+#   - analyze: planner statistics, which `pg_restore` does not restore
+import argparse
+import datetime
+import glob
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
+
+from helpers.chunk_store import ChunkStore
+from helpers.compressor import Compressor
+from helpers.local_rotation import LocalRotation
+from helpers.multipart_upload import UploadPool
+from helpers.parallel_download import ParallelDownload
+
+
+DBURL = os.environ.get('SUPPORT_DATABASE_URL')
+
+USE_S3 = bool(os.environ.get('AWS_ACCESS_KEY_ID')
+              and os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME'))
+# Same layout as `backup-to-s3.py`, `backup-to-disk.sh` and
+# `dedup-backup.py`
+S3_CATALOG_KEY = 'postgres/catalog.json'
+S3_CHUNKS_PREFIX = 'postgres/chunks/'
+CATALOG_CACHE = os.environ.get('AWS_BACKUP_CATALOG_CACHE',
+                               '/srv/backups/.s3-catalog.json')
+LOCAL_DIR = os.environ.get('POSTGRES_BACKUP_LOCAL_DIR', '/srv/backups')
+LOCAL_DEDUP_DIR = os.environ.get('POSTGRES_BACKUP_DEDUP_DIR',
+                                 '/srv/backups/dedup')
+PARALLEL_DUMP_TOC = 'toc.json'
+DEDUP_INDEX_SUFFIX = '.pg_dump.dedup'
+
+# Deleted once the restore is over, unless `--keep-spool` is passed
+SPOOL_DIR = os.environ.get('POSTGRES_RESTORE_SPOOL_DIR',
+                           '/srv/backups/restore')
+# Size of ranged GETs, and number of them in flight. Memory usage is
+# roughly the product of both.
+RANGE_SIZE = int(os.environ.get('POSTGRES_RESTORE_RANGE_SIZE',
+                                16)) * 1024 ** 2
+DOWNLOAD_JOBS = int(os.environ.get('POSTGRES_RESTORE_DOWNLOAD_JOBS', 8))
+
+###############################################################################
+
+
+def get_backups(client):
+    """
+    Returns:
+        list: dicts with `name`, `source` (`s3` or `local`), `format`,
+        `compression`, `size` and `last_modified`, oldest first
+    """
+    backups = []
+    if client is not None:
+        from helpers.backup_catalog import BackupCatalog
+
+        catalog = BackupCatalog(client, S3_CATALOG_KEY, CATALOG_CACHE)
+        if not catalog.load():
+            print('S3 backup catalog is missing, run `backup-to-s3.py '
+                  '--reconcile-catalog`', file=sys.stderr)
+        for backup in catalog.get_backups():
+            backups.append({
+                'name': backup['name'],
+                'source': 's3',
+                'format': backup.get('format') or 'custom',
+                'compression': backup['compression'],
+                'size': backup['size'],
+                'last_modified': backup['last_modified'],
+            })
+
+    # A backup of `backup-to-disk.sh` is linked in several tiers, listed once
+    paths = {}
+    for backup in LocalRotation(LOCAL_DIR, {}).get_backups():
+        paths.setdefault(backup['name'], backup['path'])
+    paths = list(paths.values()) + \
+        glob.glob(os.path.join(LOCAL_DEDUP_DIR, '*' + DEDUP_INDEX_SUFFIX))
+    for path in paths:
+        if path.endswith(DEDUP_INDEX_SUFFIX):
+            with open(path, 'r') as f:
+                index = json.loads(f.read())
+            format_, size = 'dedup', index['size']
+        elif os.path.isdir(path):
+            # `pg_dump --format=directory` of `backup-to-disk.sh`
+            format_ = 'directory'
+            size = sum(os.path.getsize(file_)
+                       for file_ in glob.glob(os.path.join(path, '*')))
+        else:
+            format_, size = 'custom', os.path.getsize(path)
+        backups.append({
+            'name': path,
+            'source': 'local',
+            'format': format_,
+            'compression': Compressor.detect(path),
+            'size': size,
+            'last_modified': datetime.datetime.utcfromtimestamp(
+                os.path.getmtime(path)),
+        })
+
+    return sorted(backups, key=lambda x: x['last_modified'])
+
+
+def get_client():
+    if not USE_S3:
+        return None
+
+    from helpers.s3_client import S3Client
+
+    return S3Client(os.environ.get('AWS_ACCESS_KEY_ID'),
+                    os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                    os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME'),
+                    region=os.environ.get('AWS_BACKUP_REGION') or None,
+                    endpoint_url=os.environ.get(
+                        'AWS_BACKUP_ENDPOINT_URL') or None)
+
+
+def download(backup, client, upload_pool):
+    """
+    Fetch the objects of `backup` into the spool. Local backups are used
+    in place, except deduplicated ones which are rebuilt.
+
+    Returns:
+        list: local paths of the objects of the backup
+    """
+    if backup['format'] == 'dedup':
+        if backup['source'] == 'local':
+            from helpers.local_storage import LocalStorage
+
+            # Not used for uploads, only for retries of reads
+            upload_pool = UploadPool(LocalStorage(LOCAL_DEDUP_DIR),
+                                     RANGE_SIZE, DOWNLOAD_JOBS)
+            prefix = 'chunks/'
+            index_key = os.path.basename(backup['name'])
+        else:
+            prefix = S3_CHUNKS_PREFIX
+            index_key = backup['name']
+        chunk_store = ChunkStore(upload_pool, prefix, Compressor(),
+                                 # Only used to write new backups
+                                 1024 ** 2)
+        path = os.path.join(SPOOL_DIR, 'dump.pg_dump')
+        with open(path, 'wb') as f:
+            chunk_store.read(index_key, f, DOWNLOAD_JOBS)
+        return [path]
+
+    if backup['source'] == 'local':
+        return [backup['name']]
+
+    prefix = backup['name'] + '/' if backup['format'] == 'parallel' \
+        else backup['name']
+    objects = [object_ for object_ in client.list_objects(prefix=prefix)
+               if backup['format'] == 'parallel'
+               or object_['key'] == backup['name']]
+    paths = [os.path.join(SPOOL_DIR, os.path.basename(object_['key']))
+             for object_ in objects]
+    parallel_download = ParallelDownload(upload_pool)
+    # Ranges of all objects share the pool, small objects do not wait for
+    # large ones
+    with ThreadPoolExecutor(max_workers=DOWNLOAD_JOBS) as executor:
+        for future in [executor.submit(parallel_download.download,
+                                       object_['key'], object_['size'], path)
+                       for object_, path in zip(objects, paths)]:
+            future.result()
+    return paths
+
+
+def decompress(paths, jobs):
+    """
+    Returns:
+        list: paths of decompressed files, in the spool
+    """
+    def _decompress(path):
+        codec = Compressor.detect(path)
+        if codec == Compressor.NONE:
+            return path
+        destination = os.path.join(
+            SPOOL_DIR,
+            os.path.basename(path)[:-len(Compressor.CODECS[codec]['suffix'])])
+        Compressor.decompress_file(codec, path, destination)
+        if path.startswith(SPOOL_DIR):
+            os.unlink(path)
+        return destination
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(_decompress, paths))
+
+
+def pg_restore(path, section=None, jobs=1):
+    """
+    Args:
+        path (str): archive
+        section (str): only restore this section, whole archive if `None`
+        jobs (int)
+    """
+    command = ['pg_restore', '--dbname={}'.format(DBURL)]
+    if section is not None:
+        command.append('--section={}'.format(section))
+    if jobs > 1:
+        command.append('--jobs={}'.format(jobs))
+    subprocess.run(command + [path], check=True)
+
+
+def recreate_database():
+    url = urlsplit(DBURL)
+    maintenance_url = urlunsplit(url._replace(path='/postgres'))
+    sql = """
+        SELECT pg_terminate_backend(pid) FROM pg_stat_activity
+        WHERE datname = :'dbname' AND pid <> pg_backend_pid();
+        DROP DATABASE IF EXISTS :"dbname";
+        CREATE DATABASE :"dbname";
+    """
+    subprocess.run(['psql', '--no-psqlrc', '--quiet',
+                    '--dbname={}'.format(maintenance_url),
+                    '--set=ON_ERROR_STOP=1',
+                    '--set=dbname={}'.format(url.path.lstrip('/'))],
+                   input=sql, stdout=subprocess.DEVNULL, text=True,
+                   check=True)
+
+
+def analyze(jobs):
+    subprocess.run(['vacuumdb', '--analyze-only', '--quiet',
+                    '--jobs={}'.format(jobs),
+                    '--dbname={}'.format(DBURL)], check=True)
+
+
+def restore(backup, jobs, client, timings):
+    """
+    Args:
+        backup (dict): see `get_backups()`
+        jobs (int): `pg_restore` jobs
+        client (S3Client): `None` if S3 is not used
+        timings (list): receives `(phase, seconds)` tuples, even if the
+            restore fails
+    """
+    def _run_phase(name, func, *args):
+        print('{}...'.format(name.capitalize()))
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            timings.append((name, time.time() - start))
+
+    with UploadPool(client, RANGE_SIZE, DOWNLOAD_JOBS) as upload_pool:
+        paths = _run_phase('download', download, backup, client, upload_pool)
+    paths = _run_phase('decompress', decompress, paths, jobs)
+    _run_phase('create database', recreate_database)
+
+    if backup['format'] != 'parallel':
+        # `pg_restore` runs post-data steps last anyway, but a single run
+        # would not report timings of each section
+        path = paths[0]
+        _run_phase('pre-data', pg_restore, path, 'pre-data')
+        _run_phase('data', pg_restore, path, 'data', jobs)
+        _run_phase('post-data', pg_restore, path, 'post-data', jobs)
+    else:
+        # Pieces of `ParallelDump`, see its table of contents. Each piece
+        # holds a single section, and data pieces hold large objects
+        # metadata as well: they are restored whole.
+        toc_path = next(path for path in paths
+                        if os.path.basename(path) == PARALLEL_DUMP_TOC)
+        with open(toc_path, 'r') as f:
+            toc = json.loads(f.read())
+        sections = {}
+        for piece in toc['pieces']:
+            suffix = Compressor.CODECS[Compressor.detect(piece['key'])][
+                'suffix']
+            sections.setdefault(piece['section'], []).append(os.path.join(
+                SPOOL_DIR, piece['key'][:len(piece['key']) - len(suffix)]))
+
+        def _restore_data():
+            # Each piece holds one large table (or all small ones)
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                list(executor.map(pg_restore, sections['data']))
+
+        _run_phase('pre-data', pg_restore, sections['pre-data'][0])
+        _run_phase('data', _restore_data)
+        _run_phase('post-data', pg_restore, sections['post-data'][0], None,
+                   jobs)
+
+    _run_phase('analyze', analyze, jobs)
+
+
+def list_backups(client):
+    for backup in get_backups(client):
+        print('\t'.join([
+            backup['name'],
+            backup['last_modified'].strftime('%Y-%m-%d %H:%M:%S'),
+            str(backup['size']),
+            backup['format'],
+        ]))
+    return True
+
+
+def restore_backup(client, name, jobs, keep_spool):
+    backup = next((backup for backup in get_backups(client)
+                   if backup['name'] == name), None)
+    if backup is None:
+        print('Backup `{}` not found'.format(name))
+        return False
+
+    print('Restoring `{}` with {} jobs...'.format(name, jobs))
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    timings = []
+    success = False
+    try:
+        restore(backup, jobs, client, timings)
+        success = True
+    except (subprocess.CalledProcessError, IOError, RuntimeError) as e:
+        print('Restore failed: {}'.format(e))
+    finally:
+        if not keep_spool:
+            shutil.rmtree(SPOOL_DIR, ignore_errors=True)
+
+    print('Restore timings:')
+    width = max(len(phase) for phase, _ in timings)
+    for phase, duration in timings:
+        print('\t{phase:<{width}}  {duration:.1f}s'.format(
+            phase=phase, width=width, duration=duration))
+    print('\t{phase:<{width}}  {duration:.1f}s'.format(
+        phase='total', width=width,
+        duration=sum(duration for _, duration in timings)))
+    return success
+
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command', required=True)
+subparsers.add_parser('list', help='list backups, tab-separated')
+restore_parser = subparsers.add_parser('restore',
+                                       help='drop the database and restore it')
+restore_parser.add_argument('name')
+restore_parser.add_argument('--jobs', type=int,
+                            default=len(os.sched_getaffinity(0)),
+                            help='defaults to the number of cores')
+restore_parser.add_argument('--keep-spool', action='store_true',
+                            help='keep downloaded files')
+args = parser.parse_args()
+
+client_ = get_client()
+if args.command == 'list':
+    success_ = list_backups(client_)
+else:
+    success_ = restore_backup(client_, args.name, args.jobs, args.keep_spool)
+
+sys.exit(0 if success_ else 1)
@@ -0,0 +1,4 @@
+#!/bin/sh
+# Run `restore.py`, which only needs the standard library, even when the
+# backup virtualenv is missing.
+exec python3 /postgres-scripts/restore.py "$@"
@@ -0,0 +1,60 @@
+# Rotation of backups on local disk (see `LocalRotation`).
+#
+#   rotate-backups.py [--dry-run] [PATH NAME]
+#
+# `PATH` is a complete dump, e.g. written to a temporary name by
+# `backup-to-disk.sh`. It is added to every tier as `NAME`, then each tier
+# deletes backups beyond its retention. Without `PATH`, only rotates.
+import argparse
+import os
+
+from helpers.local_rotation import LocalRotation
+from helpers.retention_planner import RetentionPlanner
+
+
+LOCAL_DIR = os.environ.get('POSTGRES_BACKUP_LOCAL_DIR', '/srv/backups')
+RULES = {
+    RetentionPlanner.YEARLY: int(os.environ.get(
+        'POSTGRES_BACKUP_LOCAL_YEARLY_RETENTION', 2)),
+    RetentionPlanner.MONTHLY: int(os.environ.get(
+        'POSTGRES_BACKUP_LOCAL_MONTHLY_RETENTION', 12)),
+    RetentionPlanner.WEEKLY: int(os.environ.get(
+        'POSTGRES_BACKUP_LOCAL_WEEKLY_RETENTION', 4)),
+    RetentionPlanner.DAILY: int(os.environ.get(
+        'POSTGRES_BACKUP_LOCAL_DAILY_RETENTION', 7)),
+}
+
+###############################################################################
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--dry-run', action='store_true',
+                    help='print backups which would be deleted')
+parser.add_argument('path', nargs='?')
+parser.add_argument('name', nargs='?')
+args = parser.parse_args()
+if bool(args.path) != bool(args.name):
+    parser.error('PATH and NAME go together')
+
+rotation = LocalRotation(LOCAL_DIR, RULES)
+
+# Dumps of previous versions of `backup-to-disk.sh` were written to the root
+# directory, they join the rotation
+for name in sorted(os.listdir(LOCAL_DIR)):
+    if name.startswith('postgres-') and '.pg_dump' in name \
+            and not args.dry_run:
+        print('Moving "{}" to tiers'.format(name))
+        rotation.add(os.path.join(LOCAL_DIR, name), name)
+
+if args.path and not args.dry_run:
+    for path in rotation.add(args.path, args.name):
+        print('Backup at "{}"'.format(path))
+
+for path in rotation.rotate(dry_run=args.dry_run):
+    print('{} "{}"'.format('Would delete' if args.dry_run else 'Deleted',
+                           path))
+
+distinct = {}
+for backup in rotation.get_backups():
+    distinct.setdefault(backup['name'], backup['size'])
+print('{} backups kept, {} bytes'.format(len(distinct),
+                                         sum(distinct.values())))
@@ -0,0 +1,137 @@
+# Continuous WAL archiving and point-in-time recovery of `support-postgres`.
+#
+#   wal-archive.py push [--loop SECONDS]
+#   wal-archive.py base-backup
+#   wal-archive.py list
+#   wal-archive.py restore [--target-time 'YYYY-MM-DD HH:MM:SS'] [--force]
+#
+# `restore` must run while `support-postgres` is stopped. Times are UTC.
+import argparse
+import datetime
+import os
+import sys
+import time
+
+from helpers.compressor import Compressor
+from helpers.wal_archive import WalArchive
+
+
+# `s3` or `local`
+DESTINATION = os.environ.get('POSTGRES_WAL_ARCHIVE_DESTINATION', 'local')
+# Root of the archive when `DESTINATION` is `local`
+LOCAL_ARCHIVE_DIR = os.environ.get('POSTGRES_WAL_ARCHIVE_DIR',
+                                   '/srv/wal-archive')
+# Prefix of the archive when `DESTINATION` is `s3`
+S3_PREFIX = 'postgres/wal-archive/'
+SPOOL_DIR = os.environ.get('POSTGRES_WAL_SPOOL_DIR',
+                           '/var/lib/postgresql/wal-spool')
+# Fetched WAL files are stored in the spool volume, which `support-postgres`
+# mounts at the same path
+RESTORE_DIR = os.path.join(SPOOL_DIR, 'restore')
+DATA_DIR = os.environ.get('PGDATA', '/var/lib/postgresql/data')
+DBURL = os.environ.get('SUPPORT_DATABASE_URL')
+
+PUSH_JOBS = int(os.environ.get('POSTGRES_WAL_PUSH_JOBS', 4))
+BASE_BACKUP_RETENTION = int(os.environ.get(
+    'POSTGRES_WAL_BASE_BACKUP_RETENTION', 7))
+
+COMPRESSION = os.environ.get('POSTGRES_BACKUP_COMPRESSION') or Compressor.NONE
+COMPRESSION_LEVEL = int(os.environ.get('POSTGRES_BACKUP_COMPRESSION_LEVEL')
+                        or 0) or None
+COMPRESSION_THREADS = int(os.environ.get(
+    'POSTGRES_BACKUP_COMPRESSION_THREADS') or 0)
+
+###############################################################################
+
+
+def get_archive():
+    compressor = Compressor(COMPRESSION, COMPRESSION_LEVEL,
+                            COMPRESSION_THREADS)
+    if DESTINATION == 's3':
+        from helpers.multipart_upload import UploadPool
+        from helpers.s3_client import S3Client
+
+        client = S3Client(os.environ.get('AWS_ACCESS_KEY_ID'),
+                          os.environ.get('AWS_SECRET_ACCESS_KEY'),
+                          os.environ.get('BACKUP_AWS_STORAGE_BUCKET_NAME'),
+                          region=os.environ.get('AWS_BACKUP_REGION') or None,
+                          endpoint_url=os.environ.get(
+                              'AWS_BACKUP_ENDPOINT_URL') or None)
+        chunk_size = int(os.environ.get('AWS_BACKUP_UPLOAD_CHUNK_SIZE', 15))
+        # Not closed: threads of the pool live as long as the script
+        upload_pool = UploadPool(client, chunk_size * 1024 ** 2, PUSH_JOBS)
+        return WalArchive(client, upload_pool.open, compressor, S3_PREFIX,
+                          PUSH_JOBS)
+
+    from helpers.local_storage import LocalStorage
+
+    storage = LocalStorage(LOCAL_ARCHIVE_DIR)
+    return WalArchive(storage, storage.open, compressor, jobs=PUSH_JOBS)
+
+
+def push(archive, loop):
+    while True:
+        pushed, failed = archive.push(SPOOL_DIR)
+        for filename in pushed:
+            print('Archived `{}`'.format(filename))
+        if not loop:
+            return not failed
+        time.sleep(loop)
+
+
+def base_backup(archive):
+    print('Starting base backup...')
+    info = archive.base_backup(DBURL, DATA_DIR)
+    print('Base backup `{}` done ({} to {})'.format(
+        info['label'], info['start_wal'], info['stop_wal']))
+    for key_name in archive.delete_obsolete(BASE_BACKUP_RETENTION):
+        print('Deleted obsolete `{}`'.format(key_name))
+    return True
+
+
+def list_base_backups(archive):
+    for info in archive.get_base_backups():
+        print('{label}  {start_time} - {stop_time}  {size} bytes'.format(
+            **info))
+    return True
+
+
+def restore(archive, target_time, force):
+    if target_time is not None:
+        target_time = datetime.datetime.strptime(target_time,
+                                                 '%Y-%m-%d %H:%M:%S')
+    print('Restoring to {}...'.format(target_time or 'end of archive'))
+    info = archive.restore(DATA_DIR, RESTORE_DIR, target_time, force)
+    print('Restored base backup `{}` and fetched {} WAL files.'.format(
+        info['label'], info['wal_files']))
+    print('Start `support-postgres` to replay WAL. Once recovery is over, '
+          '`{}` can be deleted.'.format(RESTORE_DIR))
+    return True
+
+
+parser = argparse.ArgumentParser()
+subparsers = parser.add_subparsers(dest='command', required=True)
+push_parser = subparsers.add_parser('push', help='send spooled WAL files')
+push_parser.add_argument('--loop', type=int, default=0, metavar='SECONDS',
+                         help='keep running, pushing every SECONDS')
+subparsers.add_parser('base-backup', help='take a base backup')
+subparsers.add_parser('list', help='list base backups')
+restore_parser = subparsers.add_parser('restore',
+                                       help='point-in-time recovery')
+restore_parser.add_argument('--target-time', metavar='"YYYY-MM-DD HH:MM:SS"',
+                            help='UTC, defaults to end of archive')
+restore_parser.add_argument('--force', action='store_true',
+                            help='overwrite existing data directory')
+args = parser.parse_args()
+
+wal_archive = get_archive()
+if args.command == 'push':
+    success = push(wal_archive, args.loop)
+elif args.command == 'base-backup':
+    success = base_backup(wal_archive)
+elif args.command == 'list':
+    success = list_base_backups(wal_archive)
+else:
+    success = restore(wal_archive, args.target_time, args.force)
+
+sys.exit(0 if success else 1)
@@ -10,7 +10,7 @@ from helpers.template import Template
 from helpers.command import Command
 from helpers.support import Support
 
-def run(force_setup=False):
+def run(force_setup=False, reconcile=False):
     if not platform.system() in ['Linux', 'Darwin']:
         CLI.colored_print('Not compatible with this OS', CLI.COLOR_ERROR)
     else:
@@ -28,13 +28,22 @@ def run(force_setup=False):
             
             # # config.init_letsencrypt()
             # # Setup.update_hosts(dict_)
+        elif reconcile:
+            # Render files again from saved configuration to detect changes
+            Template.render(config)
+
+            support = Support()
+            support.copy_support_scripts()
         else:
             print ("Running smoothly")
             # if config.auto_detect_network():
             #     Template.render(config)
             #     Setup.update_hosts(dict_)
 
-        Command.start()
+        if reconcile:
+            Command.reconcile()
+        else:
+            Command.start()
 
 if __name__ == '__main__':
    
@@ -44,12 +53,19 @@ if __name__ == '__main__':
                                    CLI.COLOR_ERROR)
         elif len(sys.argv) == 2:
             if sys.argv[1] == '-h' or sys.argv[1] == '--help':
-                Command.help()   
-                Updater.run(cron=True, update_self=update_self)
+                Command.help()
             elif sys.argv[1] == '-s' or sys.argv[1] == '--setup':
                 run(force_setup=True)
             elif sys.argv[1] == '-S' or sys.argv[1] == '--stop':
                 Command.stop()
+            elif sys.argv[1] == '-r' or sys.argv[1] == '--reconcile':
+                run(reconcile=True)
+            elif sys.argv[1] == '-p' or sys.argv[1] == '--plan':
+                Command.reconcile(dry_run=True)
+            elif sys.argv[1] == '-u' or sys.argv[1] == '--update-api':
+                Command.update_api()
+            elif sys.argv[1] == '-R' or sys.argv[1] == '--restore':
+                Command.restore()
     #         elif sys.argv[1] == '-l' or sys.argv[1] == '--logs':
     #             Command.logs()
     #         elif sys.argv[1] == '-v' or sys.argv[1] == '--version':
@@ -14,3 +14,8 @@ ${USE_AWS_BACKUP}AWS_BACKUP_YEARLY_RETENTION=${AWS_BACKUP_YEARLY_RETENTION}
 ${USE_AWS_BACKUP}AWS_BACKUP_MONTHLY_RETENTION=${AWS_BACKUP_MONTHLY_RETENTION}
 ${USE_AWS_BACKUP}AWS_BACKUP_WEEKLY_RETENTION=${AWS_BACKUP_WEEKLY_RETENTION}
 ${USE_AWS_BACKUP}AWS_BACKUP_DAILY_RETENTION=${AWS_BACKUP_DAILY_RETENTION}
+${USE_AWS_BACKUP}AWS_BACKUP_UPLOAD_CHUNK_SIZE=${AWS_BACKUP_UPLOAD_CHUNK_SIZE}
+${USE_AWS_BACKUP}AWS_BACKUP_UPLOAD_PARTS_IN_FLIGHT=${AWS_BACKUP_UPLOAD_PARTS_IN_FLIGHT}
+#Upload bandwidth in MB/s (0 for no limit), and limits by time of day (UTC)
+${USE_AWS_BACKUP}AWS_BACKUP_UPLOAD_RATE_LIMIT=${AWS_BACKUP_UPLOAD_RATE_LIMIT}
+${USE_AWS_BACKUP}AWS_BACKUP_UPLOAD_RATE_PROFILES=${AWS_BACKUP_UPLOAD_RATE_PROFILES}
@@ -3,6 +3,24 @@ POSTGRES_USER=${SUPPORT_DB_USER}
 POSTGRES_PASSWORD=${SUPPORT_DB_PASSWORD}
 
 POSTGRES_BACKUP_SCHEDULE=${POSTGRES_BACKUP_SCHEDULE}
+POSTGRES_BACKUP_DUMP_JOBS=${POSTGRES_BACKUP_DUMP_JOBS}
+POSTGRES_BACKUP_COMPRESSION=${POSTGRES_BACKUP_COMPRESSION}
+POSTGRES_BACKUP_COMPRESSION_LEVEL=${POSTGRES_BACKUP_COMPRESSION_LEVEL}
+POSTGRES_BACKUP_COMPRESSION_THREADS=${POSTGRES_BACKUP_COMPRESSION_THREADS}
+POSTGRES_BACKUP_PRIORITY=${POSTGRES_BACKUP_PRIORITY}
+POSTGRES_BACKUP_DEDUP=${POSTGRES_BACKUP_DEDUP}
+${USE_BACKUP_DEDUP}POSTGRES_BACKUP_DEDUP_CHUNK_SIZE=${POSTGRES_BACKUP_DEDUP_CHUNK_SIZE}
+${USE_BACKUP_DEDUP}POSTGRES_BACKUP_DEDUP_RETENTION=${POSTGRES_BACKUP_DEDUP_RETENTION}
+POSTGRES_BACKUP_LOCAL_YEARLY_RETENTION=${POSTGRES_BACKUP_LOCAL_YEARLY_RETENTION}
+POSTGRES_BACKUP_LOCAL_MONTHLY_RETENTION=${POSTGRES_BACKUP_LOCAL_MONTHLY_RETENTION}
+POSTGRES_BACKUP_LOCAL_WEEKLY_RETENTION=${POSTGRES_BACKUP_LOCAL_WEEKLY_RETENTION}
+POSTGRES_BACKUP_LOCAL_DAILY_RETENTION=${POSTGRES_BACKUP_LOCAL_DAILY_RETENTION}
+
+POSTGRES_WAL_ARCHIVING=${POSTGRES_WAL_ARCHIVING}
+${USE_WAL_ARCHIVING}POSTGRES_WAL_ARCHIVE_DESTINATION=${POSTGRES_WAL_ARCHIVE_DESTINATION}
+${USE_WAL_ARCHIVING}POSTGRES_WAL_BASE_BACKUP_SCHEDULE=${POSTGRES_WAL_BASE_BACKUP_SCHEDULE}
+${USE_WAL_ARCHIVING}POSTGRES_WAL_BASE_BACKUP_RETENTION=${POSTGRES_WAL_BASE_BACKUP_RETENTION}
+${USE_WAL_ARCHIVING}POSTGRES_WAL_PUSH_JOBS=${POSTGRES_WAL_PUSH_JOBS}
 
 SUPPORT_DB_SERVER=${SUPPORT_DB_SERVER}
 SUPPORT_DB_NAME=${SUPPORT_DB_NAME}
@@ -9,9 +9,18 @@ services:
       - ./database.txt
     ports:
       - "${SUPPORT_DB_PORT}:${SUPPORT_DB_INTERNAL_PORT}"
+    # Over TCP: during the first initialization, the temporary server
+    # only listens on the Unix socket
+    healthcheck:
+      test: ["CMD", "pg_isready", "-h", "127.0.0.1", "-p", "${SUPPORT_DB_INTERNAL_PORT}", "-U", "${SUPPORT_DB_USER}", "-d", "${SUPPORT_DB_NAME}"]
+      interval: 10s
+      timeout: 5s
+      retries: 6
+    ${USE_WAL_ARCHIVING}command: ["postgres", "-c", "wal_level=replica", "-c", "archive_mode=on", "-c", "archive_timeout=${POSTGRES_WAL_ARCHIVE_TIMEOUT}", "-c", "archive_command=/postgres-scripts/archive-wal.sh %p %f"]
     volumes:
       - 'support-postgres-data:/var/lib/postgresql/data'
       - ./postgres-scripts:/postgres-scripts
+      ${USE_WAL_ARCHIVING}- 'support-postgres-wal-spool:/var/lib/postgresql/wal-spool'
     networks:
       - api-network
   
@@ -37,6 +46,11 @@ services:
       - ./aws.txt
     volumes:
       - ./postgres-scripts:/postgres-scripts
+      - ./backups:/srv/backups
+      - ./logs:/srv/logs
+      ${USE_WAL_ARCHIVING}- 'support-postgres-data:/var/lib/postgresql/data'
+      ${USE_WAL_ARCHIVING}- 'support-postgres-wal-spool:/var/lib/postgresql/wal-spool'
+      ${USE_LOCAL_WAL_ARCHIVE}- ./wal-archive:/srv/wal-archive
     command: "bash ./postgres-scripts/entrypoint.sh"
     networks:
       - api-network
@@ -44,6 +58,8 @@ services:
 volumes:
   support-postgres-data:
     driver: local
+  ${USE_WAL_ARCHIVING}support-postgres-wal-spool:
+  ${USE_WAL_ARCHIVING}  driver: local
 
 networks:
   api-network:
@@ -1,6 +1,10 @@
 version: '3'
 
 services:
-  support-api:
+  support-api-proxy:
     ports:
-      - "${SUPPORT_API_PORT}:80"  
+      - "${SUPPORT_API_PORT}:8000"
+      # Idle color, checked before it receives traffic
+      - "127.0.0.1:${SUPPORT_API_ALTERNATE_PORT}:8080"
+      ${USE_HTTPS}- "80:80"
+      ${USE_HTTPS}- "443:443"
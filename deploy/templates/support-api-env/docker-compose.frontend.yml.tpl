@@ -4,13 +4,38 @@ services:
   support-api:
     image: proagenda2030/support_api:pa.v1.0.0
     hostname: support_api
-    container_name: support_api
     extra_hosts:
       - "kf.mmaya.gob.bo kc.mmaya.gob.bo ee.mmaya.gob.bo:192.168.5.151"
     restart: unless-stopped
     env_file:
       - ./database.txt
 
+  # Blue/green updates (see `run.py --update-api`): `support-api` (blue) and
+  # `support-api-green` take turns behind `support-api-proxy`. Outside
+  # updates, only one of them runs. Same definition as `support-api`.
+  # Both run `support_api_replicas` containers (`--scale`), hence no
+  # `container_name`.
+  ${USE_ROLLING_UPDATE}support-api-green:
+  ${USE_ROLLING_UPDATE}  image: proagenda2030/support_api:pa.v1.0.0
+  ${USE_ROLLING_UPDATE}  hostname: support_api
+  ${USE_ROLLING_UPDATE}  extra_hosts:
+  ${USE_ROLLING_UPDATE}    - "kf.mmaya.gob.bo kc.mmaya.gob.bo ee.mmaya.gob.bo:192.168.5.151"
+  ${USE_ROLLING_UPDATE}  restart: unless-stopped
+  ${USE_ROLLING_UPDATE}  env_file:
+  ${USE_ROLLING_UPDATE}    - ./database.txt
+
+  # Front end of the API (see `nginx/support-api.conf`). `nginx-upstream`
+  # is written by `run.py` to switch between colors.
+  support-api-proxy:
+    image: nginx:1.27-alpine
+    container_name: support_api_proxy
+    restart: unless-stopped
+    volumes:
+      - ./nginx:/etc/nginx/conf.d:ro
+      - ./nginx-upstream:/etc/nginx/upstream:ro
+      ${USE_HTTPS}- ${LETSENCRYPT_PATH}:/etc/letsencrypt:ro
+      ${USE_HTTPS}- /var/www/certbot:/var/www/certbot:ro
+
 networks:
   default:
     external:
@@ -13,6 +13,12 @@ services:
     extra_hosts:
       - "kf.mmaya.gob.bo kc.mmaya.gob.bo ee.mmaya.gob.bo:192.168.5.151"
     command: "bash /shiny-scripts/entrypoint.sh"
+    # Shiny Server accepts connections
+    healthcheck:
+      test: ["CMD", "bash", "-c", "exec 3<>/dev/tcp/127.0.0.1/3838"]
+      interval: 10s
+      timeout: 5s
+      retries: 6
     restart: always
     volumes:
       - 'shiny_logs:/var/log/shiny-server'
@@ -0,0 +1,136 @@
+# Front end of the API: balances requests between the replicas of
+# `support-api` (see `support_api_replicas`) and, when a domain is
+# configured, terminates TLS.
+# The color which receives traffic (see `run.py --update-api`) is written by
+# `run.py` in `nginx-upstream/`: `$$support_api_color` selects the upstream,
+# `$$support_api_standby` the idle color checked during updates.
+include /etc/nginx/upstream/*.conf;
+
+# Embedded DNS of Docker. Replicas are discovered, and their addresses
+# refreshed, without reloading nginx.
+resolver 127.0.0.11 valid=10s ipv6=off;
+
+# API responses are JSON, often large lists
+gzip on;
+gzip_comp_level 5;
+gzip_min_length 1024;
+gzip_proxied any;
+gzip_vary on;
+gzip_types application/json application/problem+json text/plain text/csv;
+
+# Replicas of a color answer under the name of their service. Requests go
+# to the replica with the fewest active ones: reports and exports are much
+# slower than the other endpoints.
+upstream support_api_blue {
+    zone support_api_blue 64k;
+    least_conn;
+    server support-api:80 resolve max_fails=3 fail_timeout=10s;
+    # Idle connections kept open per worker, to skip the TCP handshake
+    keepalive 32;
+    keepalive_requests 1000;
+    keepalive_timeout 60s;
+}
+
+upstream support_api_green {
+    zone support_api_green 64k;
+    least_conn;
+    server support-api-green:80 resolve max_fails=3 fail_timeout=10s;
+    keepalive 32;
+    keepalive_requests 1000;
+    keepalive_timeout 60s;
+}
+
+# No standby outside updates. nginx refuses empty upstreams.
+upstream support_api_none {
+    server 127.0.0.1:1 down;
+}
+
+server {
+    listen 8000;
+    server_tokens off;
+
+    # Allow 100M upload
+    client_max_body_size 100M;
+
+    location / {
+        proxy_pass          http://support_api_$$support_api_color;
+        # Required to reuse upstream connections
+        proxy_http_version  1.1;
+        proxy_set_header    Connection          "";
+        proxy_set_header    Host                $$http_host;
+        proxy_set_header    X-Forwarded-For     $$proxy_add_x_forwarded_for;
+    }
+}
+
+# Only published on the loopback interface
+server {
+    listen 8080;
+    server_tokens off;
+
+    client_max_body_size 100M;
+
+    # Color which receives traffic, to tell when a switch is effective
+    location = /-/color {
+        default_type text/plain;
+        return 200 $$support_api_color;
+    }
+
+    location / {
+        proxy_pass          http://support_api_$$support_api_standby;
+        proxy_http_version  1.1;
+        proxy_set_header    Connection          "";
+        proxy_set_header    Host                $$http_host;
+        proxy_set_header    X-Forwarded-For     $$proxy_add_x_forwarded_for;
+    }
+}
+
+{% if SUPPORT_API_DOMAIN %}
+server {
+    listen 80;
+    server_name ${SUPPORT_API_DOMAIN};
+    server_tokens off;
+
+    # Renewals of the certificate (webroot of certbot)
+    location /.well-known/acme-challenge/ {
+        root /var/www/certbot;
+    }
+
+    location / {
+        return 301 https://$$host$$request_uri;
+    }
+}
+
+server {
+    listen 443 ssl;
+    http2 on;
+    server_name ${SUPPORT_API_DOMAIN};
+    server_tokens off;
+
+    # Layout of certbot, see `letsencrypt.tar.gz`
+    ssl_certificate /etc/letsencrypt/live/${SUPPORT_API_DOMAIN}/fullchain.pem;
+    ssl_certificate_key /etc/letsencrypt/live/${SUPPORT_API_DOMAIN}/privkey.pem;
+    # Forward secrecy without DH parameters: ECDHE only
+    ssl_protocols TLSv1.2 TLSv1.3;
+    ssl_ciphers ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256:ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384:ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305;
+    ssl_prefer_server_ciphers off;
+    # Returning clients resume their session instead of a full handshake.
+    # 10M holds about 40000 sessions. Sessions are kept server-side: ticket
+    # keys would never be rotated.
+    ssl_session_cache shared:SSL:10m;
+    ssl_session_timeout 1d;
+    ssl_session_tickets off;
+
+    # Allow 100M upload
+    client_max_body_size 100M;
+
+    location / {
+        proxy_pass          http://support_api_$$support_api_color;
+        proxy_http_version  1.1;
+        proxy_set_header    Connection          "";
+        proxy_set_header    Host                $$http_host;
+        proxy_set_header    X-Real-IP           $$remote_addr;
+        proxy_set_header    X-Forwarded-For     $$proxy_add_x_forwarded_for;
+        proxy_set_header    X-Forwarded-Proto   https;
+    }
+}
+{% endif SUPPORT_API_DOMAIN %}